@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+import flask
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip variants are served
+    brotli = None
+
+_COMPRESSIBLE = {'.css', '.js', '.svg', '.html', '.xml', '.json', '.txt'}
+_IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class AssetManifest:
+    """Content-hashed static URLs with long-lived caching.
+
+    A file under the static folder is hashed the first time it is linked or requested, and text assets are then
+    compressed once with gzip (and brotli, if installed); both are kept for the life of the process.
+    url_for('static', ...) adds ?v=<hash> to the URL.  Requests carrying the current hash are served with an immutable
+    one-year max-age; anything else must revalidate, which the content-hash ETag turns into a 304.  Files under
+    UPLOAD_FOLDER, whose number grows with the users, are never hashed: they are served as they are and revalidate
+    on the ETag send_from_directory gives them.
+    """
+
+    def __init__(self, app=None):
+        self._versions = {}     # filename relative to the static folder -> content hash
+        self._compressed = {}   # filename -> {'br' | 'gzip': bytes}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        # UPLOAD_FOLDER is taken from the working directory, as the upload handlers do
+        uploads = app.config.get('UPLOAD_FOLDER')
+        uploads = uploads and os.path.relpath(os.path.abspath(uploads), self.static_folder).replace(os.sep, '/')
+        self.uploads = uploads if uploads and not uploads.startswith('..') else None
+        app.url_defaults(self._add_version)
+        app.view_functions['static'] = self.send_static
+
+    def version(self, filename):
+        # The content hash of a static file, or None if it is missing or an upload
+        version = self._versions.get(filename)
+        if version is None and not self._uploaded(filename):
+            path = safe_join(self.static_folder, filename)
+            if path is not None and os.path.isfile(path):
+                version = self._load(filename)
+        return version
+
+    def send_static(self, filename):
+        version = self.version(filename)
+        if version is None:
+            if not self._uploaded(filename):
+                flask.abort(404)
+            response = flask.send_from_directory(self.static_folder, filename, etag=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        encoding = self._pick_encoding(filename)
+        if encoding is None:
+            response = flask.send_from_directory(self.static_folder, filename, etag=version)
+        else:
+            response = flask.Response(self._compressed[filename][encoding],
+                                      mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(version + '-' + encoding)
+            response.make_conditional(flask.request)
+        if filename in self._compressed:
+            response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = _IMMUTABLE if flask.request.args.get('v') == version else 'no-cache'
+        return response
+
+    def _add_version(self, endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            version = self.version(values.get('filename', ''))
+            if version is not None:
+                values['v'] = version
+
+    def _uploaded(self, filename):
+        return self.uploads is not None and filename.startswith(self.uploads + '/')
+
+    def _pick_encoding(self, filename):
+        variants = self._compressed.get(filename, {})
+        accepted = flask.request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in variants and accepted[encoding]:
+                return encoding
+        return None
+
+    def _load(self, filename):
+        with open(os.path.join(self.static_folder, filename), 'rb') as f:
+            data = f.read()
+        version = hashlib.sha256(data).hexdigest()[:16]
+        compressed = {}
+        if os.path.splitext(filename)[1] in _COMPRESSIBLE and len(data) > 512:
+            compressed['gzip'] = gzip.compress(data, 9)
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data)
+        with self._lock:
+            self._versions[filename] = version
+            if compressed:
+                self._compressed[filename] = compressed
+        return version
@@ -0,0 +1,157 @@
+"""
+Generates a realistic database for the benchmarks: --users users, --posts posts spread over the last --days days,
+and votes whose count per post follows a long tail, with --heavy posts voted on by a large share of all users.
+
+The schema is taken from data/schema.sql.  Its tables are created first and filled with executemany; its indexes and
+triggers are created afterwards, and what the triggers would have maintained row by row (the search index,
+users.post_count) is then built in one pass.  upvotes and hot_score are computed from post_votes, and every migration
+is recorded as applied, so the app starts against the result as it would against a migrated database.  Users are
+user<N> with private id private<N>; posts have time-ordered ids like the app's, and the heavy posts are the newest.
+
+    python benchmarks/generate.py PATH [--users N] [--posts N] [--votes-per-post N] [--heavy N] [--seed N]
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config  # noqa: E402
+import helper  # noqa: E402
+import hot  # noqa: E402
+import migrate  # noqa: E402
+import storage  # noqa: E402
+
+BATCH = 10000  # rows per executemany
+
+
+def schema_statements(path=os.path.join(config.PATH_BASE, 'data', 'schema.sql')):
+    # (tables, rest): the CREATE TABLE statements of schema.sql, and its indexes, triggers and pragmas
+    tables, rest, statement = [], [], ''
+    with open(path) as f:
+        for line in f:
+            statement += line
+            if sqlite3.complete_statement(statement):
+                body = '\n'.join(line for line in statement.splitlines() if not line.lstrip().startswith('--'))
+                words = body.split()
+                is_table = words[:2] == ['CREATE', 'TABLE'] or words[:3] == ['CREATE', 'VIRTUAL', 'TABLE']
+                (tables if is_table else rest).append(body.strip())
+                statement = ''
+    return tables, rest
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH))
+        if not batch:
+            return
+        yield batch
+
+
+def generate(path, users=10000, posts=1000000, votes_per_post=2.0, heavy=10, days=30, seed=0, verbose=False):
+    # Writes a new database at path; returns the row counts {'users', 'posts', 'votes'}
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    # Zipf-like vocabulary, so that some words are common and others rare
+    vocabulary = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(20000)]
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    now = int(time.time())
+    start = now - days * 24 * 3600
+
+    def log(message):
+        if verbose:
+            print('%6.1f s  %s' % (time.perf_counter() - started, message))
+    started = time.perf_counter()
+
+    tables, rest = schema_statements()
+    conn = sqlite3.connect(path, isolation_level=None)
+    # nothing to protect until the file is complete
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('BEGIN')
+    for statement in tables:
+        conn.execute(statement)
+
+    conn.executemany('INSERT INTO users (username, private_id, authenticated, hasProfilePic) VALUES (?, ?, 0, 0)',
+                     (('user%d' % i, 'private%d' % i) for i in range(users)))
+    log('%d users' % users)
+
+    def timestamp(i):
+        return start + (now - start) * i // posts
+
+    def post_id(i):
+        first = -(-(timestamp(i) - start) * posts // (now - start))  # the first post made in the same second
+        return helper.post_id_for(timestamp(i), i - first)
+
+    def post_rows():
+        for i in range(posts):
+            yield (post_id(i), ' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(3, 10))),
+                   ' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(10, 120))),
+                   'user%d' % rng.randrange(users), timestamp(i))
+    for n, batch in enumerate(_batches(post_rows()), 1):
+        conn.executemany('INSERT INTO posts (post_id, title, content, username, timestamp, upvotes) '
+                         'VALUES (?, ?, ?, ?, ?, 0)', batch)
+        if n % 10 == 0:
+            log('%d posts' % (n * BATCH))
+    log('%d posts' % posts)
+
+    def vote_rows():
+        for i in range(posts - heavy):
+            # geometric number of voters with the requested mean, so most posts have a few and some have many
+            count = int(rng.expovariate(1 / votes_per_post)) if votes_per_post else 0
+            for username in {'user%d' % rng.randrange(users) for _ in range(count)}:
+                yield post_id(i), username, 1 if rng.random() < 0.8 else -1
+        for i in range(posts - heavy, posts):
+            for u in rng.sample(range(users), users // 2):
+                yield post_id(i), 'user%d' % u, 1 if rng.random() < 0.9 else -1
+    votes = 0
+    for batch in _batches(vote_rows()):
+        conn.executemany('INSERT INTO post_votes (post_id, username, direction) VALUES (?, ?, ?)', batch)
+        votes += len(batch)
+    log('%d votes' % votes)
+
+    for statement in rest:
+        conn.execute(statement)
+    log('indexes and triggers')
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    log('search index')
+    conn.execute('UPDATE users SET post_count = (SELECT count(*) FROM posts WHERE posts.username = users.username)')
+    conn.execute('UPDATE posts SET upvotes = (SELECT total(direction) FROM post_votes '
+                 'WHERE post_votes.post_id = posts.post_id)')
+    conn.create_function('hot_score', 3, hot.score, deterministic=True)
+    conn.execute(hot.REFRESH, hot.refresh_params(now, 0))
+    log('counts and scores')
+    migrate.applied_versions(conn)
+    conn.executemany("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, strftime('%s', 'now'))",
+                     [(version, name) for version, name, _ in migrate.migrations()])
+    conn.execute('COMMIT')
+    conn.close()
+    # the app runs the file in WAL mode
+    storage.connect(path).close()
+    log('done')
+    return {'users': users, 'posts': posts, 'votes': votes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--votes-per-post', type=float, default=2.0)
+    parser.add_argument('--heavy', type=int, default=10, help='posts voted on by half of all users')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    counts = generate(args.path, args.users, args.posts, args.votes_per_post, args.heavy, args.days, args.seed,
+                      verbose=True)
+    print('generated %(users)d users, %(posts)d posts and %(votes)d votes' % counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Load benchmark of the app's routes on a database made by generate.py: the feeds, profiles, posts (ordinary and
+heavily voted), search, the vote endpoints and the TSV exports.  Each route is requested --requests times as random
+users, through the Flask test client or, with --http, over HTTP from --processes processes against a threaded server
+in another process.  For each route it reports p50/p99 latency, throughput and the number of SQL statements per
+request, and --output saves the results as JSON, which --baseline compares a later run against.  The vote requests
+are really cast, so the database drifts a little from run to run.
+
+    python benchmarks/routes.py DATABASE [--requests N] [--http] [--processes N] [--output FILE] [--baseline FILE]
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import helper  # noqa: E402
+
+CASE_HEADER = 'X-Benchmark-Case'
+DUMP_REQUESTS = 3  # the TSV exports of whole tables are slow on large databases
+
+
+def plan(database, requests, seed=0):
+    # {case: [(method, path, body, private_id)]}, drawn from what is in the database
+    rng = random.Random(seed)
+    conn = sqlite3.connect('file:%s?mode=ro' % database, uri=True)
+    users = conn.execute('SELECT max(rowid) FROM users').fetchone()[0]
+    posts = conn.execute('SELECT max(rowid) FROM posts').fetchone()[0]
+    # the heavy posts are voted on by half of all users, far more than any other post
+    heavy = [post_id for (post_id,) in conn.execute('SELECT post_id FROM posts WHERE upvotes > '
+                                                    '(SELECT count(*) FROM users) / 10')]
+
+    def private_id():
+        return conn.execute('SELECT private_id FROM users WHERE rowid = ?', (rng.randint(1, users),)).fetchone()[0]
+
+    def post():
+        return conn.execute('SELECT post_id, title FROM posts WHERE rowid = ?',
+                            (rng.randint(1, posts),)).fetchone()
+
+    def older(private_id):
+        return '/%s/feed?older=%s' % (private_id, helper.encode_cursor(post()[0]))
+
+    def vote_body(post_id):
+        return json.dumps({'postid': post_id})
+
+    cases = {
+        'feed': lambda p: ('GET', '/%s/feed' % p, None),
+        'feed_deep': lambda p: ('GET', older(p), None),
+        'feed_hot': lambda p: ('GET', '/%s/feed?sort=hot' % p, None),
+        'api_feed': lambda p: ('GET', '/api/feed', None),
+        'profile': lambda p: ('GET', '/%s/profile' % p, None),
+        'post_view': lambda p: ('GET', '/post/%s' % post()[0], None),
+        'post_view_heavy': lambda p: ('GET', '/post/%s' % rng.choice(heavy), None),
+        'search': lambda p: ('GET', '/search?q=%s' % post()[1].split()[0], None),
+        'upvote': lambda p: ('POST', '/upvote', vote_body(post()[0])),
+        'upvote_heavy': lambda p: ('POST', '/upvote', vote_body(rng.choice(heavy))),
+        'downvote': lambda p: ('POST', '/downvote', vote_body(post()[0])),
+        'tsv_users': lambda p: ('GET', '/getTSVfile/users', None),
+        'tsv_posts': lambda p: ('GET', '/getTSVfile/posts', None),
+    }
+    planned = {}
+    for case, make in cases.items():
+        count = min(requests, DUMP_REQUESTS) if case.startswith('tsv_') else requests
+        planned[case] = []
+        for _ in range(count):
+            p = private_id()
+            planned[case].append(make(p) + (p,))
+    conn.close()
+    return planned
+
+
+def build_app(database):
+    # The app against database, recording how many SQL statements each request issues
+    import flask
+    import main
+    from sqlalchemy import event
+
+    app = main.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(database),
+                           'HOT_REFRESH_SECONDS': 0, 'LIVE_VOTES_ENABLED': False})
+    app.config['SESSION_SERIALIZER'] = app.session_interface.get_signing_serializer(app)
+    current = threading.local()
+    app.query_counts = {}  # case -> [statements per request]
+
+    def count(*args):
+        current.count = getattr(current, 'count', 0) + 1
+    event.listen(main.db.get_engine(app), 'before_cursor_execute', count)
+    event.listen(main.storage.read_engine, 'before_cursor_execute', count)
+
+    def start():
+        current.count = 0
+
+    def finish(response):
+        # streamed responses keep querying until they are closed
+        case = flask.request.headers.get(CASE_HEADER)
+        response.call_on_close(lambda: app.query_counts.setdefault(case, []).append(current.count))
+        return response
+
+    app.before_request_funcs.setdefault(None, []).insert(0, start)
+    app.after_request(finish)
+    app.add_url_rule('/benchmark/queries', 'benchmark_queries', lambda: json.dumps(app.query_counts))
+    return app
+
+
+def session_cookie(app, private_id):
+    return 'session=' + app.config['SESSION_SERIALIZER'].dumps({'_user_id': private_id, '_fresh': True})
+
+
+def summarize(latencies, elapsed, errors, queries):
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return {'requests': len(latencies), 'errors': errors, 'p50_ms': percentile(0.5), 'p99_ms': percentile(0.99),
+            'mean_ms': statistics.mean(latencies) * 1000, 'throughput_rps': len(latencies) / elapsed,
+            'queries_mean': statistics.mean(queries) if queries else None,
+            'queries_max': max(queries) if queries else None}
+
+
+def run_client(database, planned):
+    app = build_app(database)
+    client = app.test_client(use_cookies=False)
+    cookies = {}
+    results = {}
+    for case, requests in planned.items():
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for method, path, body, private_id in requests:
+            if private_id not in cookies:
+                cookies[private_id] = session_cookie(app, private_id)
+            start = time.perf_counter()
+            response = client.open(path, method=method, data=body,
+                                   headers={'Cookie': cookies[private_id], CASE_HEADER: case})
+            response.get_data()
+            response.close()
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+        results[case] = summarize(latencies, time.perf_counter() - started, errors, app.query_counts.get(case))
+    return results
+
+
+def _serve(database, port):
+    from werkzeug.serving import make_server
+    make_server('127.0.0.1', port, build_app(database), threaded=True).serve_forever()
+
+
+def _load(args):
+    # One load process: sends its share of a case's requests one after another, returns (latencies, errors)
+    port, case, requests, cookies = args
+    latencies, errors = [], 0
+    for method, path, body, private_id in requests:
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request(method, path, body=body, headers={'Cookie': cookies[private_id], CASE_HEADER: case})
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        latencies.append(time.perf_counter() - start)
+        errors += response.status >= 400
+    return latencies, errors
+
+
+def run_http(database, planned, processes):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = multiprocessing.Process(target=_serve, args=(database, port), daemon=True)
+    server.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    app = build_app(database)  # only to sign session cookies
+    results = {}
+    try:
+        with multiprocessing.Pool(processes) as pool:
+            for case, requests in planned.items():
+                cookies = {p: session_cookie(app, p) for _, _, _, p in requests}
+                shares = [(port, case, requests[i::processes], cookies) for i in range(processes)]
+                started = time.perf_counter()
+                done = pool.map(_load, [share for share in shares if share[2]])
+                elapsed = time.perf_counter() - started
+                results[case] = (sum((latencies for latencies, _ in done), []), elapsed,
+                                 sum(errors for _, errors in done))
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/benchmark/queries')
+        query_counts = json.loads(conn.getresponse().read())
+        conn.close()
+    finally:
+        server.terminate()
+    return {case: summarize(latencies, elapsed, errors, query_counts.get(case))
+            for case, (latencies, elapsed, errors) in results.items()}
+
+
+def report(results, baseline=None):
+    print('%-16s %8s %6s %10s %10s %10s %8s %8s' % ('route', 'requests', 'errors', 'p50 ms', 'p99 ms', 'req/s',
+                                                     'queries', 'max q'))
+    for case, r in results.items():
+        line = '%-16s %8d %6d %10.2f %10.2f %10.1f %8s %8s' % (
+            case, r['requests'], r['errors'], r['p50_ms'], r['p99_ms'], r['throughput_rps'],
+            '-' if r['queries_mean'] is None else '%.1f' % r['queries_mean'],
+            '-' if r['queries_max'] is None else r['queries_max'])
+        if baseline and case in baseline:
+            line += '   p50 %+.0f%%, p99 %+.0f%%' % (100 * (r['p50_ms'] / baseline[case]['p50_ms'] - 1),
+                                                   100 * (r['p99_ms'] / baseline[case]['p99_ms'] - 1))
+        print(line)
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('database')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--http', action='store_true', help='load a server over HTTP instead of the test client')
+    parser.add_argument('--processes', type=int, default=4, help='load processes with --http')
+    parser.add_argument('--routes', help='comma-separated routes to run (default: all)')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    planned = plan(args.database, args.requests)
+    if args.routes:
+        planned = {case: planned[case] for case in args.routes.split(',')}
+    if args.http:
+        results = run_http(args.database, planned, args.processes)
+    else:
+        results = run_client(args.database, planned)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['mode'] != ('http' if args.http else 'client'):
+            print('note: the baseline was run in %s mode' % saved['mode'])
+        baseline = saved['routes']
+    report(results, baseline)
+    if args.output:
+        conn = sqlite3.connect('file:%s?mode=ro' % args.database, uri=True)
+        counts = {table: conn.execute('SELECT count(*) FROM %s' % table).fetchone()[0]
+                  for table in ('users', 'posts', 'post_votes')}
+        conn.close()
+        with open(args.output, 'w') as f:
+            json.dump({'commit': commit(), 'time': int(time.time()), 'mode': 'http' if args.http else 'client',
+                       'processes': args.processes if args.http else 1, 'python': sys.version.split()[0],
+                       'sqlite': sqlite3.sqlite_version, 'database': counts, 'routes': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the FTS5 search behind /search with a naive LIKE '%q%' scan over posts.title and posts.content, on a
+generated database of --posts posts.  Both fetch the first page (10 rows) for each query.  The LIKE scan walks posts
+newest first and stops after 10 hits, so it is quick for common words and slow for rare ones; the FTS5 query has to
+score every match to rank them, so it is the other way round.
+
+    python benchmarks/search.py [--posts N] [--runs N]
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import migrate  # noqa: E402
+import search  # noqa: E402
+import storage  # noqa: E402
+
+LIKE = ("SELECT post_id, title, content, username, timestamp, upvotes FROM posts "
+        "WHERE title LIKE :like OR content LIKE :like ORDER BY timestamp DESC LIMIT :limit")
+
+
+def make_database(path, posts, seed=0):
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    # Zipf-like vocabulary, so that some words are common and others rare
+    vocabulary = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(20000)]
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    migrate.upgrade(path)
+    conn = storage.connect(path)
+    conn.executemany('INSERT INTO users (username, private_id, authenticated, hasProfilePic) VALUES (?, ?, 0, 0)',
+                     [('user%d' % i, 'private%d' % i) for i in range(100)])
+    conn.executemany('INSERT INTO posts (post_id, title, content, username, timestamp, upvotes) '
+                     'VALUES (?, ?, ?, ?, ?, 0)',
+                     [('post%d' % i, ' '.join(rng.choices(vocabulary, cum_weights=weights, k=5)),
+                       ' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(10, 120))),
+                       'user%d' % (i % 100), 1600000000 + i) for i in range(posts)])
+    conn.commit()
+    conn.close()
+    return vocabulary
+
+
+def timed(conn, sql, params, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'database.db')
+        start = time.perf_counter()
+        vocabulary = make_database(path, args.posts)
+        print('generated %d posts in %.1f s' % (args.posts, time.perf_counter() - start))
+        queries = [vocabulary[0], vocabulary[50], vocabulary[5000], vocabulary[3] + ' ' + vocabulary[40],
+                   vocabulary[19999][:3]]
+        conn = storage.connect(path)
+        print('%-24s %8s %12s %12s %8s' % ('query', 'matches', 'fts5 ms', 'like ms', 'speedup'))
+        for q in queries:
+            fts_ms, _ = timed(conn, search.QUERY_FIRST, {'match': search.match_expression(q), 'limit': 10}, args.runs)
+            # LIKE only handles a single phrase; for several words it looks for them next to each other
+            like_ms, _ = timed(conn, LIKE, {'like': '%' + q + '%', 'limit': 10}, args.runs)
+            matches = conn.execute('SELECT count(*) FROM posts_fts WHERE posts_fts MATCH ?',
+                                   (search.match_expression(q),)).fetchone()[0]
+            print('%-24s %8d %12.2f %12.2f %7.1fx' % (q, matches, fts_ms, like_ms, like_ms / fts_ms))
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Cost of safe_serialization.py as a cache value codec: decoding with safe_eval and safe_eval_many against the two-pass
+safe_eval it replaced (check the syntax tree, then eval the string) and ast.literal_eval, and encoding with safe_repr,
+before and after, against repr.  Strings are also encoded on their own, where safe_repr answers from its memo once they
+repeat.  The values are shaped like what the app caches: feed pages of post rows, users, and datetimes.
+
+    python benchmarks/serialization.py [--values N] [--runs N]
+"""
+import argparse
+import ast
+import datetime
+import os
+import random
+import sys
+import time
+import types
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import safe_serialization  # noqa: E402
+
+# safe_eval and safe_repr as this module had them before, kept here for comparison.  Keywords and unary minus are let through, which
+# it refused, so that it can read Python 3 timedelta reprs and negative numbers.
+_NODES = tuple(getattr(ast, name) for name in ('Module', 'Expr', 'Dict', 'Attribute', 'Name', 'Load', 'List',
+                                               'Tuple', 'Constant', 'keyword', 'UnaryOp', 'USub'))
+_GLOBALS = {'__builtins__': types.ModuleType('dummy_builtins_module'), 'datetime': datetime,
+            'True': True, 'False': False, 'None': None}
+
+
+def legacy_safe_eval(s):
+    tree = ast.parse(s)
+    for node in ast.walk(tree):
+        if isinstance(node, _NODES):
+            continue
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.value.id == 'datetime' \
+                and node.func.attr in ('datetime', 'date', 'time', 'timedelta'):
+            continue
+        raise ValueError(s)
+    return eval(s, _GLOBALS, _GLOBALS)
+
+
+_SIMPLE = (int, float, bool, type(None), datetime.datetime, datetime.date, datetime.time, datetime.timedelta, str,
+           bytes)
+
+
+def legacy_is_simple(o):
+    if isinstance(o, _SIMPLE):
+        return True
+    if type(o) in (tuple, list):
+        return all(legacy_is_simple(v) for v in o)
+    if type(o) is dict:
+        return all(legacy_is_simple(k) and legacy_is_simple(v) for k, v in o.items())
+    return False
+
+
+def legacy_safe_repr(o):
+    if legacy_is_simple(o):
+        return repr(o)
+    raise ValueError(o)
+
+
+def make_values(count, seed=0):
+    rng = random.Random(seed)
+    words = ['word%d' % i for i in range(500)]
+    now = datetime.datetime(2024, 5, 1, 12, 0)
+
+    def post():
+        return ('post%07d' % rng.randrange(10 ** 6), ' '.join(rng.choices(words, k=6)),
+                ' '.join(rng.choices(words, k=40)), 'user%d' % rng.randrange(10000), 1700000000 + rng.randrange(10 ** 7),
+                rng.randrange(-5, 500))
+    kinds = [
+        lambda: [post() for _ in range(5)],                               # a feed page
+        lambda: {'username': 'user%d' % rng.randrange(10000), 'private_id': 'private%d' % rng.randrange(10000),
+                 'authenticated': True, 'hasProfilePic': False, 'profilePicName': ''},
+        lambda: (now + datetime.timedelta(seconds=rng.randrange(10 ** 6)), datetime.timedelta(days=rng.randrange(30))),
+        lambda: ' '.join(rng.choices(words, k=40)),                     # a post's content
+    ]
+    return [kinds[i % len(kinds)]() for i in range(count)]
+
+
+def timed(func, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--values', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore', DeprecationWarning)
+
+    values = make_values(args.values)
+    encoded = [safe_serialization.safe_repr(value) for value in values]
+    assert safe_serialization.safe_eval_many(encoded) == values
+    assert [legacy_safe_eval(s) for s in encoded] == values
+    plain = [s for s in encoded if 'datetime' not in s]  # what ast.literal_eval can read
+    strings = [value for value in values if type(value) is str]
+
+    rows = [
+        ('decode: two-pass safe_eval (before)', len(encoded), lambda: [legacy_safe_eval(s) for s in encoded]),
+        ('decode: safe_eval', len(encoded), lambda: [safe_serialization.safe_eval(s) for s in encoded]),
+        ('decode: safe_eval_many', len(encoded), lambda: safe_serialization.safe_eval_many(encoded)),
+        ('decode: ast.literal_eval (no datetimes)', len(plain), lambda: [ast.literal_eval(s) for s in plain]),
+        ('encode: repr', len(values), lambda: [repr(value) for value in values]),
+        ('encode: safe_repr (before)', len(values), lambda: [legacy_safe_repr(value) for value in values]),
+        ('encode: safe_repr', len(values), lambda: [safe_serialization.safe_repr(value) for value in values]),
+        ('encode: repr, strings only', len(strings), lambda: [repr(value) for value in strings]),
+        ('encode: safe_repr, strings only', len(strings),
+         lambda: [safe_serialization.safe_repr(value) for value in strings]),
+    ]
+    print('%-42s %12s %14s' % ('', 'us/value', 'values/s'))
+    for name, count, func in rows:
+        elapsed = timed(func, args.runs)
+        print('%-42s %12.2f %14.0f' % (name, elapsed / count * 1e6, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Cold-start time of the app: each run is a fresh interpreter that imports main, builds the app with create_app() and
+serves its first request.  Runs are repeated with and without the Jinja bytecode cache, and once reflecting the
+schema the way main.py used to at import, for comparison.
+
+    python benchmarks/startup.py [--runs N] [--database PATH]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+settings = json.loads(sys.argv[1])
+reflect = settings.pop('reflect', False)
+app = main.create_app(settings)
+created = time.perf_counter()
+if reflect:
+    from sqlalchemy.ext.automap import automap_base
+    with app.app_context():
+        automap_base().prepare(autoload_with=main.db.engine)
+reflected = time.perf_counter()
+response = app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported, 'reflect': reflected - created,
+                  'first_request': served - reflected, 'total': served - start}))
+'''
+
+
+def run(settings, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', CHILD, json.dumps(settings)], cwd=ROOT, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {phase: statistics.median(sample[phase] for sample in samples) * 1000 for phase in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database', help='database to start against (default: the one in config.py)')
+    args = parser.parse_args()
+
+    settings = {}
+    if args.database:
+        settings['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(args.database)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cases = [
+            ('factory', settings),
+            ('factory + bytecode cache', dict(settings, TEMPLATE_BYTECODE_CACHE=cache_dir)),
+            ('factory + reflection', dict(settings, reflect=True)),
+        ]
+        run(cases[1][1], 1)  # fills the bytecode cache
+        results = {name: run(case, args.runs) for name, case in cases}
+
+    phases = ('import', 'create_app', 'reflect', 'first_request', 'total')
+    print('median ms over %d runs' % args.runs)
+    print('%-28s' % '' + ''.join('%14s' % phase for phase in phases))
+    for name, timings in results.items():
+        print('%-28s' % name + ''.join('%14.1f' % timings[phase] for phase in phases))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,15 @@ _STATIC_DIR = "static"
 
 PATH_BASE = os.path.dirname(os.path.abspath(__file__))
 PATH_DATABASE = _in_base(_DATA_DIR, "database.db")
+PATH_VOTE_LOG = _in_base(_DATA_DIR, "vote_intents.log")
 PATH_CONSENT_HTML = _in_base(_STATIC_DIR, "consent_form.html")
 
+# SQLite tuning, applied to every connection by storage.py
+SQLITE_JOURNAL_MODE    = "wal"
+SQLITE_SYNCHRONOUS     = "normal"            # with WAL, only the last commits can be lost on power failure
+SQLITE_CACHE_SIZE      = -16000              # negative = KiB of page cache per connection
+SQLITE_MMAP_SIZE       = 256 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT_MS = 5000                # how long a connection waits for a lock before "database is locked"
+SQLITE_READ_POOL_SIZE  = 8                   # read-only connections per process
+
 del os, sys  # keep namespace clean
@@ -0,0 +1,65 @@
+"""
+Fixtures shared by the test modules: one small migrated database with a running app, created once per session.
+"""
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+from sqlalchemy import event
+
+import helper
+import migrate
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+T0 = int(time.time()) - 3600  # timestamp of the first seeded post, recent enough for hot scores
+POST_IDS = [helper.post_id_for(T0 + i, 0) for i in range(200)]  # the seeded posts, one per second
+
+
+@pytest.fixture(scope='session')
+def app_env(tmp_path_factory):
+    # (main, app, database path, statements): 20 users, user<i> with private id private<i>, and 200 posts, POST_IDS[i]
+    # by user<i % 20>; statements collects the (statement, parameters) of every SQL statement the app runs
+    db_path = str(tmp_path_factory.mktemp('plans') / 'database.db')
+    migrate.upgrade(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO users (username, private_id, authenticated, hasProfilePic) VALUES (?, ?, 0, 0)',
+                     [('user%d' % i, 'private%d' % i) for i in range(20)])
+    conn.executemany('INSERT INTO posts (post_id, title, content, username, timestamp, upvotes) '
+                     'VALUES (?, ?, ?, ?, ?, 0)',
+                     [(POST_IDS[i], 'title %d' % i, 'content %d' % i, 'user%d' % (i % 20), T0 + i)
+                      for i in range(200)])
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+    sys.path.insert(0, ROOT)
+    import main
+    app = main.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path, 'HOT_REFRESH_SECONDS': 0,
+                           'LIVE_VOTES_PORT': 0, 'LIVE_VOTES_INTERVAL': 0.1,
+                           # deep feed pages are still read from the database
+                           'RECENT_POSTS_SIZE': 50, 'RECENT_POSTS_CHECK_MS': 0})
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    for engine in (main.db.get_engine(app), main.storage.read_engine):
+        event.listen(engine, 'before_cursor_execute', record)
+
+    return main, app, db_path, statements
+
+
+@pytest.fixture
+def logged_in_client(app_env):
+    # logged_in_client(private_id) is a test client logged in as that user; votes toggle, so tests that vote on the
+    # same posts log in as different users
+    app = app_env[1]
+
+    def login(private_id='private0'):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = private_id
+            session['_fresh'] = True
+        return client
+    return login
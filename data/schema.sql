@@ -1,11 +1,15 @@
 pragma foreign_keys = ON;
 
+-- The complete current schema.  Existing databases are brought up to date by the files in migrations/ (see
+-- migrate.py); keep this file equal to the result of applying all of them.
+
 CREATE TABLE IF NOT EXISTS users (
     username text primary key,
     private_id text,
     authenticated boolean,
     hasProfilePic boolean,
-    profilePicName text
+    profilePicName text,
+    post_count int NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS posts (
@@ -15,7 +19,68 @@ CREATE TABLE IF NOT EXISTS posts (
     username text,
     timestamp int,
     upvotes int,
+    -- legacy comma-separated voter lists, superseded by post_votes
     upvoters text default '',
     downvoters text default '',
+    -- time-decayed score behind the hot feed, kept up to date by votes and hot.py
+    hot_score real NOT NULL DEFAULT 0,
+    -- bumped whenever the post or its votes change; the JSON API builds its ETags from it
+    version int NOT NULL DEFAULT 1,
     FOREIGN KEY(username) REFERENCES users(username)
 );
+
+-- user_loader, profile() and create_submit look users up by private_id
+CREATE INDEX IF NOT EXISTS users_private_id ON users(private_id);
+
+-- post ids sort in the order posts were made (see helper.PostIds), so feed pages are read newest first in post_id
+-- order; username and version make the index covering for the ETags of /api/feed and /api/post/<post_id>
+CREATE INDEX IF NOT EXISTS posts_post_id_version ON posts(post_id, version, username);
+
+-- hot feed pages are read highest score first
+CREATE INDEX IF NOT EXISTS posts_hot ON posts(hot_score DESC, post_id DESC, username, version);
+
+-- profile pages list one user's posts newest first
+CREATE INDEX IF NOT EXISTS posts_username_post_id ON posts(username, post_id);
+
+-- users.post_count follows inserts and deletes so profile pages never count posts
+CREATE TRIGGER IF NOT EXISTS posts_count_insert AFTER INSERT ON posts BEGIN
+    UPDATE users SET post_count = post_count + 1 WHERE username = NEW.username;
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_count_delete AFTER DELETE ON posts BEGIN
+    UPDATE users SET post_count = post_count - 1 WHERE username = OLD.username;
+END;
+
+-- the ids that posts had before they were given time-ordered ones, for links to them made before
+CREATE TABLE IF NOT EXISTS post_id_aliases (
+    old_id text primary key,
+    post_id text NOT NULL
+);
+
+-- one row per (post, user) vote; direction is 1 for an upvote, -1 for a downvote
+CREATE TABLE IF NOT EXISTS post_votes (
+    post_id text,
+    username text,
+    direction int,
+    PRIMARY KEY(post_id, username),
+    FOREIGN KEY(post_id) REFERENCES posts(post_id) ON DELETE CASCADE,
+    FOREIGN KEY(username) REFERENCES users(username)
+);
+
+-- full-text index over post titles and contents for /search.  The text itself stays in posts (external content);
+-- posts_fts rows share the rowid of their post and are kept in step by the triggers below.
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, content, content='posts', content_rowid='rowid',
+                                                        tokenize='unicode61 remove_diacritics 2');
+
+CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', OLD.rowid, OLD.title, OLD.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, content ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', OLD.rowid, OLD.title, OLD.content);
+    INSERT INTO posts_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+END;
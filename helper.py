@@ -3,7 +3,23 @@ import base64
 from datetime import timezone
 import datetime
 import math
-from PIL import Image
+import os
+import re
+import threading
+import time
+from PIL import Image, ImageOps, features
+
+PROFILE_PIC_SIZES = (40, 80, 200)
+
+# Post ids are 12 characters of POST_ID_ALPHABET, whose characters are URL-safe and in ASCII order, so that ids sort
+# as strings in the order they were made.  They encode 72 bits: milliseconds since the epoch (42 bits, until 2109),
+# the process id of the worker that made it (22 bits, Linux's largest pid_max) and a sequence number within the
+# millisecond (8 bits).  Worker 0 is left to the posts given new ids by migration 0009.
+POST_ID_ALPHABET = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+POST_ID_LENGTH = 12
+_WORKER_BITS = 22
+_SEQUENCE_BITS = 8
+_POST_ID = re.compile('[%s]{%d}' % (re.escape(POST_ID_ALPHABET), POST_ID_LENGTH))
 
 
 def hash_string(string: str) -> str:
@@ -12,6 +28,64 @@ def hash_string(string: str) -> str:
     return b64[:len(b64) - 2]
 
 
+def make_post_id(ms: int, worker: int = 0, sequence: int = 0) -> str:
+    n = (ms << (_WORKER_BITS + _SEQUENCE_BITS)) | (worker << _SEQUENCE_BITS) | sequence
+    chars = []
+    for _ in range(POST_ID_LENGTH):
+        chars.append(POST_ID_ALPHABET[n & 63])
+        n >>= 6
+    return ''.join(reversed(chars))
+
+
+def post_id_for(timestamp: int, index: int) -> str:
+    # The id given to an older post made at timestamp (in seconds), index being the number of posts before it in
+    # the same second.  The first 256 share the second's first millisecond, the next 256 the one after, and so on.
+    return make_post_id(timestamp * 1000 + (index >> _SEQUENCE_BITS), 0, index & ((1 << _SEQUENCE_BITS) - 1))
+
+
+def is_post_id(post_id: str) -> bool:
+    # Whether post_id has the form of the ids made by PostIds, rather than that of the ids before migration 0009
+    return _POST_ID.fullmatch(post_id) is not None
+
+
+def post_id_time(post_id: str):
+    # Milliseconds since the epoch at which post_id was made, or None if it is not a post id made by PostIds
+    if not is_post_id(post_id):
+        return None
+    n = 0
+    for char in post_id:
+        n = n << 6 | POST_ID_ALPHABET.index(char)
+    return n >> (_WORKER_BITS + _SEQUENCE_BITS)
+
+
+class PostIds:
+    """Generator of post ids, safe to call from several threads.
+
+    Ids never repeat within a process, since the millisecond never goes backwards, and never across processes on
+    one host, since each carries its pid.  More than 256 ids in one millisecond borrow the next one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ms = 0
+        self._sequence = 0
+
+    def __call__(self) -> str:
+        with self._lock:
+            ms = time.time_ns() // 1000000
+            if ms > self._ms:
+                self._ms, self._sequence = ms, 0
+            elif self._sequence < (1 << _SEQUENCE_BITS) - 1:
+                self._sequence += 1
+            else:
+                self._ms, self._sequence = self._ms + 1, 0
+            ms, sequence = self._ms, self._sequence
+        return make_post_id(ms, os.getpid(), sequence)
+
+
+new_post_id = PostIds()
+
+
 def get_timestamp() -> int:
     dt = datetime.datetime.now(timezone.utc)
     utc_time = dt.replace(tzinfo=timezone.utc)
@@ -19,12 +93,39 @@ def get_timestamp() -> int:
     return math.floor(utc_timestamp)
 
 
+def encode_cursor(*key) -> str:
+    # key is the sort key of a post: its post id alone for the newest-first feed, which is URL-safe as it is, or its
+    # hot score and post id for the hot feed
+    if len(key) == 1:
+        return key[0]
+    score, post_id = key
+    return base64.urlsafe_b64encode((str(score) + ':' + post_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, key_type=None):
+    # returns the sort key, (post_id,) when key_type is None and (score, post_id) otherwise, or None if the cursor
+    # was not made by encode_cursor
+    if key_type is None:
+        return (cursor,) if is_post_id(cursor) else None
+    if len(cursor) > 64:  # far longer than any score and post id
+        return None
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        key, post_id = decoded.split(':', 1)
+        key = key_type(key)
+    except ValueError:
+        return None
+    if not is_post_id(post_id) or not math.isfinite(key):
+        return None
+    return key, post_id
+
+
 def time_string(post_timestamp: int) -> str:
     now = get_timestamp()
     diff = now - post_timestamp
     if diff < 60:
         return 'Posted just now'
-    elif 60 < diff < (60 * 60):
+    elif diff < (60 * 60):
         if math.floor(diff/60) == 1:
             return 'Posted 1 minute ago'
         return 'Posted ' + str(math.floor(diff / 60)) + ' minutes ago'
@@ -45,12 +146,45 @@ def time_string(post_timestamp: int) -> str:
             return 'Posted ' + str(diff_hours) + ' hours ago'
 
 
+def is_image(file) -> bool:
+    # Whether the file object holds a picture Pillow can read, without decoding it all; rewinds the file
+    try:
+        with Image.open(file) as im:
+            im.verify()
+        return True
+    except Exception:  # Pillow raises a variety of errors for files it cannot parse
+        return False
+    finally:
+        file.seek(0)
+
+
 def make_img_square(filename):
     im = Image.open(filename)
     im = crop_max_square(im)
     im.save(filename)
 
 
+def make_profile_pic_derivatives(filename, sizes=PROFILE_PIC_SIZES) -> list:
+    # Saves <name>_<size>.jpg, plus .webp where Pillow supports it, next to the uploaded picture, cropped to a square.
+    # Files are written smallest first and each one is renamed into place, so once the largest .jpg exists the set is
+    # complete.  Runs in a worker process.
+    im = ImageOps.exif_transpose(Image.open(filename))
+    im = crop_max_square(im).convert('RGB')
+    stem = os.path.splitext(filename)[0]
+    formats = [('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True})]
+    if features.check('webp'):
+        formats.insert(0, ('WEBP', 'webp', {'quality': 80, 'method': 4}))
+    written = []
+    for size in sorted(sizes):
+        thumb = im.resize((size, size), Image.LANCZOS)
+        for image_format, extension, options in formats:
+            path = '%s_%d.%s' % (stem, size, extension)
+            thumb.save(path + '.tmp', format=image_format, **options)
+            os.replace(path + '.tmp', path)
+            written.append(path)
+    return written
+
+
 def crop_center(pil_img, crop_width, crop_height):
     img_width, img_height = pil_img.size
     return pil_img.crop(((img_width - crop_width) // 2,
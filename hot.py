@@ -0,0 +1,116 @@
+"""
+"Hot" ranking of posts for /<private_id>/feed?sort=hot.
+
+posts.hot_score holds score(upvotes, timestamp, now) as of the last time the post was voted on or refreshed, and the
+posts_hot index serves hot feed pages in that order.  Votes rescore their post straight away; HotRefresher rescores
+the recent posts every HOT_REFRESH_SECONDS so that they sink as they age.  score() is available in SQL as
+hot_score(upvotes, timestamp, now) on every connection opened through storage.py.
+
+    python hot.py refresh [database]    rescore every post now
+"""
+import logging
+import sys
+import threading
+import time
+
+from sqlalchemy import text
+
+import config
+import helper
+import storage
+
+log = logging.getLogger(__name__)
+
+GRAVITY = 1.8               # how quickly posts sink with age
+WINDOW = 7 * 24 * 3600      # posts older than this score 0 and are left alone by refreshes
+
+# post ids sort in the order the posts were made, so the posts made since a time are a range of the primary key
+REFRESH = 'UPDATE posts SET hot_score = hot_score(upvotes, timestamp, :now) WHERE post_id >= :first_id'
+
+
+def score(upvotes, timestamp, now):
+    age = now - timestamp
+    if age > WINDOW:
+        return 0.0
+    return max(upvotes + 1, 0) / (max(age, 0) / 3600 + 2) ** GRAVITY
+
+
+def refresh_params(now, since):
+    # Parameters of REFRESH for the posts made at or after since (in seconds)
+    return {'now': now, 'first_id': helper.make_post_id(since * 1000)}
+
+
+storage.register_function('hot_score', 3, score)
+
+
+class HotRefresher:
+    """Background thread rescoring recent posts.
+
+    Each pass covers the posts young enough to still be decaying plus a margin, so posts that have just left WINDOW
+    are set to 0 on their way out.  The first pass after startup covers every post, which also backfills databases
+    that have just gained the column.  With several worker processes, set HOT_REFRESH_SECONDS to 0 in all but one
+    (or run `python hot.py refresh` from cron instead).
+    """
+
+    def __init__(self, app=None, db=None):
+        self._refresh_listeners = []
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('HOT_REFRESH_SECONDS', 300)
+        self.interval = app.config['HOT_REFRESH_SECONDS']
+        self.app = app
+        self.db = db
+        if self.interval:
+            # started by the first request, like the vote buffer, so that forked workers each get their own thread
+            app.before_request(self._start)
+
+    def add_refresh_listener(self, listener):
+        # listener() is called after each pass
+        self._refresh_listeners.append(listener)
+
+    def refresh(self, full=False):
+        now = int(time.time())
+        since = 0 if full else now - WINDOW - 2 * self.interval
+        with self.db.get_engine(self.app).begin() as conn:
+            count = conn.execute(text(REFRESH), refresh_params(now, since)).rowcount
+        for listener in self._refresh_listeners:
+            listener()
+        return count
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='hot-refresh', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        full = True
+        while True:
+            try:
+                self.refresh(full)
+                full = False
+            except Exception:
+                log.exception('Hot score refresh failed')
+            time.sleep(self.interval)
+
+
+def _main(argv):
+    if len(argv) < 2 or argv[1] != 'refresh':
+        print(__doc__.strip())
+        return 2
+    conn = storage.connect(argv[2] if len(argv) > 2 else config.PATH_DATABASE)
+    count = conn.execute(REFRESH, refresh_params(int(time.time()), 0)).rowcount
+    conn.commit()
+    conn.close()
+    print('Rescored %d post(s)' % count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
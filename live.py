@@ -0,0 +1,216 @@
+import asyncio
+import errno
+import json
+import logging
+import socket
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import flask
+
+log = logging.getLogger(__name__)
+
+_HEADERS = ('HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/event-stream\r\n'
+            'Cache-Control: no-cache\r\n'
+            'Connection: keep-alive\r\n'
+            '%s'
+            'Vary: Origin\r\n'
+            'X-Accel-Buffering: no\r\n'
+            '\r\n'
+            'retry: 5000\n\n')
+
+
+class LiveVotes:
+    """Server-Sent Events stream of vote counts.
+
+    Browsers open GET /live/votes?posts=<id>,<id>,... on the app's own origin, which the proxy in front of the app
+    passes to LIVE_VOTES_PORT; without one, the app redirects there.  That port is served by an asyncio server in a
+    background thread, so an idle subscriber costs a socket and a coroutine rather than a thread.  The vote handlers
+    call publish() with a post's new count; once every LIVE_VOTES_INTERVAL seconds the latest count of every post that
+    changed is sent, as one "votes" event of {post_id: upvotes}, to each subscriber watching any of them.
+
+    One worker process serves the stream for all of them: the first to bind LIVE_VOTES_PORT.  The others send their
+    counts to it as UDP datagrams on the same port of the loopback interface, and keep trying to bind the port, so
+    that one of them takes over if that worker exits.
+    """
+
+    def __init__(self, app=None):
+        self.port = None
+        self.serving = False
+        self._changed = {}           # post_id -> latest upvotes, since the last send
+        self._subscribers = {}       # post_id -> set of StreamWriters watching it
+        self._lock = threading.Lock()
+        self._thread = None
+        self._socket = None          # UDP socket publish() sends with while another worker serves the stream
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIVE_VOTES_ENABLED', True)
+        app.config.setdefault('LIVE_VOTES_HOST', '127.0.0.1')
+        app.config.setdefault('LIVE_VOTES_PORT', 8002)  # 0 for any free port, with a single worker process
+        app.config.setdefault('LIVE_VOTES_URL', None)   # public URL of the stream, if not /live/votes on the app
+        app.config.setdefault('LIVE_VOTES_ORIGIN', None)  # origin of the pages, if the stream is on another one
+        app.config.setdefault('LIVE_VOTES_INTERVAL', 1.0)
+        app.config.setdefault('LIVE_VOTES_KEEPALIVE', 15.0)
+        app.config.setdefault('LIVE_VOTES_MAX_POSTS', 50)
+        self.config = {key: app.config['LIVE_VOTES_' + key] for key in
+                       ('HOST', 'PORT', 'URL', 'ORIGIN', 'INTERVAL', 'KEEPALIVE', 'MAX_POSTS')}
+        if app.config['LIVE_VOTES_ENABLED']:
+            # started by the first request, like the vote buffer, so that forked workers each get their own thread
+            app.before_request(self._start)
+            app.add_url_rule('/live/votes', 'live_votes', self._redirect)
+        app.add_template_global(self.url, 'live_votes_url')
+
+    def publish(self, post_id, upvotes):
+        # Called from request threads; the count goes out with the next send
+        if self.serving:
+            with self._lock:
+                self._changed[post_id] = upvotes
+        elif self._socket is not None:
+            try:
+                self._socket.sendto(('%s\t%d' % (post_id, upvotes)).encode(), ('127.0.0.1', self.port))
+            except OSError:
+                pass  # no worker is serving the stream right now
+
+    def url(self):
+        # Where pages should point their EventSource, or None when the stream is not running
+        if self.port is None:
+            return None
+        return self.config['URL'] or flask.url_for('live_votes')
+
+    def _redirect(self):
+        # /live/votes reaches the app when no proxy passes it to the stream, e.g. with the development server
+        if self.port is None:
+            flask.abort(404)
+        return flask.redirect('%s://%s:%d/live/votes?%s' % (flask.request.scheme, flask.request.host.rsplit(':', 1)[0],
+                                                            self.port, flask.request.query_string.decode('latin-1')),
+                              307)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            started = threading.Event()
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._serve(started)), name='live-votes',
+                                            daemon=True)
+            self._thread.start()
+        started.wait(5)
+
+    async def _serve(self, started):
+        while True:
+            try:
+                server = await asyncio.start_server(self._handle, self.config['HOST'], self.config['PORT'])
+            except OSError as e:
+                if e.errno != errno.EADDRINUSE or not self.config['PORT']:
+                    log.error('Live votes stream not started: %r', e)
+                    started.set()
+                    return
+                # another worker serves the stream; send it the votes handled here until it goes away
+                if self._socket is None:
+                    self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    self.port = self.config['PORT']
+                    started.set()
+                await asyncio.sleep(self.config['KEEPALIVE'])
+                continue
+            break
+        self.port = server.sockets[0].getsockname()[1]
+        self.serving = True
+        if self._socket is not None:
+            self._socket.close()  # taken over from the worker it sent to
+        try:
+            # the votes published by the other workers
+            await asyncio.get_running_loop().create_datagram_endpoint(lambda: _Published(self),
+                                                                      local_addr=('127.0.0.1', self.port))
+        except OSError as e:
+            log.error('Live votes from other workers not received: %r', e)
+        started.set()
+        async with server:
+            await self._send_loop()
+
+    async def _send_loop(self):
+        since_keepalive = 0.0
+        while True:
+            await asyncio.sleep(self.config['INTERVAL'])
+            with self._lock:
+                changed, self._changed = self._changed, {}
+            updates = {}  # writer -> {post_id: upvotes}
+            for post_id, upvotes in changed.items():
+                for writer in self._subscribers.get(post_id, ()):
+                    updates.setdefault(writer, {})[post_id] = upvotes
+            for writer, counts in updates.items():
+                self._send(writer, 'event: votes\ndata: %s\n\n' % json.dumps(counts))
+            since_keepalive += self.config['INTERVAL']
+            if since_keepalive >= self.config['KEEPALIVE']:
+                since_keepalive = 0.0
+                for writer in {writer for writers in self._subscribers.values() for writer in writers}:
+                    self._send(writer, ': keepalive\n\n')
+
+    def _send(self, writer, message):
+        # Never waits for a client: one that has let a lot of output pile up is dropped instead
+        if writer.transport.get_write_buffer_size() > 64 * 1024:
+            writer.close()
+            return
+        writer.write(message.encode())
+
+    def _allowed_origin(self, headers):
+        # The Origin to allow cross-origin reads from: LIVE_VOTES_ORIGIN, or else the app on another port of the host
+        # the stream was reached at, as when /live/votes is redirected here
+        origin = headers.get('origin')
+        if origin is None:
+            return None
+        if self.config['ORIGIN'] is not None:
+            return origin if origin == self.config['ORIGIN'] else None
+        host = urlsplit('//' + headers.get('host', '')).hostname
+        return origin if host is not None and urlsplit(origin).hostname == host else None
+
+    async def _handle(self, reader, writer):
+        post_ids = ()
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            lines = request.decode('latin-1').split('\r\n')
+            method, target = lines[0].split(' ', 2)[:2]
+            headers = {name.strip().lower(): value.strip() for name, _, value in
+                       (line.partition(':') for line in lines[1:] if line)}
+            url = urlsplit(target)
+            post_ids = [post_id for value in parse_qs(url.query).get('posts', ()) for post_id in value.split(',')
+                        if post_id][:self.config['MAX_POSTS']]
+            if method != 'GET' or url.path != '/live/votes' or not post_ids:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                post_ids = ()
+                return
+            origin = self._allowed_origin(headers)
+            writer.write((_HEADERS % ('Access-Control-Allow-Origin: %s\r\n' % origin if origin else '')).encode())
+            for post_id in post_ids:
+                self._subscribers.setdefault(post_id, set()).add(writer)
+            while await reader.read(1024):
+                pass  # nothing more is expected from the client; this returns when it disconnects
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError,
+                ConnectionError):
+            pass
+        finally:
+            for post_id in post_ids:
+                watchers = self._subscribers.get(post_id)
+                if watchers is not None:
+                    watchers.discard(writer)
+                    if not watchers:
+                        del self._subscribers[post_id]
+            writer.close()
+
+
+class _Published(asyncio.DatagramProtocol):
+    # Receives "post_id\tupvotes" datagrams from the workers that do not serve the stream
+
+    def __init__(self, live_votes):
+        self.live_votes = live_votes
+
+    def datagram_received(self, data, addr):
+        try:
+            post_id, upvotes = data.decode().split('\t')
+            upvotes = int(upvotes)
+        except ValueError:
+            return
+        self.live_votes.publish(post_id, upvotes)
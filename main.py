@@ -1,39 +1,112 @@
 import flask
+import hashlib
+import logging
 import os
+import time
+import zlib
+from urllib.parse import urlencode
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from helper import *
-import sqlite3
-from flask import request, current_app, json, url_for, send_file, flash
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.ext.automap import automap_base
-
-app = flask.Flask(__name__)
-app.secret_key = 'some secret key'
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = -1
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data/database.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = './static/img/profile_pics'
+import hot
+from live import LiveVotes
+from flask import request, current_app, json, url_for, flash
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from sqlalchemy import bindparam, text, tuple_
+from assets import AssetManifest
+from cache import LRUCache
+from metrics import Metrics
+import migrate
+from models import db, User, Posts
+from ratelimit import VoteLimiter
+from recent import RecentPost, RecentPosts
+import search
+import snapshot
+from storage import Storage
+import tsv
+import tsv_import
+from vote_buffer import VoteBuffer
+
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
-DATABASE = 'data/database.db'
-db = SQLAlchemy(app)
+bp = flask.Blueprint('main', __name__)
+log = logging.getLogger(__name__)
 login_manager = LoginManager()
-login_manager.init_app(app)
-
-Base = automap_base()
-
-
-class User(UserMixin, Base):
-    __tablename__ = 'users'
+storage = Storage()
+metrics = Metrics()
+reader = storage.reader  # session on the read-only pool, for views that do not write
+vote_buffer = VoteBuffer()
+hot_refresher = hot.HotRefresher()
+live_votes = LiveVotes()
+vote_limiter = VoteLimiter()
+recent_posts = RecentPosts()  # the newest posts, for the first feed pages
+assets = AssetManifest()
+feed_cache = LRUCache(1024, 60)  # feed pages (post ids and cursors) per process
+card_cache = LRUCache(4096, 300)  # rendered post cards per process
+user_cache = LRUCache(10000, 300)  # logged-in users kept in memory by user_loader
+
+
+def create_app(settings=None):
+    # Builds the app without touching the database; connections are opened by the first request that needs one, so
+    # the app can be created once before a server forks its workers.  settings overrides any of the config below.
+    app = flask.Flask(__name__)
+    app.secret_key = 'some secret key'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = './static/img/profile_pics'
+    app.config['IMAGE_WORKERS'] = 2  # processes resizing uploaded profile pictures
+    app.config['ADMIN_USERS'] = ()  # usernames allowed to use /admin routes
+    app.config['VOTE_BUFFER_ENABLED'] = False  # True to acknowledge votes from memory and write them in batches
+    app.config['VOTE_BUFFER_FLUSH_MS'] = 250
+    app.config['VOTE_BUFFER_MAX_PENDING'] = 200
+    app.config['HOT_REFRESH_SECONDS'] = 300  # how often hot scores are decayed; 0 leaves it to `python hot.py refresh`
+    app.config['TEMPLATE_BYTECODE_CACHE'] = None  # directory for compiled templates, shared across restarts
+    if settings:
+        app.config.update(settings)
+
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        os.makedirs(app.config['TEMPLATE_BYTECODE_CACHE'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE'])
+    metrics.init_app(app)
+    metrics.register(*snapshot.METRICS)
+    metrics.register(*vote_limiter.metrics)
+    metrics.register(*recent_posts.metrics)
+    storage.init_app(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    vote_buffer.init_app(app, storage.database)
+    hot_refresher.init_app(app, db)
+    live_votes.init_app(app)
+    vote_limiter.init_app(app)
+    recent_posts.init_app(app, storage.database, db.session)
+    assets.init_app(app)
+    feed_cache.init_app(app, 'FEED_CACHE')
+    card_cache.init_app(app, 'CARD_CACHE')
+    user_cache.init_app(app, 'USER_CACHE')
+    app.register_blueprint(bp)
+    return app
+
+
+class CachedUser:
+    # Plain copy of a users row for Flask-Login.  It is not bound to any session, so it can outlive the request that
+    # loaded it in user_cache.
+    __slots__ = ('username', 'private_id', 'authenticated', 'hasProfilePic', 'profilePicName')
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, username, private_id, authenticated, hasProfilePic, profilePicName):
+        self.username = username
+        self.private_id = private_id
+        self.authenticated = authenticated
+        self.hasProfilePic = hasProfilePic
+        self.profilePicName = profilePicName
 
     def get_id(self):
         return self.private_id
 
     def __repr__(self):
-        return '<User %r>' % self.username
-
-
-Base.prepare(db.engine, reflect=True)
-Posts = Base.classes.posts
+        return '<CachedUser %r>' % self.username
 
 
 def allowed_file(filename):
@@ -41,22 +114,153 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+image_pool = None
+profile_pics_ready = set()
+profile_pics_queued = set()
+profile_pics_failed = set()  # pictures whose derivatives could not be made, shown as the placeholder
+
+
+def process_profile_pic(filename):
+    # Resizes an uploaded picture into its derivatives in a worker process.  The pool starts on first use so that it
+    # is never forked from a half-imported module, and again if a worker process died and broke it.
+    global image_pool
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    profile_pics_queued.add(filename)
+    try:
+        try:
+            if image_pool is None:
+                image_pool = ProcessPoolExecutor(current_app.config['IMAGE_WORKERS'])
+            future = image_pool.submit(make_profile_pic_derivatives, path)
+        except BrokenProcessPool:
+            image_pool = ProcessPoolExecutor(current_app.config['IMAGE_WORKERS'])
+            future = image_pool.submit(make_profile_pic_derivatives, path)
+    except BaseException:
+        profile_pics_queued.discard(filename)
+        raise
+    future.add_done_callback(lambda f: profile_pic_processed(filename, f))
+
+
+def profile_pic_processed(filename, future):
+    # Called once the job has finished, failed or lost its worker process.  A picture that failed is not queued
+    # again by this process, so that every page showing it does not resubmit it.
+    try:
+        if future.exception() is not None:
+            log.error('Processing %s failed: %r', filename, future.exception())
+            profile_pics_failed.add(filename)
+    finally:
+        profile_pics_queued.discard(filename)
+
+
+@bp.app_template_global()
+def profile_pic(user, size):
+    # {'src', 'srcset', 'webp_srcset'} for showing user's picture at size px.  Until the derivatives exist this is
+    # the placeholder; pictures uploaded before derivatives existed are queued for processing on first sight.
+    name = user.profilePicName
+    stem = os.path.splitext(name)[0]
+    if name not in profile_pics_ready:
+        if not os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], '%s_%d.jpg' % (stem, max(PROFILE_PIC_SIZES)))):
+            if name not in profile_pics_queued and name not in profile_pics_failed and \
+                    os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], name)):
+                process_profile_pic(name)
+            placeholder = url_for('static', filename='img/profile_placeholder.svg')
+            return {'src': placeholder, 'srcset': placeholder, 'webp_srcset': None}
+        profile_pics_ready.add(name)
+
+    def srcset(extension):
+        urls = [url_for('static', filename='img/profile_pics/%s_%d.%s' % (stem, size, extension)) + ' 1x']
+        if size * 2 in PROFILE_PIC_SIZES:
+            urls.append(url_for('static', filename='img/profile_pics/%s_%d.%s' % (stem, size * 2, extension)) + ' 2x')
+        return ', '.join(urls)
+    return {'src': url_for('static', filename='img/profile_pics/%s_%d.jpg' % (stem, size)), 'srcset': srcset('jpg'),
+            'webp_srcset': srcset('webp') if features.check('webp') else None}
+
+
 @login_manager.user_loader
 def user_loader(user_id):
-    return db.session.query(User).filter_by(private_id=user_id).first()
+    user = user_cache.get(user_id)
+    if user is None:
+        row = reader.execute(text('SELECT username, private_id, authenticated, hasProfilePic, profilePicName '
+                                  'FROM users WHERE private_id = :private_id'), {'private_id': user_id}).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+        user_cache.set(user_id, user)
+    return user
 
 
 def init_db():
-    conn = sqlite3.connect('data/database.db')
-    c = conn.cursor()
-    with open('data/schema.sql') as schema:
-        c.executescript(schema.read())
-    conn.close()
+    migrate.upgrade(storage.database)
+
+
+def get_vote(post_id, username, session=None):
+    pending = vote_buffer.pending_vote(post_id, username)
+    if pending is not None:
+        return pending
+    return (session or reader).execute(text('SELECT direction FROM post_votes WHERE post_id = :post_id AND username = :username'),
+                                       {'post_id': post_id, 'username': username}).scalar() or 0
+
+
+def get_votes(post_ids, username):
+    # {post_id: direction} for the posts in post_ids that username has voted on
+    if not post_ids:
+        return {}
+    rows = reader.execute(text('SELECT post_id, direction FROM post_votes WHERE username = :username AND post_id IN :post_ids')
+                          .bindparams(bindparam('post_ids', expanding=True)),
+                          {'username': username, 'post_ids': list(post_ids)})
+    votes = dict(rows.fetchall())
+    for post_id in post_ids:
+        pending = vote_buffer.pending_vote(post_id, username)
+        if pending is not None:
+            votes[post_id] = pending
+    return votes
+
+
+def cast_vote(post_id, username, direction):
+    # Toggles username's vote on post_id in the given direction (1 = up, -1 = down).  Voting the same way twice
+    # removes the vote, voting the other way flips it.  Returns (upvotes, new direction), or None if there is no post.
+    if db.session.execute(text('SELECT 1 FROM posts WHERE post_id = :post_id'), {'post_id': post_id}).scalar() is None:
+        return None
+    params = {'post_id': post_id, 'username': username, 'direction': direction}
+    current = get_vote(post_id, username, db.session)
+    if current == direction:
+        db.session.execute(text('DELETE FROM post_votes WHERE post_id = :post_id AND username = :username'), params)
+        new_direction = 0
+    else:
+        db.session.execute(text('INSERT INTO post_votes (post_id, username, direction) VALUES (:post_id, :username, :direction) '
+                                'ON CONFLICT (post_id, username) DO UPDATE SET direction = excluded.direction'), params)
+        new_direction = direction
+    upvotes = db.session.execute(text('UPDATE posts SET upvotes = upvotes + :delta, version = version + 1, '
+                                      'hot_score = hot_score(upvotes + :delta, timestamp, :now) '
+                                      'WHERE post_id = :post_id RETURNING upvotes'),
+                                 {'post_id': post_id, 'delta': new_direction - current, 'now': get_timestamp()}).scalar()
+    db.session.commit()
+    return upvotes, new_direction
+
+
+def record_vote(post_id, username, direction):
+    if vote_buffer.enabled:
+        result = vote_buffer.vote(post_id, username, direction)
+    else:
+        result = cast_vote(post_id, username, direction)
+    card_cache.invalidate_tag(post_id)
+    if result:
+        recent_posts.set_upvotes(post_id, result[0])
+        live_votes.publish(post_id, result[0])
+    return result
+
+
+def invalidate_cards(post_ids):
+    for post_id in post_ids:
+        card_cache.invalidate_tag(post_id)
 
 
-@app.teardown_appcontext
+vote_buffer.add_flush_listener(invalidate_cards)
+hot_refresher.add_refresh_listener(lambda: feed_cache.invalidate_tag('hot'))
+
+
+@bp.teardown_app_request
 def close_connection(exception):
-    db.session.close()
+    db.session.close()  # hands the writer connection back as soon as the request is done
 
 
 @login_manager.unauthorized_handler
@@ -64,251 +268,485 @@ def unauthorized():
     return flask.render_template('unauthorized.html')
 
 
-@app.errorhandler(405)
-@app.errorhandler(404)
+@bp.app_errorhandler(405)
+@bp.app_errorhandler(404)
 def e404(e):
     return flask.render_template('error.html')
 
 
-@app.route('/getTSVdump', methods=['POST', 'GET'])
+@bp.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return json.dumps({'feed': feed_cache.stats(), 'cards': card_cache.stats(), 'users': user_cache.stats()})
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_page():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/getTSVdump', methods=['POST', 'GET'])
 def get_tsv():
     return flask.render_template('downtsv.html')
 
 
-@app.route('/getTSVfile/<tbtype>', methods=['GET'])
+def export_rows(tbtype, batch_size=1000):
+    # Yields the TSV export of a table in chunks of batch_size rows, reading it through a server-side cursor.
+    yield tsv.header(tbtype)
+    result = reader.execute(text(tsv.QUERIES[tbtype]).execution_options(stream_results=True))
+    for rows in result.yield_per(batch_size).partitions():
+        yield ''.join([tsv.encode_row(row) for row in rows])
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = zlib with a gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@bp.route('/getTSVfile/<tbtype>', methods=['GET'])
 def get_branch_data_file(tbtype):
-    # connection = engine.connect()
-    data_for_csv = []
-    # data = db.session.query(str(tbtype)).all()
-    if tbtype == 'posts':
-        data = db.session.query(Posts).all()
-        file_basename = 'posts.tsv'
-        server_path = ''
-        w_file = open(server_path + file_basename, 'w')
-        w_file.write('post_id\ttitle\tcontent\tusername\ttimestamp\tupvotes\tupvoters\tdownvoters\n')
-        for row in data:
-            row_as_string = row.post_id + '\t' + row.title + '\t' + row.content + '\t' + row.username + '\t' + str(
-                row.timestamp) + '\t'
-            row_as_string += str(row.upvotes) + '\t' + row.upvoters + '\t' + row.downvoters + '\n'
-            print(row_as_string)
-            w_file.write(row_as_string)
-    elif tbtype == 'users':
-        data = db.session.query(User).all()
-        file_basename = 'users.tsv'
-        server_path = ''
-        w_file = open(server_path + file_basename, 'w')
-        w_file.write('username\tprivate_id\tauthenticated\thasProfilePic\tprofilePicName\n')
-        for row in data:
-            row_as_string = row.username + '\t' + row.private_id + '\t' + str(row.authenticated) + '\t' + str(row.hasProfilePic)+ '\t' + str(row.profilePicName) + '\n'
-            print(row_as_string)
-            w_file.write(row_as_string)
-
-    w_file.close()
-    w_file = open(server_path + file_basename, 'r')
-    file_size = len(w_file.read())
-    return send_file(server_path + file_basename, as_attachment=True)
+    if tbtype not in tsv.QUERIES:
+        flask.abort(404)
+    body = flask.stream_with_context(export_rows(tbtype))
+    headers = {'Content-Disposition': 'attachment; filename=%s.tsv' % tbtype, 'Vary': 'Accept-Encoding'}
+    if request.args.get('gzip') and 'gzip' in request.accept_encodings:
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    return flask.Response(body, mimetype='text/tab-separated-values', headers=headers)
 
 
+@bp.route('/admin/import', methods=['POST'])
+@login_required
+def import_tsv():
+    # Imports one /getTSVfile export sent as the request body, read as it arrives
+    if current_user.username not in current_app.config['ADMIN_USERS']:
+        flask.abort(403)
+    started = time.perf_counter()
+
+    def progress(name, table, rows):
+        log.info('import %s rows=%d rows_per_second=%.0f', table, rows, rows / (time.perf_counter() - started))
+    conn = db.get_engine(current_app).raw_connection()  # the writer, so that the app's own writes queue behind it
+    try:
+        counts = tsv_import.import_tsv(conn, [('request', (line.decode() for line in request.stream))], progress)
+    except (ValueError, UnicodeDecodeError) as e:
+        return json.dumps({'status': 'error', 'error': str(e)}), 400
+    finally:
+        conn.close()
+    for cache in (feed_cache, card_cache, user_cache):
+        cache.clear()
+    recent_posts.invalidate()
+    return json.dumps({'status': 'success', 'rows': counts, 'seconds': round(time.perf_counter() - started, 3)})
+
+
+@bp.route('/admin/snapshot', methods=['GET'])
+@login_required
+def export_snapshot():
+    # Streams a zip of every table as of one moment, taken with the backup API while the app keeps writing
+    if current_user.username not in current_app.config['ADMIN_USERS']:
+        flask.abort(403)
+    body = snapshot.stream(storage.database)
+    filename = 'snapshot-%s.zip' % time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+    return flask.Response(body, mimetype='application/zip',
+                          headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
+def vote_response(direction):
+    # Handles a click on a vote button, after vote_limiter has had its say
+    try:
+        post_id = json.loads(request.data)['postid']
+    except (ValueError, TypeError, KeyError):
+        post_id = None
+    if not isinstance(post_id, str):
+        return json.dumps({'status': 'error', 'error': 'expected {"postid": "<post id>"}'}), 400
+    log.debug('vote post_id=%s user=%s direction=%d', post_id, current_user.username, direction)
+    outcome, value = vote_limiter.check(current_user.username, post_id, direction)
+    if outcome == 'limited':
+        return (json.dumps({'status': 'rate limited', 'retry_after': round(value, 3)}), 429,
+                {'Retry-After': str(int(value) + 1)})
+    if outcome == 'running':
+        return json.dumps({'status': 'duplicate'})  # the first click is still being handled and will answer
+    if outcome == 'collapsed':
+        result = value
+    else:
+        result = record_vote(post_id, current_user.username, direction)
+        vote_limiter.record(current_user.username, post_id, direction, result)
+    if result:
+        upvotes, new_direction = result
+        return json.dumps({'status': 'success', 'upvotes': upvotes, 'vote': new_direction})
+    return json.dumps({'status': 'no post found'})
+
+
+@bp.route('/upvote', methods=['POST'])
 @login_required
-@app.route('/upvote', methods=['POST'])
 def upvote_post():
-    if request.method == "POST":
-        dataGet = json.loads(request.data)
-        print('Upvote invoked')
-        print(dataGet['postid'])
-        post = db.session.query(Posts).filter_by(post_id=dataGet['postid']).first()
-        print("Upvoters")
-        print(post.upvoters)
-        print(current_user.username)
-        # current_user.username
-        if post:
-            allVoters = str(post.upvoters).split(',')
-            print(allVoters)
-            downvoters = str(post.downvoters).split(',')
-            if current_user.username in downvoters:
-                print('Change downvote to upvote')
-                if allVoters == ['']:
-                    setattr(post, "upvoters", current_user.username)
-                else:
-                    allVoters.append(current_user.username)
-                    allVoters = ','.join(allVoters)
-                    setattr(post, "upvoters", allVoters)
-                downvoters.remove(current_user.username)
-                if len(downvoters) == 0:
-                    setattr(post, "downvoters", '')
-                else:
-                    downvoters = ','.join(downvoters)
-                    setattr(post, "downvoters", downvoters)
-                setattr(post, "upvotes", post.upvotes + 2)
-                db.session.commit()
-                return json.dumps({'status': 'success', 'upvotes': post.upvotes})
-            elif current_user.username in allVoters:
-                print('Remove upvote')
-                allVoters.remove(current_user.username)
-                if len(allVoters) == 0:
-                    setattr(post, "upvoters", '')
-                else:
-                    allVoters = ','.join(allVoters)
-                    setattr(post, "upvoters", allVoters)
-                setattr(post, "upvotes", post.upvotes - 1)
-                db.session.commit()
-                return json.dumps({'status': 'success', 'upvotes': post.upvotes})
-            else:
-                if allVoters == ['']:
-                    setattr(post, "upvoters", current_user.username)
-                else:
-                    allVoters.append(current_user.username)
-                    allVoters = ','.join(allVoters)
-                    print('updated voters')
-                    print(allVoters)
-                    setattr(post, "upvoters", allVoters)
-                setattr(post, "upvotes", post.upvotes + 1)
-                db.session.commit()
-                print('Post upvote success')
-                return json.dumps({'status': 'success', 'upvotes': post.upvotes})
-        return json.dumps({'status': 'no post found'})
-    return 'Not POST'
+    return vote_response(1)
 
 
+@bp.route('/downvote', methods=['POST'])
 @login_required
-@app.route('/downvote', methods=['POST'])
 def downvote_post():
-    if request.method == "POST":
-        dataGet = json.loads(request.data)
-        print('Downvote invoked')
-        print(dataGet['postid'])
-        post = db.session.query(Posts).filter_by(post_id=dataGet['postid']).first()
-        print("Downvoters")
-        print(post.downvoters)
-        print(current_user.username)
-        # current_user.username
-        if post:
-            allVoters = str(post.downvoters).split(',')
-            print(allVoters)
-            upvoters = str(post.upvoters).split(',')
-            if current_user.username in upvoters:
-                print('Change upvote to downvote')
-                if allVoters == ['']:
-                    setattr(post, "downvoters", current_user.username)
-                else:
-                    allVoters.append(current_user.username)
-                    allVoters = ','.join(allVoters)
-                    setattr(post, "downvoters", allVoters)
-                upvoters.remove(current_user.username)
-                if len(upvoters) == 0:
-                    setattr(post, "upvoters", '')
-                else:
-                    upvoters = ','.join(upvoters)
-                    setattr(post, "upvoters", upvoters)
-                setattr(post, "upvotes", post.upvotes - 2)
-                db.session.commit()
-                return json.dumps({'status': 'success', 'upvotes': post.upvotes})
-            elif current_user.username in allVoters:
-                print('Remove downvote')
-                allVoters.remove(current_user.username)
-                if len(allVoters) == 0:
-                    setattr(post, "downvoters", '')
-                else:
-                    allVoters = ','.join(allVoters)
-                    setattr(post, "downvoters", allVoters)
-                setattr(post, "upvotes", post.upvotes + 1)
-                db.session.commit()
-                return json.dumps({'status': 'success', 'upvotes': post.upvotes})
-            else:
-                if allVoters == ['']:
-                    setattr(post, "downvoters", current_user.username)
-                else:
-                    allVoters.append(current_user.username)
-                    allVoters = ','.join(allVoters)
-                    print('updated voters')
-                    print(allVoters)
-                    setattr(post, "downvoters", allVoters)
-                setattr(post, "upvotes", post.upvotes - 1)
-                db.session.commit()
-                print('Post downvote success')
-                return json.dumps({'status': 'success', 'upvotes': post.upvotes})
-        return json.dumps({'status': 'no post found'})
-    return 'Not POST'
+    return vote_response(-1)
+
 
+SORT_KEYS = {'new': (Posts.post_id,), 'hot': (Posts.hot_score, Posts.post_id)}
 
+
+def query_page(q, cursor=None, newer=False, per_page=5, offset=0, sort='new'):
+    # Keyset pagination of a posts query over SORT_KEYS[sort], post_id by default: one page of posts after (or, with
+    # newer=True, before) the cursor in descending order.  Fetching one extra row replaces a COUNT(*) per page.
+    # Returns (posts, has_newer, has_older).
+    columns = SORT_KEYS[sort]
+    key = tuple_(*columns)
+    if cursor is not None:
+        q = q.filter(key > tuple_(*cursor) if newer else key < tuple_(*cursor))
+    if newer:
+        q = q.order_by(*[column.asc() for column in columns])
+    else:
+        q = q.order_by(*[column.desc() for column in columns])
+    posts = q.offset(offset).limit(per_page + 1).all()
+    more = len(posts) > per_page
+    posts = posts[:per_page]
+    if newer:
+        posts.reverse()
+        return posts, more, True
+    return posts, cursor is not None or offset > 0, more
+
+
+def sort_key(post, sort='new'):
+    return tuple(getattr(post, column.key) for column in SORT_KEYS[sort])
+
+
+def request_cursor(key_type=None):
+    # The (cursor, newer) pair from a ?newer=<cursor> or ?older=<cursor> query string
+    newer = 'newer' in request.args
+    cursor = request.args.get('newer' if newer else 'older')
+    if cursor is not None:
+        cursor = decode_cursor(cursor, key_type)
+        if cursor is None:
+            return None, False  # not a cursor of ours, e.g. from an edited link: the first page
+    return cursor, newer
+
+
+def page_urls(url, keys, has_newer, has_older, query=None):
+    # keys are the sort keys of the posts on the page, in display order (only the first and last are used); query
+    # holds any other query string parameters the links should keep
+    newer_url = older_url = None
+    if keys and has_newer:
+        newer_url = url + '?' + urlencode(dict(query or {}, newer=encode_cursor(*keys[0])))
+    if keys and has_older:
+        older_url = url + '?' + urlencode(dict(query or {}, older=encode_cursor(*keys[-1])))
+    return newer_url, older_url
+
+
+def feed_results(username, cursor=None, newer=False, offset=0, sort='new'):
+    # One feed page as ([(timestamp, post_id), ...], has_newer, has_older, edges), where edges are the sort keys of
+    # its first and last posts, and the Posts rows if it had to be read from the database.  Cached pages are tagged
+    # with every post on them, with 'head' if a new post would show up on them, with 'offset' for numbered pages,
+    # which shift whenever a post is added or deleted, and with 'hot' for hot pages, which a new post or a refresh
+    # of the scores can reorder.  The first pages of the newest-first feed come from recent_posts instead.
+    if sort == 'new' and not offset:
+        found = recent_posts.page(username, cursor, newer)
+        if found is not None:
+            posts, has_newer, has_older = found
+            return (([(post.timestamp, post.post_id) for post in posts], has_newer, has_older,
+                     [sort_key(post) for post in posts[:1] + posts[-1:]]), {post.post_id: post for post in posts})
+    key = (username, cursor, newer, offset, sort)
+    page = feed_cache.get(key)
+    if page is not None:
+        return page, {}
+    q = reader.query(Posts).filter(Posts.username != username)
+    posts, has_newer, has_older = query_page(q, cursor, newer, offset=offset, sort=sort)
+    page = ([(post.timestamp, post.post_id) for post in posts], has_newer, has_older,
+            [sort_key(post, sort) for post in posts[:1] + posts[-1:]])
+    tags = [post.post_id for post in posts]
+    if sort == 'hot':
+        tags.append('hot')
+    elif cursor is None or newer:
+        tags.append('head')
+    if offset:
+        tags.append('offset')
+    feed_cache.set(key, page, tags)
+    return page, {post.post_id: post for post in posts}
+
+
+def post_versions(post_ids):
+    # {post_id: version} for the posts in post_ids that exist, from the posts_post_id_version index alone
+    if not post_ids:
+        return {}
+    rows = reader.execute(text('SELECT post_id, version FROM posts INDEXED BY posts_post_id_version '
+                               'WHERE post_id IN :post_ids').bindparams(bindparam('post_ids', expanding=True)),
+                          {'post_ids': list(post_ids)})
+    return dict(rows.fetchall())
+
+
+def render_cards(keys, posts, votes=None):
+    # Rendered post cards for the (timestamp, post_id) keys, given the viewer's votes if they were already read.  A
+    # card is cached under its post and version, its relative time label and the viewer's vote, so it is rendered
+    # again as soon as its "Posted ... ago" text changes or any process votes on the post.  The versions come with
+    # the posts read for the page, or else from the index.
+    if votes is None:
+        votes = get_votes([post_id for _, post_id in keys], current_user.username)
+    versions = {post_id: post.version for post_id, post in posts.items()}
+    if any(post_id not in versions for _, post_id in keys):
+        versions = post_versions([post_id for _, post_id in keys])
+    card_keys = [(post_id, versions[post_id], time_string(timestamp), votes.get(post_id, 0))
+                 for timestamp, post_id in keys if post_id in versions]
+    cards = [card_cache.get(card_key) for card_key in card_keys]
+    missing = [card_key[0] for card_key, card in zip(card_keys, cards) if card is None and card_key[0] not in posts]
+    if missing:
+        posts = dict(posts)
+        posts.update((post.post_id, post) for post in reader.query(Posts).filter(Posts.post_id.in_(missing)))
+    for i, (post_id, version, time_label, vote) in enumerate(card_keys):
+        if cards[i] is None and post_id in posts:
+            cards[i] = Markup(flask.render_template('post_card.html', post=posts[post_id], vote=vote,
+                                                    time_label=time_label))
+            card_cache.set(card_keys[i], cards[i], tags=[post_id])
+    return [card for card in cards if card is not None]
+
+
+def render_feed(page, posts, sort='new'):
+    keys, has_newer, has_older, edges = page
+    newer_url, older_url = page_urls('/' + current_user.private_id + '/feed', edges, has_newer, has_older,
+                                     {'sort': sort} if sort != 'new' else None)
+    return flask.render_template('feed.html', cards=render_cards(keys, posts), newer_url=newer_url,
+                                 older_url=older_url, sort=sort)
+
+
+@bp.route('/<private_id>/feed', methods=['GET', 'POST'])
 @login_required
-@app.route('/<private_id>/feed', methods=['GET', 'POST'])
-def feed_redirect(private_id):
+def feed(private_id):
     if current_user.is_anonymous or private_id != current_user.private_id:
         return current_app.login_manager.unauthorized()
-    return flask.redirect('/' + private_id + '/feed/1')
+    sort = request.args.get('sort', 'new')
+    if sort not in SORT_KEYS:
+        flask.abort(404)
+    cursor, newer = request_cursor(float if sort == 'hot' else None)
+    return render_feed(*feed_results(current_user.username, cursor, newer, sort=sort), sort=sort)
 
 
+@bp.route('/<private_id>/feed/<int:page>', methods=['GET', 'POST'])
 @login_required
-@app.route('/<private_id>/feed/<int:page>', methods=['GET', 'POST'])
-def feed(private_id, page):
+def feed_page(private_id, page):
+    # Numbered pages from before cursors existed.  The page itself is found by offset, its links are cursors.
     if current_user.is_anonymous or private_id != current_user.private_id:
         return current_app.login_manager.unauthorized()
-    per_page = 5
-    posts = db.session.query(Posts).filter(Posts.username != current_user.username).order_by(
-        Posts.timestamp.desc()).paginate(page, per_page, error_out=False)
-    return flask.render_template('feed.html', posts=posts, time_string=time_string)
+    return render_feed(*feed_results(current_user.username, offset=(max(page, 1) - 1) * 5))
+
+
+def search_results(q, cursor=None, per_page=10):
+    # One page of posts matching q, best match first, as dicts with highlighted title and snippet Markup, and the
+    # cursor of the next page (None on the last one).  Like query_page, one extra row tells whether there is more.
+    match = search.match_expression(q)
+    if match is None:
+        return [], None
+    params = {'match': match, 'limit': per_page + 1}
+    if cursor is not None:
+        params['score'], params['rowid'] = cursor
+    rows = reader.execute(text(search.QUERY_FIRST if cursor is None else search.QUERY_AFTER), params).fetchall()
+    next_cursor = search.encode_cursor(*rows[per_page - 1][6:8]) if len(rows) > per_page else None
+    results = [{'post_id': post_id, 'title': search.highlight(title), 'snippet': search.highlight(snippet),
+                'username': username, 'timestamp': timestamp, 'upvotes': upvotes, 'score': score}
+               for post_id, title, snippet, username, timestamp, upvotes, score, _ in rows[:per_page]]
+    return results, next_cursor
+
+
+def request_search():
+    # (query, cursor) from ?q=<words>&after=<cursor>
+    cursor = request.args.get('after')
+    if cursor is not None:
+        cursor = search.decode_cursor(cursor)
+        if cursor is None:
+            flask.abort(404)
+    return request.args.get('q', '').strip(), cursor
+
+
+@bp.route('/search', methods=['GET'])
+@login_required
+def search_page():
+    if current_user.is_anonymous:
+        return current_app.login_manager.unauthorized()
+    q, cursor = request_search()
+    results, next_cursor = search_results(q, cursor)
+    for result in results:
+        result['time_label'] = time_string(result['timestamp'])
+    more_url = '/search?' + urlencode({'q': q, 'after': next_cursor}) if next_cursor else None
+    return flask.render_template('search.html', q=q, results=results, more_url=more_url)
 
 
+@bp.route('/api/search', methods=['GET'])
+@login_required
+def search_api():
+    if current_user.is_anonymous:
+        return current_app.login_manager.unauthorized()
+    q, cursor = request_search()
+    results, next_cursor = search_results(q, cursor)
+    return json.dumps({'query': q, 'results': results, 'next': next_cursor})
+
+
+@bp.route('/post/<post_id>/delete', methods=['POST'])
 @login_required
-@app.route('/post/<post_id>/delete', methods=['POST'])
 def delete_post(post_id):
+    db.session.execute(text('DELETE FROM post_votes WHERE post_id = :post_id'), {'post_id': post_id})
     db.session.query(Posts).filter_by(post_id=post_id).delete()
     db.session.commit()
+    feed_cache.invalidate_tag(post_id)
+    feed_cache.invalidate_tag('offset')
+    card_cache.invalidate_tag(post_id)
+    recent_posts.remove(post_id)
     return flask.redirect('/' + current_user.private_id + '/profile')
 
 
-@app.route('/<private_id>/create-submit', methods=['POST'])
+@bp.route('/<private_id>/create-submit', methods=['POST'])
 def create_submit(private_id):
-    timestamp = get_timestamp()
     data = request.form
     username = db.session.query(User).filter_by(private_id=private_id).first().username
-    post_id = hash_string(username + str(timestamp))
+    post_id = new_post_id()
+    timestamp = post_id_time(post_id) // 1000  # the second in the id, which /api/feed's ETag reads time labels from
     db.session.add(
         Posts(post_id=post_id, title=data['title'], content=data['content'], username=username, timestamp=timestamp,
-              upvotes=0, upvoters='', downvoters=''))
+              upvotes=0, upvoters='', downvoters='', hot_score=hot.score(0, timestamp, timestamp)))
     db.session.commit()
+    recent_posts.add(RecentPost(post_id, data['title'], data['content'], username, timestamp, 0, 1))
+    feed_cache.invalidate_tag('head')
+    feed_cache.invalidate_tag('hot')
     return flask.redirect('/' + private_id + '/profile')
 
 
+@bp.route('/<private_id>/create', methods=['GET', 'POST'])
 @login_required
-@app.route('/<private_id>/create', methods=['GET', 'POST'])
 def create(private_id):
     if current_user.is_anonymous or private_id != current_user.private_id:
         return current_app.login_manager.unauthorized()
     return flask.render_template('create.html', private_id=private_id)
 
 
+@bp.route('/<private_id>/profile', methods=['GET', 'POST'])
 @login_required
-@app.route('/<private_id>/profile', methods=['GET', 'POST'])
 def profile(private_id):
-    q = db.session.query(User).filter_by(private_id=private_id).first()
-    if q is None:
+    user = reader.execute(text('SELECT username, post_count FROM users WHERE private_id = :private_id'),
+                          {'private_id': private_id}).first()
+    if user is None:
         flask.abort(404)
-    uname = q.username
+    uname, post_count = user
     if current_user.is_anonymous or private_id != current_user.private_id:
         return current_app.login_manager.unauthorized()
 
-    # get posts with username
-    q = db.session.query(Posts).filter_by(username=uname)
-    post_list = []
-    for post in q:
-        post_list.append([post.post_id, post.title, post.content, time_string(post.timestamp), post.upvotes])
-    post_list.reverse()
-    return flask.render_template('profile.html', username=uname, data=post_list)
+    # one page of posts with username, newest first
+    cursor, newer = request_cursor()
+    posts, has_newer, has_older = query_page(reader.query(Posts).filter(Posts.username == uname), cursor, newer,
+                                             per_page=10)
+    newer_url, older_url = page_urls('/' + private_id + '/profile', [sort_key(post) for post in posts],
+                                     has_newer, has_older)
+    post_list = [[post.post_id, post.title, post.content, time_string(post.timestamp), post.upvotes] for post in posts]
+    return flask.render_template('profile.html', username=uname, data=post_list, post_count=post_count,
+                                 newer_url=newer_url, older_url=older_url)
 
 
+def renamed_post(post_id):
+    # The id that a post with the old id post_id was given by migration 0009, or None
+    return reader.execute(text('SELECT post_id FROM post_id_aliases WHERE old_id = :old_id'),
+                          {'old_id': post_id}).scalar()
+
+
+@bp.route('/post/<post_id>', methods=['GET', 'POST'])
 @login_required
-@app.route('/post/<post_id>', methods=['GET', 'POST'])
 def post_view(post_id):
-    q = db.session.query(Posts).filter_by(post_id=post_id).first()
+    q = reader.query(Posts).filter_by(post_id=post_id).first()
     if q is None:
-        flask.abort(404)
+        renamed = renamed_post(post_id)
+        if renamed is None:
+            flask.abort(404)
+        return flask.redirect('/post/' + renamed, 301)
     found = [q.post_id, q.title, q.content, time_string(q.timestamp), q.upvotes, q.username]
-    return flask.render_template('post.html', post=found)
+    vote = get_vote(post_id, current_user.username) if current_user.is_authenticated else 0
+    return flask.render_template('post.html', post=found, vote=vote)
 
 
-@app.route('/login-submit', methods=['POST'])
+def api_etag(*parts):
+    # Strong ETag over everything an API response is built from
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def api_response(body, etag):
+    response = flask.Response(json.dumps(body, separators=(',', ':')), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'  # per user, and always revalidated
+    response.headers['Vary'] = 'Cookie'
+    return response
+
+
+def not_modified(etag):
+    # A 304 if the client already holds the response tagged etag, else None
+    if request.if_none_match.contains(etag):
+        return api_response(None, etag).make_conditional(request)
+    return None
+
+
+def post_json(post, vote):
+    return {'post_id': post.post_id, 'title': post.title, 'content': post.content, 'username': post.username,
+            'timestamp': post.timestamp, 'upvotes': post.upvotes, 'vote': vote, 'version': post.version}
+
+
+@bp.route('/api/feed', methods=['GET'])
+@login_required
+def api_feed():
+    # The feed page for the same ?sort=, ?newer= and ?older= as /<private_id>/feed, with the cursors of the pages
+    # around it and each post's card as rendered on the feed page.  The ETag comes from the (post_id, version) pairs
+    # on the page, which the feed indexes cover, and the cards' time labels, which come from the second in each post
+    # id, so a revalidation that ends in a 304 never reads a posts row.
+    if current_user.is_anonymous:
+        return current_app.login_manager.unauthorized()
+    sort = request.args.get('sort', 'new')
+    if sort not in SORT_KEYS:
+        flask.abort(404)
+    cursor, newer = request_cursor(float if sort == 'hot' else None)
+    username = current_user.username
+    q = reader.query(*SORT_KEYS[sort], Posts.version).filter(Posts.username != username)
+    rows, has_newer, has_older = query_page(q, cursor, newer, sort=sort)
+    etag = api_etag(username, sort, has_newer, has_older,
+                    [(row.post_id, row.version, vote_buffer.pending_vote(row.post_id, username),
+                      time_string(post_id_time(row.post_id) // 1000)) for row in rows])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    post_ids = [row.post_id for row in rows]
+    posts = {post.post_id: post for post in reader.query(Posts).filter(Posts.post_id.in_(post_ids))} if rows else {}
+    votes = get_votes(post_ids, username)
+    post_ids = [post_id for post_id in post_ids if post_id in posts]
+    cards = render_cards([(posts[post_id].timestamp, post_id) for post_id in post_ids], posts, votes)
+    body = {'posts': [dict(post_json(posts[post_id], votes.get(post_id, 0)), card=str(card))
+                      for post_id, card in zip(post_ids, cards)],
+            'newer': encode_cursor(*sort_key(rows[0], sort)) if rows and has_newer else None,
+            'older': encode_cursor(*sort_key(rows[-1], sort)) if rows and has_older else None}
+    return api_response(body, etag)
+
+
+@bp.route('/api/post/<post_id>', methods=['GET'])
+def api_post(post_id):
+    # SQLite would pick the primary key index, which then has to read the row for version
+    version = reader.execute(text('SELECT version FROM posts INDEXED BY posts_post_id_version WHERE post_id = :post_id'),
+                             {'post_id': post_id}).scalar()
+    if version is None:
+        renamed = renamed_post(post_id)
+        if renamed is None:
+            return json.dumps({'status': 'no post found'}), 404
+        return flask.redirect('/api/post/' + renamed, 301)
+    username = current_user.username if current_user.is_authenticated else None
+    etag = api_etag(username, post_id, version, vote_buffer.pending_vote(post_id, username))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    post = reader.query(Posts).filter_by(post_id=post_id).first()
+    if post is None:
+        return json.dumps({'status': 'no post found'}), 404
+    return api_response(post_json(post, get_vote(post_id, username) if username else 0), etag)
+
+
+@bp.route('/login-submit', methods=['POST'])
 def login_submit():
     data = request.form
     username = data['username'].lower()
@@ -329,6 +767,7 @@ def login_submit():
         user.authenticated = True
         login_user(user)
         db.session.commit()
+        user_cache.pop(private_id)
         return flask.redirect('/' + private_id + '/feed')
     else:
         if request.files['myPic'].filename == '':
@@ -338,29 +777,39 @@ def login_submit():
             if not allowed_file(profile_pic.filename):
                 flash('Profile pictures must be either in .jpg or .png format. Please choose another photo.', 'danger')
                 return flask.redirect('/register')
+            if not is_image(profile_pic.stream):
+                flash('That file is not a picture we can read. Please choose another photo.', 'danger')
+                return flask.redirect('/register')
             file_extension = profile_pic.filename.split('.')[-1]
             filename = private_id + '.' + file_extension
-            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
             profile_pic.save(path)
-            make_img_square(path)
+            process_profile_pic(filename)
             user = User(username=username, private_id=private_id, authenticated=True, hasProfilePic=True, profilePicName=filename)
         db.session.add(user)
         db.session.commit()
+        user_cache.pop(private_id)
         # flash('Thank you for registering, ' + data['username'] + '.', 'success')
         login_user(user)
         return flask.redirect('/' + private_id + '/feed')
 
 
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/login', methods=['GET', 'POST'])
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def login():
-    current_user.authenticated = False
-    db.session.commit()
+    if current_user.is_authenticated:
+        db.session.execute(text('UPDATE users SET authenticated = 0 WHERE private_id = :private_id'),
+                           {'private_id': current_user.private_id})
+        db.session.commit()
+        user_cache.pop(current_user.private_id)
     logout_user()
     return flask.render_template('login.html')
 
 
 if __name__ == '__main__':
-    init_db()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(port=8001, host='127.0.0.1', debug=True, use_evalex=False)
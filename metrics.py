@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+import flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram:
+    # Cumulative-bucket histogram per label set, in the Prometheus text format
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, values, amount):
+        index = bisect_left(self.buckets, amount)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((values, list(counts), total) for values, (counts, total) in self._series.items())
+        for values, counts, total in series:
+            labels = _labels(self.labels, values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket{%s%sle="%s"} %d' % (self.name, labels, labels and ',', bound, cumulative))
+            lines.append('%s_sum%s %r' % (self.name, labels and '{%s}' % labels, total))
+            lines.append('%s_count%s %d' % (self.name, labels and '{%s}' % labels, cumulative))
+        return lines
+
+
+class Gauge:
+    # Current value per label set, in the Prometheus text format
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, values, amount):
+        with self._lock:
+            self._values[values] = amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s gauge' % self.name]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, amount in values:
+            labels = _labels(self.labels, label_values)
+            lines.append('%s%s %r' % (self.name, labels and '{%s}' % labels, amount))
+        return lines
+
+
+class Counter(Gauge):
+    # Total per label set that only goes up, in the Prometheus text format
+
+    def inc(self, values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        lines = Gauge.render(self)
+        lines[1] = '# TYPE %s counter' % self.name
+        return lines
+
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, _escape(value)) for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Request and SQL instrumentation, exposed by render() in the Prometheus text format.
+
+    Every request is timed from the start of its handling to the end of its response body, so streamed exports count
+    in full, and observed per route rule, method and status.  Every SQL statement run through SQLAlchemy in this
+    process is timed per statement kind (SELECT, INSERT, ...).  Statements slower than SLOW_QUERY_MS are logged as
+    warnings, and so are requests that run the same statement N_PLUS_ONE_THRESHOLD times or more, the usual sign of
+    a query issued once per row of another.
+    """
+
+    def __init__(self, app=None):
+        self.requests = Histogram('http_request_duration_seconds', 'Time to handle a request and send its response.',
+                                  ('route', 'method', 'status'), REQUEST_BUCKETS)
+        self.statements = Histogram('sql_statement_duration_seconds', 'Time to execute an SQL statement.',
+                                    ('kind',), SQL_BUCKETS)
+        self.queries_per_request = Histogram('http_request_sql_statements', 'SQL statements run per request.',
+                                             ('route',), (1, 2, 3, 5, 10, 20, 50, 100))
+        self._collectors = []  # metrics of other modules, added by register()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_MS', 100)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+        self.slow_query = app.config['SLOW_QUERY_MS'] / 1000
+        self.n_plus_one = app.config['N_PLUS_ONE_THRESHOLD']
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        # on the Engine class, so that the writer and read-only engines are covered whenever they are created
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+
+    def register(self, *collectors):
+        # Adds Histograms or Gauges kept elsewhere to the output of render(); registering one again, as every app
+        # created in the process does, changes nothing
+        self._collectors.extend(collector for collector in collectors if collector not in self._collectors)
+
+    def render(self):
+        lines = self.requests.render() + self.queries_per_request.render() + self.statements.render()
+        for collector in self._collectors:
+            lines += collector.render()
+        return '\n'.join(lines) + '\n'
+
+    def _start_request(self):
+        flask.g.metrics_start = time.perf_counter()
+        flask.g.metrics_statements = {}  # statement -> times run during this request
+
+    def _end_request(self, response):
+        if 'metrics_start' not in flask.g:
+            return response
+        start, statements = flask.g.metrics_start, flask.g.metrics_statements
+        route = flask.request.url_rule.rule if flask.request.url_rule else '<unmatched>'
+        labels = (route, flask.request.method, str(response.status_code))
+        # a streamed body is still being generated; the request is complete when the server closes it
+        response.call_on_close(lambda: self._request_done(start, labels, statements))
+        return response
+
+    def _request_done(self, start, labels, statements):
+        self.requests.observe(labels, time.perf_counter() - start)
+        self.queries_per_request.observe(labels[:1], sum(statements.values()))
+        for statement, count in statements.items():
+            if count >= self.n_plus_one:
+                log.warning('possible N+1 queries route=%s count=%d statement=%s', labels[0], count,
+                            ' '.join(statement.split()))
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        # a failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get('metrics_start'):
+            context.connection.info['metrics_start'].pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_start'].pop()
+        self.statements.observe((statement.lstrip().split(None, 1)[0].upper(),), elapsed)
+        route = None
+        if flask.has_request_context() and 'metrics_statements' in flask.g:
+            flask.g.metrics_statements[statement] = flask.g.metrics_statements.get(statement, 0) + 1
+            route = flask.request.url_rule.rule if flask.request.url_rule else '<unmatched>'
+        if elapsed >= self.slow_query:
+            log.warning('slow query ms=%.1f route=%s statement=%s', elapsed * 1000, route, ' '.join(statement.split()))
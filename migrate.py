@@ -0,0 +1,102 @@
+"""
+Schema migrations for the SQLite database.
+
+Migrations live in migrations/ as NNNN_description.sql or NNNN_description.py (with an up(conn) function) and are
+applied in order, each in its own transaction together with its row in schema_version.  data/schema.sql is kept
+equal to the result of applying all of them.
+
+    python migrate.py up [database]        apply pending migrations
+    python migrate.py status [database]    list applied and pending migrations
+"""
+import importlib.util
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+import config
+import storage
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(config.PATH_BASE, 'migrations')
+_FILENAME = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+
+def migrations():
+    # [(version, name, path)] for every migration file, in order
+    found = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _FILENAME.match(filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(found)
+
+
+def applied_versions(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version int primary key, name text, applied_at int)')
+    return {version for (version,) in conn.execute('SELECT version FROM schema_version')}
+
+
+def pending(conn):
+    done = applied_versions(conn)
+    return [migration for migration in migrations() if migration[0] not in done]
+
+
+def upgrade(path=config.PATH_DATABASE):
+    # Applies every pending migration to the database at path and returns the versions applied.
+    conn = storage.connect(path, isolation_level=None)
+    try:
+        applied = []
+        for version, name, migration_path in pending(conn):
+            log.info('Applying migration %04d_%s to %s', version, name, path)
+            _apply(conn, version, name, migration_path)
+            applied.append(version)
+        return applied
+    finally:
+        conn.close()
+
+
+def _apply(conn, version, name, path):
+    stamp = "INSERT INTO schema_version (version, name, applied_at) VALUES (%d, '%s', strftime('%%s', 'now'));" % (
+        version, name)
+    try:
+        if path.endswith('.sql'):
+            # executescript commits any open transaction first, so the script carries its own
+            with open(path) as f:
+                conn.executescript('BEGIN;\n' + f.read() + '\n;' + stamp + '\nCOMMIT;')
+        else:
+            spec = importlib.util.spec_from_file_location('migration_%04d' % version, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            conn.execute('BEGIN')
+            module.up(conn)
+            conn.execute(stamp)
+            conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+
+
+def _main(argv):
+    if len(argv) < 2 or argv[1] not in ('up', 'status'):
+        print(__doc__.strip())
+        return 2
+    path = argv[2] if len(argv) > 2 else config.PATH_DATABASE
+    if argv[1] == 'up':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+        applied = upgrade(path)
+        log.info('Applied %d migration(s)', len(applied))
+    else:
+        conn = sqlite3.connect(path)
+        done = applied_versions(conn)
+        conn.close()
+        for version, name, _ in migrations():
+            print('%s %04d_%s' % ('[x]' if version in done else '[ ]', version, name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
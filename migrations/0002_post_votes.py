@@ -0,0 +1,23 @@
+# One row per (post, user) vote in post_votes, converted from the comma-separated posts.upvoters/downvoters lists.
+# The lists are blanked once converted.
+
+
+def up(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS post_votes (
+            post_id text,
+            username text,
+            direction int,
+            PRIMARY KEY(post_id, username),
+            FOREIGN KEY(post_id) REFERENCES posts(post_id) ON DELETE CASCADE,
+            FOREIGN KEY(username) REFERENCES users(username)
+        )''')
+    rows = conn.execute("SELECT post_id, upvoters, downvoters FROM posts "
+                        "WHERE upvoters != '' OR downvoters != ''").fetchall()
+    users = {username for (username,) in conn.execute('SELECT username FROM users')}
+    votes = []
+    for post_id, upvoters, downvoters in rows:
+        votes += [(post_id, voter, 1) for voter in (upvoters or '').split(',') if voter in users]
+        votes += [(post_id, voter, -1) for voter in (downvoters or '').split(',') if voter in users]
+    conn.executemany('INSERT OR REPLACE INTO post_votes (post_id, username, direction) VALUES (?, ?, ?)', votes)
+    conn.execute("UPDATE posts SET upvoters = '', downvoters = '' WHERE upvoters != '' OR downvoters != ''")
@@ -0,0 +1,2 @@
+-- feed pages are read newest first, keyed on (timestamp, post_id)
+CREATE INDEX IF NOT EXISTS posts_timestamp_post_id ON posts(timestamp DESC, post_id DESC);
@@ -0,0 +1,16 @@
+# users.post_count, kept up to date by triggers on posts, and the index behind profile pages.
+
+
+def up(conn):
+    if 'post_count' not in [column[1] for column in conn.execute('PRAGMA table_info(users)')]:
+        conn.execute('ALTER TABLE users ADD COLUMN post_count int NOT NULL DEFAULT 0')
+    conn.execute('UPDATE users SET post_count = (SELECT count(*) FROM posts WHERE posts.username = users.username)')
+    conn.execute('CREATE INDEX IF NOT EXISTS posts_username_timestamp ON posts(username, timestamp DESC, post_id DESC)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_count_insert AFTER INSERT ON posts BEGIN
+            UPDATE users SET post_count = post_count + 1 WHERE username = NEW.username;
+        END''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_count_delete AFTER DELETE ON posts BEGIN
+            UPDATE users SET post_count = post_count - 1 WHERE username = OLD.username;
+        END''')
@@ -0,0 +1,2 @@
+-- user_loader, profile() and create_submit look users up by private_id
+CREATE INDEX IF NOT EXISTS users_private_id ON users(private_id);
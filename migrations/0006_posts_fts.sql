@@ -0,0 +1,19 @@
+-- full-text index over post titles and contents for /search.  The text itself stays in posts (external content);
+-- posts_fts rows share the rowid of their post and are kept in step by the triggers below.
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, content, content='posts', content_rowid='rowid',
+                                                        tokenize='unicode61 remove_diacritics 2');
+
+CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', OLD.rowid, OLD.title, OLD.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, content ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', OLD.rowid, OLD.title, OLD.content);
+    INSERT INTO posts_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+END;
+
+INSERT INTO posts_fts (posts_fts) VALUES ('rebuild');
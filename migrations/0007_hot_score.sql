@@ -0,0 +1,3 @@
+-- time-decayed score behind the hot feed (see hot.py); filled in by the app's first refresh or `python hot.py refresh`
+ALTER TABLE posts ADD COLUMN hot_score real NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS posts_hot ON posts(hot_score DESC, post_id DESC);
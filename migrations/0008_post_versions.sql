@@ -0,0 +1,11 @@
+-- per-post version, bumped whenever a post or its votes change; the JSON API builds its ETags from it
+ALTER TABLE posts ADD COLUMN version int NOT NULL DEFAULT 1;
+
+-- the feed indexes also carry username and version, so that /api/feed can work out its ETag from the index alone
+DROP INDEX IF EXISTS posts_timestamp_post_id;
+CREATE INDEX posts_timestamp_post_id ON posts(timestamp DESC, post_id DESC, username, version);
+DROP INDEX IF EXISTS posts_hot;
+CREATE INDEX posts_hot ON posts(hot_score DESC, post_id DESC, username, version);
+
+-- and /api/post/<post_id> from this one
+CREATE INDEX IF NOT EXISTS posts_post_id_version ON posts(post_id, version);
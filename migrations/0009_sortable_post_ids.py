@@ -0,0 +1,32 @@
+# Time-ordered post ids (see helper.PostIds).  Every post whose id was not made by PostIds (the SHA3 hashes of
+# username + timestamp made before) gets helper.post_id_for(timestamp, ...), which keeps the order of the feed, and
+# its votes follow it.  post_id_aliases maps the old ids to the new ones, so that links to old posts still work and
+# votes left in the vote buffer's log under an old id are still applied.  The newest-first feed and profile pages are
+# then read in post_id order, from indexes that replace the (timestamp, post_id) ones.
+import helper
+
+
+def up(conn):
+    conn.execute('PRAGMA defer_foreign_keys = ON')  # post_votes rows point at the old ids until they are rekeyed too
+    conn.execute('CREATE TABLE IF NOT EXISTS post_id_aliases (old_id text primary key, post_id text NOT NULL)')
+    conn.execute('CREATE TEMP TABLE rekey (old_id text primary key, post_id text NOT NULL)')
+    rows = conn.execute('SELECT post_id, timestamp FROM posts ORDER BY timestamp, post_id').fetchall()
+    rekeyed = []
+    previous, index = None, 0
+    for post_id, timestamp in rows:
+        index = index + 1 if timestamp == previous else 0
+        previous = timestamp
+        if helper.post_id_time(post_id) is None:
+            rekeyed.append((post_id, helper.post_id_for(timestamp or 0, index)))
+    conn.executemany('INSERT INTO rekey (old_id, post_id) VALUES (?, ?)', rekeyed)
+    for table in ('posts', 'post_votes'):
+        conn.execute('UPDATE %s SET post_id = (SELECT post_id FROM rekey WHERE old_id = %s.post_id) '
+                     'WHERE post_id IN (SELECT old_id FROM rekey)' % (table, table))
+    conn.execute('INSERT OR REPLACE INTO post_id_aliases (old_id, post_id) SELECT old_id, post_id FROM rekey')
+    conn.execute('DROP TABLE rekey')
+
+    conn.execute('DROP INDEX IF EXISTS posts_timestamp_post_id')
+    conn.execute('DROP INDEX IF EXISTS posts_post_id_version')
+    conn.execute('DROP INDEX IF EXISTS posts_username_timestamp')
+    conn.execute('CREATE INDEX IF NOT EXISTS posts_post_id_version ON posts(post_id, version, username)')
+    conn.execute('CREATE INDEX IF NOT EXISTS posts_username_post_id ON posts(username, post_id)')
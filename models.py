@@ -0,0 +1,39 @@
+from flask_login import UserMixin
+
+from storage import SQLAlchemy
+
+# Declared to match data/schema.sql, so that nothing has to be reflected from the database at startup
+db = SQLAlchemy()
+
+
+class User(UserMixin, db.Model):
+    __tablename__ = 'users'
+    username = db.Column(db.Text, primary_key=True)
+    private_id = db.Column(db.Text)
+    authenticated = db.Column(db.Boolean)
+    hasProfilePic = db.Column(db.Boolean)
+    profilePicName = db.Column(db.Text)
+    post_count = db.Column(db.Integer, nullable=False, server_default='0')
+
+    def get_id(self):
+        return self.private_id
+
+    def __repr__(self):
+        return '<User %r>' % self.username
+
+
+class Posts(db.Model):
+    __tablename__ = 'posts'
+    post_id = db.Column(db.Text, primary_key=True)
+    title = db.Column(db.Text)
+    content = db.Column(db.Text)
+    username = db.Column(db.Text, db.ForeignKey('users.username'))
+    timestamp = db.Column(db.Integer)
+    upvotes = db.Column(db.Integer)
+    upvoters = db.Column(db.Text, server_default='')
+    downvoters = db.Column(db.Text, server_default='')
+    hot_score = db.Column(db.Float, nullable=False, server_default='0')
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    def __repr__(self):
+        return '<Posts %r>' % self.post_id
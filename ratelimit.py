@@ -0,0 +1,107 @@
+import threading
+import time
+
+from metrics import Counter
+
+_RUNNING = object()  # the result of a click that is still being handled
+
+
+class VoteLimiter:
+    """In-memory limits on votes, checked before a vote touches the database.
+
+    Each user has a token bucket of VOTE_LIMIT_USER_BURST votes refilled at VOTE_LIMIT_USER_RATE per second, and each
+    (user, post) pair a smaller one, VOTE_LIMIT_POST_BURST refilled at VOTE_LIMIT_POST_RATE per second, so that one
+    post cannot be toggled back and forth by a script.  A vote with an empty bucket is refused.  Before that, a click
+    repeating the user's last vote on the same post within VOTE_COLLAPSE_MS milliseconds is taken for a double click:
+    rather than toggling the vote off again, it is answered with the result of the first click (None for a post that
+    was not found), or told to wait for it if that is still being handled.  Outcomes are counted in
+    vote_limiter_requests_total.  State is per process, like the caches, and is pruned once it holds
+    VOTE_LIMIT_MAX_KEYS entries.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.requests = Counter('vote_limiter_requests_total', 'Votes checked by the vote limiter, by outcome.',
+                                ('outcome',))
+        self.metrics = (self.requests,)
+        self._buckets = {}   # username or (username, post_id) -> [tokens, monotonic time of last update]
+        self._last = {}      # (username, post_id) -> (monotonic time, direction, result)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VOTE_LIMIT_ENABLED', True)
+        app.config.setdefault('VOTE_LIMIT_USER_RATE', 2.0)
+        app.config.setdefault('VOTE_LIMIT_USER_BURST', 20)
+        app.config.setdefault('VOTE_LIMIT_POST_RATE', 0.5)
+        app.config.setdefault('VOTE_LIMIT_POST_BURST', 5)
+        app.config.setdefault('VOTE_COLLAPSE_MS', 400)
+        app.config.setdefault('VOTE_LIMIT_MAX_KEYS', 100000)
+        self.enabled = app.config['VOTE_LIMIT_ENABLED']
+        self.user_rate = app.config['VOTE_LIMIT_USER_RATE']
+        self.user_burst = app.config['VOTE_LIMIT_USER_BURST']
+        self.post_rate = app.config['VOTE_LIMIT_POST_RATE']
+        self.post_burst = app.config['VOTE_LIMIT_POST_BURST']
+        self.collapse = app.config['VOTE_COLLAPSE_MS'] / 1000
+        self.max_keys = app.config['VOTE_LIMIT_MAX_KEYS']
+
+    def check(self, username, post_id, direction):
+        # Returns ('allowed', None) for a vote to go ahead, which record() should then be given the result of,
+        # ('collapsed', result of the first click) or ('running', None) for a repeated click, depending on whether the
+        # first one has been recorded, and ('limited', seconds until a vote would be allowed) for a refused one
+        if not self.enabled:
+            return 'allowed', None
+        now = time.monotonic()
+        pair = (username, post_id)
+        with self._lock:
+            last = self._last.get(pair)
+            if last is not None and last[1] == direction and now - last[0] < self.collapse:
+                outcome, value = 'collapsed', last[2]
+            else:
+                outcome, value = 'limited_user', self._wait(username, now, self.user_rate, self.user_burst)
+                if not value:
+                    outcome, value = 'limited_post', self._wait(pair, now, self.post_rate, self.post_burst)
+                if not value:
+                    self._buckets[username][0] -= 1
+                    self._buckets[pair][0] -= 1
+                    self._last[pair] = (now, direction, _RUNNING)
+                    outcome = 'allowed'
+        self.requests.inc((outcome,))
+        if outcome == 'collapsed' and value is _RUNNING:
+            return 'running', None
+        return ('limited', value) if outcome.startswith('limited') else (outcome, value)
+
+    def record(self, username, post_id, direction, result):
+        # Keeps the result of an allowed vote, to answer clicks that repeat it with
+        if not self.enabled:
+            return
+        with self._lock:
+            last = self._last.get((username, post_id))
+            if last is not None and last[1] == direction:
+                self._last[username, post_id] = (last[0], direction, result)
+            if len(self._last) + len(self._buckets) > self.max_keys:
+                self._prune(time.monotonic())
+
+    def reset(self):
+        # Forgets every bucket and click
+        with self._lock:
+            self._buckets.clear()
+            self._last.clear()
+
+    def _wait(self, key, now, rate, burst):
+        # Refills key's bucket up to now; returns 0 if it holds a token, else the seconds until it will
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return 0 if bucket[0] >= 1 else (1 - bucket[0]) / rate
+
+    def _prune(self, now):
+        # Forgets the clicks too old to collapse and the buckets that have refilled, which are as good as new
+        self._last = {pair: last for pair, last in self._last.items() if now - last[0] < self.collapse}
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[0] + (now - bucket[1]) * (self.post_rate if type(key) is tuple else self.user_rate)
+                         < (self.post_burst if type(key) is tuple else self.user_burst)}
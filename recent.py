@@ -0,0 +1,203 @@
+import bisect
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+
+import storage
+from metrics import Counter
+
+# the columns a post card is rendered from, and the version its cached card is kept under
+RecentPost = namedtuple('RecentPost', 'post_id title content username timestamp upvotes version')
+
+_NEWEST = ('SELECT post_id, title, content, username, timestamp, upvotes, version FROM posts '
+           'ORDER BY post_id DESC LIMIT ?')
+# the ids and versions of the posts from one onwards, read from the index alone
+_VERSIONS = 'SELECT post_id, version FROM posts INDEXED BY posts_post_id_version WHERE post_id >= ? ORDER BY post_id'
+_CHANGED = 'SELECT post_id, upvotes, version FROM posts WHERE post_id IN (%s)'
+
+
+class RecentPosts:
+    """The newest RECENT_POSTS_SIZE posts of the database, held in memory to serve the first pages of the feed.
+
+    Posts are kept as RecentPost tuples in post_id order, which is the order they were made in, so a feed page is a
+    bisect and a short walk that skips the viewer's own posts.  A page that would run past the oldest post held
+    returns None, and the caller reads it from the database instead.  This process's new posts, deletions and votes
+    are applied in place.  Changes committed by other processes are noticed through PRAGMA data_version, checked at
+    most every RECENT_POSTS_CHECK_MS milliseconds.  The ids and versions of the posts held are then read from an
+    index: the posts are reloaded if posts were added or deleted, and otherwise only those whose version changed, by
+    a vote, have their counts updated in place.  invalidate() reloads them too.  data_version also changes with this
+    process's own commits, so those made through the session given to init_app are recorded as seen.  The posts are
+    loaded by the first page.
+    """
+
+    def __init__(self, app=None, database=None):
+        self.size = 0
+        self.pages = Counter('recent_posts_pages_total', 'Feed pages served from the recent posts, or not.',
+                             ('source',))
+        self.reloads = Counter('recent_posts_reloads_total', 'Times the recent posts were read from the database.')
+        self.updates = Counter('recent_posts_updates_total', 'Times the recent posts had their counts updated.')
+        self.metrics = (self.pages, self.reloads, self.updates)
+        self._ids = []          # post ids, oldest first
+        self._posts = []        # RecentPost for each of _ids
+        self._complete = False  # whether there are no posts older than _posts[0]
+        self._stale = True
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._checked = 0.0
+        if app is not None:
+            self.init_app(app, database)
+
+    def init_app(self, app, database=None, session=None):
+        # session is the writer session whose commits are applied in place by the caller
+        app.config.setdefault('RECENT_POSTS_SIZE', 1000)
+        app.config.setdefault('RECENT_POSTS_CHECK_MS', 200)
+        self.size = app.config['RECENT_POSTS_SIZE']
+        self.check_interval = app.config['RECENT_POSTS_CHECK_MS'] / 1000
+        self.database = database
+        self._stale = True
+        if session is not None and not event.contains(session, 'after_commit', self._after_commit):
+            event.listen(session, 'after_begin', self._after_begin)
+            event.listen(session, 'after_commit', self._after_commit)
+
+    def page(self, username, cursor=None, newer=False, per_page=5):
+        # One newest-first feed page of posts not by username, like main.query_page over post_id: (posts, has_newer,
+        # has_older), or None if it has to be read from the database
+        if not self.size:
+            return None
+        self._sync()
+        with self._lock:
+            ids, posts, complete = self._ids, self._posts, self._complete
+            found = []  # newest first when older, oldest first when newer
+            if newer:
+                # every post newer than one held is held too, but not those between an older cursor and the oldest
+                if not complete and (not ids or cursor[0] < ids[0]):
+                    found = None
+                else:
+                    for i in range(bisect.bisect_right(ids, cursor[0]), len(ids)):
+                        if posts[i].username != username:
+                            found.append(posts[i])
+                            if len(found) > per_page:
+                                break
+            else:
+                i = len(ids) if cursor is None else bisect.bisect_left(ids, cursor[0])
+                while i > 0 and len(found) <= per_page:
+                    i -= 1
+                    if posts[i].username != username:
+                        found.append(posts[i])
+                if len(found) <= per_page and not complete:
+                    found = None
+        self.pages.inc(('memory' if found is not None else 'database',))
+        if found is None:
+            return None
+        more = len(found) > per_page
+        found = found[:per_page]
+        if newer:
+            found.reverse()
+            return found, more, True
+        return found, cursor is not None, more
+
+    def add(self, post):
+        # A post just made by this process
+        if not self.size:
+            return
+        with self._lock:
+            i = bisect.bisect_left(self._ids, post.post_id)
+            if i == 0 and not self._complete and self._ids:
+                return  # older than everything held
+            self._ids.insert(i, post.post_id)
+            self._posts.insert(i, post)
+            if len(self._ids) > self.size:
+                del self._ids[0], self._posts[0]
+                self._complete = False
+
+    def remove(self, post_id):
+        with self._lock:
+            i = bisect.bisect_left(self._ids, post_id)
+            if i < len(self._ids) and self._ids[i] == post_id:
+                del self._ids[i], self._posts[i]
+
+    def set_upvotes(self, post_id, upvotes):
+        with self._lock:
+            i = bisect.bisect_left(self._ids, post_id)
+            if i < len(self._ids) and self._ids[i] == post_id:
+                self._posts[i] = self._posts[i]._replace(upvotes=upvotes)
+
+    def invalidate(self):
+        # Reloads the posts before the next page, e.g. after a bulk import
+        self._stale = True
+
+    def _sync(self):
+        # Reloads the posts if they are stale, or brings them up to date if another connection has committed since the
+        # last check
+        now = time.monotonic()
+        if not self._stale and now - self._checked < self.check_interval:
+            return
+        with self._check_lock:
+            data_version = self._version()
+            if self._stale or (data_version != self._data_version and not self._update(self._conn)):
+                self._reload(self._conn)
+            self._data_version = data_version
+            self._checked = now
+
+    def _version(self):
+        # PRAGMA data_version on this process's connection; call with _check_lock held
+        if self._pid != os.getpid():
+            # a connection cannot cross a fork, and each worker process needs its own
+            self._conn = storage.connect(self.database, check_same_thread=False)
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _after_begin(self, session, transaction, connection):
+        # The writer's transactions start with BEGIN IMMEDIATE, so no other connection can commit until this one has
+        # committed or rolled back: whether the posts are up to date now is whether they will be after the commit.
+        session.info.pop('recent_posts_current', None)
+        if not self.size or self._stale or self._data_version is None:
+            return
+        with self._check_lock:
+            session.info['recent_posts_current'] = self._version() == self._data_version
+
+    def _after_commit(self, session):
+        # Records this process's commit as seen, if nothing else was committed before it.  A commit by another
+        # process in the moment between this one and the PRAGMA below is taken for ours, and is only noticed with
+        # the next change after it.
+        if not session.info.pop('recent_posts_current', False):
+            return
+        with self._check_lock:
+            if not self._stale and self._pid == os.getpid():
+                self._data_version = self._version()
+
+    def _update(self, conn):
+        # Applies the votes committed elsewhere to the posts held, if the same posts are still the newest; returns
+        # whether they were, and False if the posts have to be reloaded instead
+        with self._lock:
+            ids, posts, complete = self._ids, self._posts, self._complete
+        rows = conn.execute(_VERSIONS, ('' if complete or not ids else ids[0],)).fetchall()
+        if len(rows) != len(ids) or any(post_id != held for (post_id, _), held in zip(rows, ids)):
+            return False
+        changed = [post_id for (post_id, version), post in zip(rows, posts) if version != post.version]
+        if changed:
+            counts = conn.execute(_CHANGED % ','.join('?' * len(changed)), changed).fetchall()
+            with self._lock:
+                for post_id, upvotes, version in counts:
+                    i = bisect.bisect_left(self._ids, post_id)
+                    if i < len(self._ids) and self._ids[i] == post_id:
+                        self._posts[i] = self._posts[i]._replace(upvotes=upvotes, version=version)
+            self.updates.inc(())
+        return True
+
+    def _reload(self, conn):
+        rows = conn.execute(_NEWEST, (self.size + 1,)).fetchall()
+        posts = [RecentPost(*row) for row in reversed(rows[:self.size])]
+        with self._lock:
+            self._ids = [post.post_id for post in posts]
+            self._posts = posts
+            self._complete = len(rows) <= self.size
+            self._stale = False
+        self.reloads.inc(())
@@ -1,6 +1,5 @@
-#!/usr/bin/python2.7
+#!/usr/bin/env python3
 # vim: fileencoding=utf8
-from __future__ import unicode_literals, division
 """
 Author:    Alexander J. Quinn
 Copyright: (c) 2012-2019 Alexander J. Quinn
@@ -21,71 +20,126 @@ License:   MIT License
 
 """
 This module does the same as repr + ast.literal_eval except that it also allows
-datetime.datetime, datetime.date, datetime.time, and datetime.timedelta.
+datetime.datetime, datetime.date, datetime.time, datetime.timedelta, and
+datetime.timezone.
 """
-from ast import parse, walk, Attribute, Call, Dict, Expr, Load, Module, Name, Num, Str, List, Tuple
-import datetime, types
-
-# To make eval more safe, we pass it a minimal globals/locals dict with only
-# the datetime module.  To deny access to __builtins__, we must pass it an
-# empty module in place of __builtins__.  According to the documentation for
-# eval(..), if we didn't do that, then eval(..) would substitute in the old
-# __builtin__ module.  (Note:  The normal module is called "__builtin__" but is
-# under __builtins__ with an "s" in the globals() dict.)
-_dummy_builtins_module = types.ModuleType(str("dummy_builtins_module"))
-_minimal_globals_for_safe_eval = {
-	"__builtins__" : _dummy_builtins_module,
-	"datetime":datetime,
-	"True" : True,
-	"False" : False,
-	"None" : None,
+import ast, datetime, math
+
+# safe_eval(..) never calls eval(..).  It parses the string once and builds the
+# value directly from the syntax tree, accepting only literals, tuples, lists,
+# dicts, and calls to these constructors (plus datetime.timezone.utc).
+_datetime_constructors = {
+	"datetime" : datetime.datetime,
+	"date" : datetime.date,
+	"time" : datetime.time,
+	"timedelta" : datetime.timedelta,
+	"timezone" : datetime.timezone,
 }
-_safe_node_types = (Module, Expr, Dict, Str, Attribute, Num, Name, Load, List, Tuple)
-_safe_datetime_module_attributes = ("datetime", "date", "time", "timedelta")
-_simple_types = (int, float, bool, type(None), datetime.datetime, datetime.date, datetime.time, datetime.timedelta, type(b''.decode('ascii')), type(b''))
 
-def safe_eval(s):
-	# Credit:  This function is adapted from a snippet posted by "unutbu" at stackoverflow on 11/21/2010.
-	#          http://stackoverflow.com/a/4236328/500022
+# Exact types only:  the repr of a subclass (e.g., a namedtuple or a
+# markupsafe.Markup) names the subclass and could not be read back.
+_simple_types = frozenset((int, float, bool, type(None), str, bytes, datetime.datetime, datetime.date, datetime.time,
+	datetime.timedelta, datetime.timezone))
+_always_simple_types = _simple_types - {float, datetime.datetime, datetime.time}   # no further checks needed
+
+# safe_repr(..) remembers the repr of values of these types, for which a dict
+# lookup is cheaper than repr(..) (strings and bytes only from a length of
+# _repr_cache_min_length).  The datetime and time types are left out because
+# values that compare equal can have different reprs (same instant in different
+# time zones, or a different fold).  So are floats, because 0.0 == -0.0.
+_repr_caches = {t:{} for t in (str, bytes, int, datetime.date, datetime.timedelta)}
+_repr_cache_size = 4096   # per type; a full cache is emptied and starts over
+_repr_cache_min_length = 64
 
+def safe_eval(s):
 	try:
-		tree=parse(s)
-
-	except SyntaxError:
+		tree = ast.parse(s, mode="eval")
+	except (SyntaxError, ValueError, MemoryError, RecursionError):
 		raise ValueError(s)
-
-	for node in walk(tree):
-		if isinstance(node, _safe_node_types):
-			continue
-
-		if isinstance(node,Call) and \
-			   isinstance(node.func, Attribute) and \
-			   node.func.value.id == "datetime" and \
-			   node.func.attr in _safe_datetime_module_attributes:
-			continue
-
-		raise ValueError(s)
-
-	# For extra caution, we will limit access to __builtins__ or anything else except the datetime module.
-	return eval(s, _minimal_globals_for_safe_eval, _minimal_globals_for_safe_eval)
+	return _value(tree.body, s)
+
+def safe_eval_many(strings):
+	# Decodes a batch of safe_repr(..) strings, e.g., the values of a cache
+	# multi-get.  Parsing them together as the items of one list was tried and
+	# is no faster:  compile(..) dominates and grows with the source either way.
+	return [safe_eval(s) for s in strings]
+
+def _value(node, s):
+	t = type(node)
+	if t is ast.Constant:
+		if node.value is Ellipsis:
+			raise ValueError(s)
+		return node.value
+	elif t is ast.Tuple:
+		return tuple(_value(n, s) for n in node.elts)
+	elif t is ast.List:
+		return [_value(n, s) for n in node.elts]
+	elif t is ast.Dict:
+		if None in node.keys:   # {**other}
+			raise ValueError(s)
+		try:
+			return {_value(k, s):_value(v, s) for (k,v) in zip(node.keys, node.values)}
+		except TypeError:   # unhashable key
+			raise ValueError(s)
+	elif t is ast.UnaryOp and type(node.op) in (ast.USub, ast.UAdd):
+		operand = _value(node.operand, s)
+		if type(operand) not in (int, float, complex):
+			raise ValueError(s)
+		return -operand if type(node.op) is ast.USub else operand
+	elif t is ast.Call and _is_datetime_attribute(node.func) and node.func.attr in _datetime_constructors:
+		args = [_value(n, s) for n in node.args]
+		if any(keyword.arg is None for keyword in node.keywords):   # f(**other)
+			raise ValueError(s)
+		kwargs = {keyword.arg:_value(keyword.value, s) for keyword in node.keywords}
+		try:
+			return _datetime_constructors[node.func.attr](*args, **kwargs)
+		except (TypeError, ValueError, OverflowError):
+			raise ValueError(s)
+	elif t is ast.Attribute and node.attr == "utc" and _is_datetime_attribute(node.value) and node.value.attr == "timezone":
+		return datetime.timezone.utc
+	raise ValueError(s)
+
+def _is_datetime_attribute(node):
+	# True for datetime.<something>
+	return type(node) is ast.Attribute and type(node.value) is ast.Name and node.value.id == "datetime"
 
 def safe_repr(o):
-	if is_simple(o):
+	t = type(o)
+	cache = _repr_caches.get(t)
+	if cache is not None and ((t is not str and t is not bytes) or len(o) >= _repr_cache_min_length):
+		r = cache.get(o)
+		if r is None:
+			if len(cache) >= _repr_cache_size:
+				cache.clear()
+			r = cache[o] = repr(o)
+		return r
+	elif is_simple(o):
 		return repr(o)
 	else:
 		raise ValueError("%r cannot be repr'd in a way that could be safely eval'd with this code."%(o,))
 
 def is_simple(o):
-	if isinstance(o, _simple_types):
+	t = type(o)
+	if t in _simple_types:
+		if t is float:
+			return math.isfinite(o)   # inf and nan have no literal
+		elif t is datetime.datetime or t is datetime.time:
+			return o.tzinfo is None or type(o.tzinfo) is datetime.timezone
+		else:
+			return True
+	elif (t is tuple) or (t is list):  # namedtuples are not allowed
+		for v in o:
+			if type(v) not in _always_simple_types and not is_simple(v):
+				return False
+		return True
+	elif t is dict:
+		for (k,v) in o.items():
+			if (type(k) not in _always_simple_types and not is_simple(k)) or \
+			   (type(v) not in _always_simple_types and not is_simple(v)):
+				return False
 		return True
 	else:
-		t = type(o)
-		if (t is tuple) or (t is list):  # namedtuples are not allowed
-			return all(is_simple(v) for v in o)
-		elif t is dict:
-			return all(is_simple(k) and is_simple(v) for (k,v) in o.iteritems())
-		else:
-			return False
+		return False
 
 def _test():
 	import traceback, collections, datetime
@@ -94,20 +148,48 @@ def _test():
 	good_exprs = (
 		None,
 		3,
+		-3,
 		3.1415,
+		-2.5e-10,
 		True,
+		"i am a string with 'quotes', \"quotes\", a\ttab and a\nnewline",
+		b"i am bytes\x00\xff",
 		("i", "am", "a", "tuple"),
+		("one",),
+		(),
 		["i", "am", "a", "list"],
 		{"my_type":"dict", "my_name":"Tom"},
 		{"nested_tuple":("tuple", "inside"), "nested_list":["list", "inside"], "nested_dict":{"dict":"inside"}},
+		{1:"int key", ("tuple", "key"):None},
 		now,
 		now.time(),
 		now.date(),
 		now - now,
+		datetime.timedelta(days=-1, seconds=5),
+		now.astimezone(datetime.timezone.utc),
+		now.astimezone(datetime.timezone(datetime.timedelta(hours=-5), "EST")),
+		datetime.time(12, 30, tzinfo=datetime.timezone.utc),
 	)
 	bad_exprs = (
 		Foo(1,2,3),
 		{"namedtuple_as_value":Foo(1,2,3)},
+		float("inf"),
+		{1, 2, 3},
+	)
+	bad_strings = (
+		"__import__('os').system('echo hi')",
+		"datetime.datetime.now()",
+		"datetime.__class__",
+		"open('/etc/passwd')",
+		"[1, 2][0]",
+		"1 + 2",
+		"{**{}}",
+		"datetime.timedelta(**{})",
+		"{[]: 1}",
+		"...",
+		"-'a'",
+		"(lambda: 1)()",
+		"",
 	)
 
 	test_num = 0  # will be 1-based
@@ -115,11 +197,9 @@ def _test():
 		for expr in exprs:
 			test_num += 1
 			try:
-				expr == safe_eval( safe_repr(expr) )
+				got_success = expr == safe_eval( safe_repr(expr) )
 			except ValueError:
 				got_success = False
-			else:
-				got_success = True
 
 			if got_success and expect_success:
 				print( "%2d. test success:  %r\n                   got no exception as expected"%(test_num, expr) )
@@ -130,6 +210,22 @@ def _test():
 			else:
 				print( "%2d. test FAILURE:  %r\n                   expected ValueError but got success"%(test_num, expr) )
 
+	for s in bad_strings:
+		test_num += 1
+		try:
+			safe_eval(s)
+		except ValueError:
+			print( "%2d. test success:  %r\n                   got ValueError as expected"%(test_num, s) )
+		else:
+			print( "%2d. test FAILURE:  %r\n                   expected ValueError but got success"%(test_num, s) )
+
+	test_num += 1
+	reprs = [safe_repr(expr) for expr in good_exprs]
+	if safe_eval_many(reprs) == list(good_exprs) and safe_eval_many(["1, 2", "3"]) == [(1, 2), 3]:
+		print( "%2d. test success:  safe_eval_many"%(test_num,) )
+	else:
+		print( "%2d. test FAILURE:  safe_eval_many"%(test_num,) )
+
 	for exprs in (good_exprs, bad_exprs):
 		for expr in exprs:
 			print( repr(expr) )
@@ -0,0 +1,86 @@
+"""
+Full-text search over posts, backed by the posts_fts FTS5 table (see migrations/0006_posts_fts.sql).
+
+posts_fts is keyed on posts.rowid, which VACUUM may renumber, so rebuild the index after a VACUUM.  Databases
+migrated to 0006 are already indexed; rebuild is also the one-shot backfill for a posts table filled by other means.
+
+    python search.py rebuild [database]    reindex every post from the posts table
+"""
+import base64
+import re
+import sys
+
+from markupsafe import Markup, escape
+
+import config
+import storage
+
+TITLE_WEIGHT = 10.0     # bm25 weight of a match in the title relative to one in the content
+SNIPPET_TOKENS = 24     # length of the content excerpt around the matches
+_START, _END = '\x02', '\x03'  # match markers, swapped for <mark> after the text has been escaped
+_CONTROL = re.compile('[\x00-\x1f\x7f-\x9f]')  # never part of a word, and FTS5 fails on a query holding a NUL
+
+_RANK = 'bm25(posts_fts, %r, 1.0)' % TITLE_WEIGHT
+_QUERY = ("SELECT posts.post_id, highlight(posts_fts, 0, '{start}', '{end}'), "
+          "snippet(posts_fts, 1, '{start}', '{end}', '…', {tokens}), posts.username, posts.timestamp, "
+          "posts.upvotes, {rank}, posts_fts.rowid "
+          "FROM posts_fts JOIN posts ON posts.rowid = posts_fts.rowid "
+          "WHERE posts_fts MATCH :match{after} "
+          "ORDER BY {rank}, posts_fts.rowid LIMIT :limit")
+_FORMAT = dict(start=_START, end=_END, tokens=SNIPPET_TOKENS, rank=_RANK)
+QUERY_FIRST = _QUERY.format(after='', **_FORMAT)
+QUERY_AFTER = _QUERY.format(after=' AND (%s, posts_fts.rowid) > (:score, :rowid)' % _RANK, **_FORMAT)
+
+
+def match_expression(text):
+    # FTS5 query for what a user typed: every word must appear, the last one possibly as a prefix.  Words are quoted,
+    # so FTS5 operators and punctuation in the input are searched for rather than interpreted.  Control characters
+    # separate words.
+    words = ['"%s"' % word.replace('"', '""') for word in _CONTROL.sub(' ', text).split()]
+    if not words:
+        return None
+    return ' '.join(words) + '*'
+
+
+def highlight(text):
+    # Escapes text and wraps the matches FTS5 marked in <mark>
+    return Markup(str(escape(text or '')).replace(_START, '<mark>').replace(_END, '</mark>'))
+
+
+def encode_cursor(score, rowid):
+    return base64.urlsafe_b64encode(('%r:%d' % (score, rowid)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # returns (score, rowid), or None if the cursor was not made by encode_cursor
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        score, rowid = decoded.split(':', 1)
+        return float(score), int(rowid)
+    except ValueError:
+        return None
+
+
+def rebuild(path=config.PATH_DATABASE):
+    conn = storage.connect(path)
+    try:
+        count = conn.execute('SELECT count(*) FROM posts').fetchone()[0]
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+        conn.commit()
+        return count
+    finally:
+        conn.close()
+
+
+def _main(argv):
+    if len(argv) < 2 or argv[1] != 'rebuild':
+        print(__doc__.strip())
+        return 2
+    count = rebuild(argv[2] if len(argv) > 2 else config.PATH_DATABASE)
+    print('Indexed %d post(s)' % count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,157 @@
+"""
+Consistent snapshots of the database, exported as one zip archive.
+
+backup() copies the database with the SQLite backup API, PAGES_PER_STEP pages at a time, into a file next to it.  The
+source connection keeps one read transaction open for the whole copy, so the copy is a single point in time: without
+it, every write by another connection would restart the backup.  In WAL mode a reader never blocks writers, and the
+short steps only hold the source while a few pages are copied.  archive() then reads the copy, not the live database,
+and streams a zip of users.tsv and posts.tsv, in the /getTSVfile layout that tsv_import.py reads back, followed by
+manifest.json with the row counts, schema version and timings.  Progress and durations are exposed through
+/metrics.
+
+    python snapshot.py [--database PATH] OUTPUT.zip
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from urllib.request import pathname2url
+
+import config
+import tsv
+from metrics import Gauge, Histogram
+
+PAGES_PER_STEP = 256    # pages copied per backup step
+STEP_SLEEP = 0.005      # seconds between steps, left to other connections
+TABLES = ('users', 'posts')
+
+backup_pages = Gauge('snapshot_backup_pages', 'Pages of the snapshot being copied, total and remaining.', ('state',))
+export_rows = Gauge('snapshot_export_rows', 'Rows written to the archive being exported, per table.', ('table',))
+durations = Histogram('snapshot_duration_seconds', 'Time taken by each phase of a snapshot.', ('phase',),
+                      (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+METRICS = (backup_pages, export_rows, durations)
+
+
+def _read_only(path):
+    # The URI of a read-only connection to the file at path, quoted so that '?', '#' or '%' in it are not taken for
+    # parts of the URI
+    return 'file:%s?mode=ro' % pathname2url(path)
+
+
+def backup(database=config.PATH_DATABASE, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    # Copies database into a new file in the same directory and returns its path; the caller removes it
+    started = time.perf_counter()
+    fd, path = tempfile.mkstemp(prefix='snapshot-', suffix='.db', dir=os.path.dirname(os.path.abspath(database)))
+    os.close(fd)
+    source = sqlite3.connect(_read_only(database), uri=True, isolation_level=None,
+                             timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    target = sqlite3.connect(path, isolation_level=None)
+    try:
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT count(*) FROM sqlite_master').fetchone()  # starts the read transaction
+
+            def progress(status, remaining, total):
+                backup_pages.set(('total',), total)
+                backup_pages.set(('remaining',), remaining)
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            source.execute('COMMIT')
+            # the copy needs no -wal file of its own
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            source.close()
+            target.close()
+    except BaseException:
+        os.remove(path)
+        raise
+    durations.observe(('backup',), time.perf_counter() - started)
+    return path
+
+
+class _Chunks:
+    # Write-only file for zipfile that keeps what is written until take() collects it
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def archive(path, batch_size=1000):
+    # Yields the zip archive of the snapshot at path in chunks, as it is written
+    started = time.perf_counter()
+    conn = sqlite3.connect(_read_only(path), uri=True)
+    out = _Chunks()
+    try:
+        manifest = {
+            'created_at': int(time.time()),
+            'schema_version': conn.execute('SELECT max(version) FROM schema_version').fetchone()[0],
+            'tables': {},
+        }
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for table in TABLES:
+                rows = 0
+                export_rows.set((table,), 0)
+                with zf.open(table + '.tsv', 'w', force_zip64=True) as f:
+                    f.write(tsv.header(table).encode())
+                    cursor = conn.execute(tsv.QUERIES[table])
+                    for batch in iter(lambda: cursor.fetchmany(batch_size), []):
+                        f.write(''.join([tsv.encode_row(row) for row in batch]).encode())
+                        rows += len(batch)
+                        export_rows.set((table,), rows)
+                        yield out.take()
+                manifest['tables'][table] = {'file': table + '.tsv', 'columns': list(tsv.COLUMNS[table]), 'rows': rows}
+            manifest['export_seconds'] = round(time.perf_counter() - started, 3)
+            zf.writestr('manifest.json', json.dumps(manifest, indent=2) + '\n')
+        yield out.take()
+    finally:
+        conn.close()
+    durations.observe(('export',), time.perf_counter() - started)
+
+
+def stream(database=config.PATH_DATABASE):
+    # Takes a snapshot now and returns a generator of its zip archive, which removes the snapshot once it has been
+    # consumed or closed
+    path = backup(database)
+
+    def chunks():
+        try:
+            yield from archive(path)
+        finally:
+            os.remove(path)
+    return chunks()
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=config.PATH_DATABASE)
+    parser.add_argument('output')
+    args = parser.parse_args(argv[1:])
+    started = time.perf_counter()
+    chunks = stream(args.database)
+    print('Copied the database in %.1f s' % (time.perf_counter() - started))
+    size = 0
+    with open(args.output, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+    print('Wrote %s (%d bytes) in %.1f s' % (args.output, size, time.perf_counter() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
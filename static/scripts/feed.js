@@ -0,0 +1,49 @@
+// Loads feed pages from /api/feed in place instead of reloading the whole page.  The NEWER/OLDER links stay plain
+// links, so the feed still works without this script or if the API call fails.
+
+function pageURL(cards, direction, cursor) {
+	const params = new URLSearchParams();
+	if (cards.data('sort') !== 'new') {
+		params.set('sort', cards.data('sort'));
+	}
+	params.set(direction, cursor);
+	return location.pathname + '?' + params.toString();
+}
+
+function loadPage(url, push) {
+	const cards = $('#cards');
+	$.ajax({
+		url : '/api/feed' + new URL(url, location.href).search,
+		dataType: 'json',
+		success : function(page) {
+			// Each card comes rendered by the server from post_card.html, as on the feed page itself
+			cards.empty();
+			page.posts.forEach(function(post) {
+				cards.append(post.card, '<br>');
+			});
+			$('.feed-empty').toggleClass('d-none', page.posts.length !== 0);
+			$('.feed-newer').attr('href', page.newer ? pageURL(cards, 'newer', page.newer) : '').toggleClass('d-none', !page.newer);
+			$('.feed-older').attr('href', page.older ? pageURL(cards, 'older', page.older) : '').toggleClass('d-none', !page.older);
+			$('.feed-top').toggleClass('d-none', page.posts.length <= 3);
+			watchVotes();
+			if (push) {
+				history.pushState(null, '', url);
+			}
+			window.scrollTo(0, 0);
+		},
+		error : function(xhr) {
+			console.log(xhr);
+			location.href = url;
+		}
+	});
+}
+
+$(document).ready(function(){
+	$(document).on('click', '.feed-nav', function(event) {
+		event.preventDefault();
+		loadPage(this.href, true);
+	});
+	window.addEventListener('popstate', function() {
+		loadPage(location.href, false);
+	});
+});
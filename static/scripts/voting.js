@@ -1,51 +1,99 @@
 
 
-$(document).ready(function(){
-	$('.upvote').click(function() {
-		console.log('Ajax called');
-		console.log($(this).data('postid'));
-		const postID = $(this).data('postid');
-		$.ajax({
-			url : '/upvote',
-			type : 'POST',
-			contentType: 'application/json;charset=UTF-8',
-			dataType: "json",
-			data : JSON.stringify({'postid' : $(this).data('postid')}),
-			success : function(response) {
-				console.log(response);
-				if (response.status === 'success'){
-					console.log("Got that update!!!!!!!!!!");
-					document.getElementById(postID).innerHTML ='&nbsp;<strong>' + response.upvotes.toString() + '</strong>&nbsp;';
-				}
-
-			},
-			error : function(xhr) {
-				console.log(xhr);
+function showVote(postID, vote) {
+	$('.upvote[data-postid="' + postID + '"]').toggleClass('voted', vote === 1);
+	$('.downvote[data-postid="' + postID + '"]').toggleClass('voted', vote === -1);
+}
+
+function showUpvotes(postID, upvotes) {
+	const count = document.getElementById(postID);
+	if (count) {
+		count.innerHTML = '&nbsp;<strong>' + upvotes.toString() + '</strong>&nbsp;';
+	}
+}
+
+function shownVote(postID) {
+	if ($('.upvote[data-postid="' + postID + '"]').hasClass('voted')) {
+		return 1;
+	}
+	return $('.downvote[data-postid="' + postID + '"]').hasClass('voted') ? -1 : 0;
+}
+
+// Shows message for seconds at the bottom of the page, replacing any message shown before
+function showVoteMessage(message, seconds) {
+	let alert = $('#vote-message');
+	if (alert.length === 0) {
+		alert = $('<div id="vote-message" class="alert alert-warning fixed-bottom m-3" role="alert">').appendTo('body');
+	}
+	alert.text(message).removeClass('d-none');
+	clearTimeout(alert.data('timeout'));
+	alert.data('timeout', setTimeout(function() { alert.addClass('d-none'); }, seconds * 1000));
+}
+
+// Sends a click on a vote button.  The button lights up at once; once the server answers it shows the server's vote
+// and count, and if the click was not counted it goes back to how it was before.
+function vote(postID, direction) {
+	const before = shownVote(postID);
+	showVote(postID, before === direction ? 0 : direction);
+	$.ajax({
+		url : direction === 1 ? '/upvote' : '/downvote',
+		type : 'POST',
+		contentType: 'application/json;charset=UTF-8',
+		dataType: "json",
+		data : JSON.stringify({'postid' : postID}),
+		success : function(response) {
+			if (response.status === 'success') {
+				showUpvotes(postID, response.upvotes);
+				showVote(postID, response.vote);
+			} else {
+				// 'duplicate': an earlier click on the same button is still being handled, and its answer will
+				// show the outcome; 'no post found': the post has been deleted
+				showVote(postID, before);
 			}
-		});
+		},
+		error : function(xhr) {
+			console.log(xhr);
+			showVote(postID, before);
+			if (xhr.status === 429) {
+				const seconds = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 1;
+				showVoteMessage('You are voting too fast. Try again in ' + seconds +
+					(seconds === 1 ? ' second.' : ' seconds.'), seconds);
+			}
+		}
 	});
+}
 
-	$('.downvote').click(function() {
-		console.log('Ajax called');
-		console.log($(this).data('postid'));
-		const postID = $(this).data('postid');
-		$.ajax({
-			url : '/downvote',
-			type : 'POST',
-			contentType: 'application/json;charset=UTF-8',
-			dataType: "json",
-			data : JSON.stringify({'postid' : $(this).data('postid')}),
-			success : function(response) {
-				console.log(response);
-				if (response.status === 'success'){
-					console.log("Got that update!!!!!!!!!!");
-					document.getElementById(postID).innerHTML ='&nbsp;<strong>' + response.upvotes.toString() + '</strong>&nbsp;';
-				}
-
-			},
-			error : function(xhr) {
-				console.log(xhr);
-			}
+let liveVotes = null;
+
+// Follows the vote counts of the posts on the page through the server's event stream; call again when the cards change
+function watchVotes() {
+	const url = $('meta[name="live-votes"]').attr('content');
+	if (liveVotes) {
+		liveVotes.close();
+		liveVotes = null;
+	}
+	const postIDs = $.unique($('.upvote').map(function() { return $(this).data('postid'); }).get());
+	if (!url || !window.EventSource || postIDs.length === 0) {
+		return;
+	}
+	liveVotes = new EventSource(url + '?posts=' + postIDs.map(encodeURIComponent).join(','));
+	liveVotes.addEventListener('votes', function(event) {
+		const counts = JSON.parse(event.data);
+		Object.keys(counts).forEach(function(postID) {
+			showUpvotes(postID, counts[postID]);
 		});
 	});
+}
+
+$(document).ready(function(){
+	watchVotes();
+
+	// delegated, so that cards loaded in place by feed.js are covered too
+	$(document).on('click', '.upvote', function() {
+		vote($(this).data('postid'), 1);
+	});
+
+	$(document).on('click', '.downvote', function() {
+		vote($(this).data('postid'), -1);
+	});
 });
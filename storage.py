@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+import flask_sqlalchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, scoped_session
+from sqlalchemy.pool import QueuePool
+
+import config
+
+
+class Storage:
+    """SQLite connection setup shared by every process serving the app.
+
+    The database runs in WAL mode so that readers never wait for the writer.  Each process writes through a single
+    connection (Flask-SQLAlchemy's engine, limited to one pooled connection) whose transactions start with BEGIN
+    IMMEDIATE, so concurrent writers queue on busy_timeout instead of failing with "database is locked" half way
+    through.  Views that only read use self.reader, a session over a pool of read-only connections.  Neither engine
+    is created before it is first used, so an app created before forking workers holds no connections.
+    """
+
+    def __init__(self, app=None):
+        self.database = None
+        self._read_engine = None
+        self._lock = threading.Lock()
+        self.reader = scoped_session(lambda: Session(bind=self.read_engine))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Call before db.init_app(app), so that the writer engine is created with these options
+        app.config.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///' + config.PATH_DATABASE)
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'poolclass': QueuePool, 'pool_size': 1, 'max_overflow': 0,
+            'pool_timeout': config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+            'connect_args': {'check_same_thread': False, 'timeout': config.SQLITE_BUSY_TIMEOUT_MS / 1000}})
+        app.config.setdefault('SQLITE_READ_POOL_SIZE', config.SQLITE_READ_POOL_SIZE)
+        # relative paths are taken from the app's root folder, as Flask-SQLAlchemy does
+        self.database = os.path.join(app.root_path, make_url(app.config['SQLALCHEMY_DATABASE_URI']).database)
+        self.read_pool_size = app.config['SQLITE_READ_POOL_SIZE']
+        self._read_engine = None
+        app.teardown_appcontext(self._close_reader)
+
+    @property
+    def read_engine(self):
+        with self._lock:
+            if self._read_engine is None:
+                self._read_engine = create_engine(
+                    'sqlite:///file:%s?mode=ro&uri=true' % pathname2url(self.database), poolclass=QueuePool,
+                    pool_size=self.read_pool_size, max_overflow=0, pool_timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+                    connect_args={'check_same_thread': False, 'timeout': config.SQLITE_BUSY_TIMEOUT_MS / 1000})
+                event.listen(self._read_engine, 'connect', _on_connect_read_only)
+            return self._read_engine
+
+    def _close_reader(self, exception):
+        self.reader.remove()
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    # Flask-SQLAlchemy creates its engine on first use; this makes it the writer described in Storage
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        event.listen(engine, 'connect', _on_connect)
+        event.listen(engine, 'begin', _begin_immediate)
+        return engine
+
+
+_functions = []  # (name, num_params, func) added to every connection
+
+
+def register_function(name, num_params, func):
+    # Makes a Python function callable from SQL on every connection opened from now on
+    _functions.append((name, num_params, func))
+
+
+def apply_pragmas(conn, read_only=False):
+    # Sets up a sqlite3 connection: the config.py pragmas and the functions from register_function.  journal_mode=WAL
+    # is stored in the file, so read-only connections leave it alone.
+    if not read_only:
+        conn.execute('PRAGMA journal_mode=%s' % config.SQLITE_JOURNAL_MODE)
+    conn.execute('PRAGMA synchronous=%s' % config.SQLITE_SYNCHRONOUS)
+    conn.execute('PRAGMA cache_size=%d' % config.SQLITE_CACHE_SIZE)
+    conn.execute('PRAGMA mmap_size=%d' % config.SQLITE_MMAP_SIZE)
+    conn.execute('PRAGMA busy_timeout=%d' % config.SQLITE_BUSY_TIMEOUT_MS)
+    if read_only:
+        conn.execute('PRAGMA query_only=ON')
+    for name, num_params, func in _functions:
+        conn.create_function(name, num_params, func, deterministic=True)
+
+
+def connect(path=None, **kwargs):
+    # A raw sqlite3 connection with the same pragmas, for code that works outside SQLAlchemy
+    conn = sqlite3.connect(path or config.PATH_DATABASE, timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000, **kwargs)
+    apply_pragmas(conn)
+    return conn
+
+
+def _on_connect(dbapi_conn, connection_record):
+    apply_pragmas(dbapi_conn)
+    # pysqlite would otherwise open its own deferred transactions; _begin_immediate emits them instead
+    dbapi_conn.isolation_level = None
+
+
+def _on_connect_read_only(dbapi_conn, connection_record):
+    apply_pragmas(dbapi_conn, read_only=True)
+
+
+def _begin_immediate(conn):
+    conn.exec_driver_sql('BEGIN IMMEDIATE')
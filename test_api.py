@@ -0,0 +1,59 @@
+"""
+The JSON API: feed and post responses and their ETag revalidation.
+
+    python -m pytest test_api.py
+"""
+import json
+
+import storage
+from conftest import POST_IDS
+
+
+def test_api_revalidates_from_indexes(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private3')
+
+    conn = storage.connect(db_path)
+    for url in ('/api/feed', '/api/post/' + POST_IDS[120]):
+        first = client.get(url)
+        assert first.status_code == 200 and first.headers['ETag']
+        del statements[:]
+        again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304 and again.headers['ETag'] == first.headers['ETag']
+        for statement, parameters in statements:
+            plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            assert all('COVERING INDEX' in detail for detail in plan), (statement, plan)
+
+    etag = client.get('/api/post/' + POST_IDS[120]).headers['ETag']
+    client.post('/upvote', data=json.dumps({'postid': POST_IDS[120]}))
+    changed = client.get('/api/post/' + POST_IDS[120], headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and json.loads(changed.data)['vote'] == 1
+
+    page = json.loads(client.get('/api/feed').data)
+    older = json.loads(client.get('/api/feed', query_string={'older': page['older']}).data)
+    assert older['newer']
+    assert not set(post['post_id'] for post in page['posts']) & set(post['post_id'] for post in older['posts'])
+
+
+def test_api_feed_sends_rendered_cards(app_env, logged_in_client, monkeypatch):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private4')
+    first = client.get('/api/feed')
+    page = json.loads(first.data)
+    assert page['posts']
+    for post in page['posts']:
+        assert 'data-postid="%s"' % post['post_id'] in post['card']
+        assert main.time_string(post['timestamp']) + ' by' in post['card']
+
+    # the ETag changes with the cards' time labels, which a 304 would otherwise leave stale
+    monkeypatch.setattr(main, 'time_string', lambda timestamp: 'Posted a while ago')
+    again = client.get('/api/feed', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200 and 'Posted a while ago by' in json.loads(again.data)['posts'][0]['card']
+
+
+def test_time_string_at_one_minute(monkeypatch):
+    import helper
+    monkeypatch.setattr(helper, 'get_timestamp', lambda: 1000)
+    assert helper.time_string(1000 - 59) == 'Posted just now'
+    assert helper.time_string(1000 - 60) == 'Posted 1 minute ago'
+    assert helper.time_string(1000 - 3599) == 'Posted 59 minutes ago'
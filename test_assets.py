@@ -0,0 +1,29 @@
+"""
+Content-hashed static URLs, and the uploads that are served without a hash.
+
+    python -m pytest test_assets.py
+"""
+import os
+
+import flask
+
+from conftest import ROOT
+
+
+def test_static_files_are_hashed_when_linked(app_env):
+    main, app, db_path, statements = app_env
+    client = app.test_client()
+    picture = sorted(name for name in os.listdir(os.path.join(ROOT, 'static', 'img', 'profile_pics'))
+                     if name.endswith('.jpg'))[0]
+    with app.test_request_context():
+        script = flask.url_for('static', filename='scripts/delete_posts.js')
+        upload = flask.url_for('static', filename='img/profile_pics/' + picture)
+    assert '?v=' in script and '?v=' not in upload
+    assert not [name for name in main.assets._versions if name.startswith('img/profile_pics/')]
+
+    response = client.get(script)
+    assert response.status_code == 200 and 'immutable' in response.headers['Cache-Control']
+    response = client.get(upload)
+    assert response.status_code == 200 and response.headers['Cache-Control'] == 'no-cache'
+    assert client.get(upload, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/static/img/profile_pics/missing.jpg').mimetype == 'text/html'  # the not-found page
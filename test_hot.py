@@ -0,0 +1,27 @@
+"""
+The hot feed, ordered by the hot_score column that votes and the periodic refresh keep up to date.
+
+    python -m pytest test_hot.py
+"""
+import json
+import sqlite3
+
+from conftest import POST_IDS
+
+
+def test_hot_feed_follows_votes(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private2')
+
+    main.hot_refresher.refresh(full=True)
+    assert b'/post/%s"' % POST_IDS[150].encode() not in client.get('/private2/feed?sort=hot').data
+    client.post('/upvote', data=json.dumps({'postid': POST_IDS[150]}))
+    main.feed_cache.clear()  # votes leave cached hot pages to expire
+    first_page = client.get('/private2/feed?sort=hot').data.decode()
+    assert first_page.index('/post/%s"' % POST_IDS[150]) < first_page.index('/post/%s"' % POST_IDS[199])
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE posts SET timestamp = timestamp - 30 * 24 * 3600 WHERE post_id = ?', (POST_IDS[150],))
+    conn.commit()
+    main.hot_refresher.refresh(full=True)
+    assert conn.execute('SELECT hot_score FROM posts WHERE post_id = ?', (POST_IDS[150],)).fetchone()[0] == 0
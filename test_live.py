@@ -0,0 +1,79 @@
+"""
+Live vote counts, streamed to subscribed pages as Server-Sent Events.
+
+    python -m pytest test_live.py
+"""
+import json
+import socket
+
+import flask
+import pytest
+
+from conftest import POST_IDS
+from live import LiveVotes
+
+
+@pytest.fixture
+def live_port(app_env):
+    # starts the stream as the first request would, which waits until it is listening
+    main = app_env[0]
+    main.live_votes._start()
+    assert main.live_votes.serving
+    return main.live_votes.port
+
+
+def subscribe(port, post_ids, origin=None):
+    # An open stream watching post_ids, and its response headers
+    stream = socket.create_connection(('127.0.0.1', port), timeout=5)
+    stream.sendall(b'GET /live/votes?posts=%s HTTP/1.1\r\nHost: localhost:%d\r\n%s\r\n'
+                   % (','.join(post_ids).encode(), port, b'Origin: %s\r\n' % origin.encode() if origin else b''))
+    received = b''
+    while b'retry:' not in received:
+        received += stream.recv(4096)
+    assert received.startswith(b'HTTP/1.1 200 OK') and b'text/event-stream' in received
+    return stream, received
+
+
+def wait_for(stream, received, data):
+    while data not in received:
+        received += stream.recv(4096)
+    return received
+
+
+def test_live_votes_stream(app_env, logged_in_client, live_port):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private2')
+
+    assert b'<meta name="live-votes" content="/live/votes">' in client.get('/post/' + POST_IDS[120]).data
+    redirect = client.get('/live/votes?posts=' + POST_IDS[120])
+    assert redirect.status_code == 307
+    assert redirect.headers['Location'] == 'http://localhost:%d/live/votes?posts=%s' % (live_port, POST_IDS[120])
+
+    stream, received = subscribe(live_port, [POST_IDS[120], POST_IDS[121]])
+    with stream:
+        assert b'Access-Control-Allow-Origin' not in received
+        client.post('/upvote', data=json.dumps({'postid': POST_IDS[122]}))
+        upvotes = json.loads(client.post('/upvote', data=json.dumps({'postid': POST_IDS[120]})).data)['upvotes']
+        received = wait_for(stream, received, b'data: {"%s": %d}\n\n' % (POST_IDS[120].encode(), upvotes))
+        assert POST_IDS[122].encode() not in received  # not subscribed to
+
+
+def test_live_votes_origins(live_port):
+    for origin, allowed in (('http://localhost:8001', True), ('https://elsewhere.example', False)):
+        stream, received = subscribe(live_port, [POST_IDS[120]], origin)
+        stream.close()
+        assert (b'Access-Control-Allow-Origin: %s\r\n' % origin.encode() in received) == allowed
+        assert (b'Access-Control-Allow-Origin' in received) == allowed
+
+
+def test_other_workers_publish_to_the_stream(live_port):
+    # a second worker of the same server finds the port taken and sends its votes to the worker serving it
+    worker = LiveVotes(flask.Flask(__name__))
+    worker.config.update(PORT=live_port)
+    worker._start()
+    assert worker.port == live_port and not worker.serving
+
+    stream, received = subscribe(live_port, [POST_IDS[130]])
+    with stream:
+        worker.publish(POST_IDS[130], 42)
+        wait_for(stream, received, b'data: {"%s": 42}\n\n' % POST_IDS[130].encode())
@@ -0,0 +1,35 @@
+"""
+Request and SQL metrics, and the warnings for slow and repeated queries.
+
+    python -m pytest test_metrics.py
+"""
+from conftest import POST_IDS
+
+
+def test_metrics(app_env, logged_in_client, caplog):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private2')
+
+    client.get('/post/' + POST_IDS[120]).close()
+    body = client.get('/metrics').data.decode()
+    assert 'http_request_duration_seconds_count{route="/post/<post_id>",method="GET",status="200"} ' in body
+    assert 'http_request_sql_statements_bucket{route="/post/<post_id>",le="+Inf"} ' in body
+    assert 'sql_statement_duration_seconds_count{kind="SELECT"} ' in body
+
+    thresholds = main.metrics.n_plus_one, main.metrics.slow_query
+    main.metrics.n_plus_one, main.metrics.slow_query = 1, 0
+    try:
+        client.get('/post/' + POST_IDS[120]).close()
+    finally:
+        main.metrics.n_plus_one, main.metrics.slow_query = thresholds
+    messages = [record.getMessage() for record in caplog.records if record.name == 'metrics']
+    assert any(message.startswith('possible N+1 queries route=/post/<post_id> count=1 ') for message in messages)
+    assert any(message.startswith('slow query ms=') and 'route=/post/<post_id>' in message for message in messages)
+
+
+def test_collectors_are_registered_once(app_env):
+    main, app, db_path, statements = app_env
+    main.metrics.register(*main.snapshot.METRICS)
+    body = main.metrics.render()
+    assert body.count('# TYPE snapshot_duration_seconds histogram') == 1
+    assert body.count('# TYPE vote_limiter_requests_total counter') == 1
@@ -0,0 +1,42 @@
+"""
+Time-ordered post ids, and the aliases that keep links to the ids they replaced working.
+
+    python -m pytest test_post_ids.py
+"""
+import json
+
+import helper
+import storage
+
+
+def test_post_ids_are_time_ordered(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private9')
+    conn = storage.connect(db_path)
+    # several posts by one user within the same second no longer collide
+    for i in range(3):
+        client.post('/private8/create-submit', data={'title': 'burst %d' % i, 'content': 'same second'})
+    rows = conn.execute("SELECT post_id, title FROM posts WHERE content = 'same second' ORDER BY post_id").fetchall()
+    assert [title for _, title in rows] == ['burst 0', 'burst 1', 'burst 2']
+    assert all(helper.post_id_time(post_id) for post_id, _ in rows)
+    feed = json.loads(client.get('/api/feed').data)
+    assert [post['title'] for post in feed['posts'][:3]] == ['burst 2', 'burst 1', 'burst 0']
+
+    conn.execute("INSERT INTO post_id_aliases (old_id, post_id) VALUES ('old-hash', ?)", (rows[0][0],))
+    conn.commit()
+    assert client.get('/post/old-hash').headers['Location'].endswith('/post/' + rows[0][0])
+    assert client.get('/api/post/old-hash').status_code == 301
+
+
+def test_bad_cursors_give_the_first_page(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private9')
+    first = json.loads(client.get('/api/feed').data)
+    for cursor in ('garbage', "' OR 1=1 --", 'x' * 1000, first['older'] + '-'):
+        page = client.get('/api/feed', query_string={'older': cursor})
+        assert page.status_code == 200 and json.loads(page.data) == first
+    assert helper.decode_cursor(first['older']) == (first['older'],)
+    score_cursor = helper.encode_cursor(0.5, first['older'])
+    assert helper.decode_cursor(score_cursor, float) == (0.5, first['older'])
+    for bad in (helper.encode_cursor('nan', first['older']), helper.encode_cursor(0.5, 'post1'), score_cursor[:-2]):
+        assert helper.decode_cursor(bad, float) is None
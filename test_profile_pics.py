@@ -0,0 +1,37 @@
+"""
+Profile pictures resized in the background process pool.
+
+    python -m pytest test_profile_pics.py
+"""
+import io
+import time
+from types import SimpleNamespace
+
+
+def test_failed_pictures_are_not_queued_again(app_env, caplog, monkeypatch, tmp_path):
+    main, app, db_path, statements = app_env
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    (tmp_path / 'broken.jpg').write_bytes(b'not a picture')
+    user = SimpleNamespace(profilePicName='broken.jpg')
+    with app.test_request_context():
+        assert 'profile_placeholder.svg' in main.profile_pic(user, 40)['src']  # while it is queued
+    deadline = time.monotonic() + 30
+    while 'broken.jpg' in main.profile_pics_queued and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert 'broken.jpg' not in main.profile_pics_queued and 'broken.jpg' in main.profile_pics_failed
+    assert any(record.getMessage().startswith('Processing broken.jpg failed') for record in caplog.records)
+
+    submitted = []
+    monkeypatch.setattr(main, 'process_profile_pic', submitted.append)
+    with app.test_request_context():
+        assert 'profile_placeholder.svg' in main.profile_pic(user, 40)['src']
+    assert submitted == []
+
+
+def test_registration_refuses_files_that_are_not_pictures(app_env):
+    main, app, db_path, statements = app_env
+    response = app.test_client().post('/login-submit', data={
+        'username': 'notapicture', 'password': 'secret', 'myPic': (io.BytesIO(b'not a picture'), 'me.png')})
+    assert response.status_code == 302 and response.headers['Location'].endswith('/register')
+    with app.app_context():
+        assert main.db.session.query(main.User).filter_by(username='notapicture').first() is None
@@ -0,0 +1,121 @@
+"""
+Runs every route against a small migrated database and checks EXPLAIN QUERY PLAN for each SQL statement it issues,
+so a query that falls back to a full table scan or a temporary sort fails here.
+
+    python -m pytest test_query_plans.py
+"""
+import json
+import os
+import sqlite3
+
+import migrate
+import storage
+from conftest import POST_IDS, ROOT
+
+# Routes that read whole tables on purpose
+FULL_SCAN_ROUTES = {'/getTSVfile/posts', '/getTSVfile/users'}
+# Routes that rank full-text matches, which means sorting them
+RANKED_ROUTES = {'/search', '/api/search'}
+
+
+def plan_problems(conn, statement, parameters, sorting_allowed=False):
+    problems = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters):
+        detail = row[-1]
+        if detail.startswith('SCAN ') and ' USING ' not in detail and 'CONSTANT ROW' not in detail \
+                and 'VIRTUAL TABLE INDEX' not in detail:
+            problems.append(detail)
+        if 'USE TEMP B-TREE' in detail and not sorting_allowed:
+            problems.append(detail)
+    return problems
+
+
+def routes(main):
+    # (method, url, body) for every route, logged in as user0 viewing other users' posts
+    post_id = POST_IDS[1]
+    return [
+        ('GET', '/private0/feed', None),
+        ('GET', '/private0/feed?older=' + main.encode_cursor(POST_IDS[100]), None),
+        ('GET', '/private0/feed?newer=' + main.encode_cursor(POST_IDS[100]), None),
+        ('GET', '/private0/feed/2', None),
+        ('GET', '/private0/feed?sort=hot', None),
+        ('GET', '/private0/feed?sort=hot&older=' + main.encode_cursor(0.01, POST_IDS[100]), None),
+        ('GET', '/private0/profile', None),
+        ('GET', '/private0/profile?older=' + main.encode_cursor(POST_IDS[100]), None),
+        ('GET', '/post/' + post_id, None),
+        ('POST', '/upvote', json.dumps({'postid': post_id})),
+        ('POST', '/downvote', json.dumps({'postid': post_id})),
+        ('POST', '/private0/create-submit', {'title': 'new', 'content': 'post'}),
+        ('POST', '/post/%s/delete' % POST_IDS[0], None),
+        ('GET', '/getTSVfile/posts', None),
+        ('GET', '/getTSVfile/users', None),
+        ('GET', '/api/feed?sort=hot', None),
+        ('GET', '/api/feed?older=' + main.encode_cursor(POST_IDS[100]), None),
+        ('GET', '/api/post/' + post_id, None),
+        ('GET', '/search?q=title', None),
+        ('GET', '/api/search?q=content+1&after=' + main.search.encode_cursor(-1.5, 10), None),
+        ('GET', '/login', None),
+    ]
+
+
+def test_routes_use_indexes(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private0')
+    conn = storage.connect(db_path)  # with the SQL functions the app registers
+    failures = []
+    for method, url, body in routes(main):
+        del statements[:]
+        response = client.open(url, method=method, data=body)
+        response.get_data()
+        assert response.status_code < 500, url
+        if url in FULL_SCAN_ROUTES:
+            continue
+        ranked = url.split('?')[0] in RANKED_ROUTES
+        for statement, parameters in statements:
+            for problem in plan_problems(conn, statement, parameters, sorting_allowed=ranked):
+                failures.append('%s %s: %s\n    %s' % (method, url, problem, statement))
+    conn.close()
+    assert not failures, '\n'.join(failures)
+
+
+def test_hot_refresh_uses_index(app_env):
+    # a pass runs inside the writer's transaction every HOT_REFRESH_SECONDS
+    main, app, db_path, statements = app_env
+    del statements[:]
+    main.hot_refresher.refresh()
+    conn = storage.connect(db_path)
+    failures = [problem for statement, parameters in statements
+                for problem in plan_problems(conn, statement, parameters)]
+    assert statements and not failures, failures
+
+
+def test_schema_sql_matches_migrations(tmp_path):
+    def objects(conn):
+        rows = conn.execute("SELECT type, name, tbl_name FROM sqlite_master "
+                            "WHERE name NOT LIKE 'sqlite_%' AND name != 'schema_version'").fetchall()
+        columns = {table: conn.execute('PRAGMA table_info(%s)' % table).fetchall()
+                   for kind, table, _ in rows if kind == 'table'}
+        return sorted(rows), columns
+
+    migrated = str(tmp_path / 'migrated.db')
+    migrate.upgrade(migrated)
+    from_schema = sqlite3.connect(':memory:')
+    with open(os.path.join(ROOT, 'data', 'schema.sql')) as schema:
+        from_schema.executescript(schema.read())
+    assert objects(sqlite3.connect(migrated)) == objects(from_schema)
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    path = str(tmp_path / 'database.db')
+    assert migrate.upgrade(path) == [version for version, _, _ in migrate.migrations()]
+    assert migrate.upgrade(path) == []
+
+
+def test_models_match_schema(tmp_path):
+    import models
+    path = str(tmp_path / 'database.db')
+    migrate.upgrade(path)
+    conn = sqlite3.connect(path)
+    for model in (models.User, models.Posts):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(%s)' % model.__tablename__)]
+        assert [column.name for column in model.__table__.columns] == columns
@@ -0,0 +1,54 @@
+"""
+The vote limiter: token buckets per user and per post, and collapsed double clicks.
+
+    python -m pytest test_ratelimit.py
+"""
+import json
+
+import storage
+from conftest import POST_IDS
+
+
+def test_vote_limiter(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    conn = storage.connect(db_path)
+    upvotes = conn.execute('SELECT upvotes FROM posts WHERE post_id = ?', (POST_IDS[7],)).fetchone()[0]
+    anonymous = app.test_client().post('/upvote', data=json.dumps({'postid': POST_IDS[7]}))
+    assert b'status' not in anonymous.data
+    assert conn.execute('SELECT upvotes FROM posts WHERE post_id = ?', (POST_IDS[7],)).fetchone()[0] == upvotes
+
+    client = logged_in_client('private5')
+
+    def vote(url):
+        return client.post(url, data=json.dumps({'postid': POST_IDS[7]}))
+    main.vote_limiter.reset()
+    first = json.loads(vote('/upvote').data)
+    assert first['vote'] == 1 and first['upvotes'] == upvotes + 1
+    # a double click answers like the first click instead of taking the vote back
+    assert json.loads(vote('/upvote').data) == first
+    assert json.loads(vote('/downvote').data)['vote'] == -1
+    collapse = main.vote_limiter.collapse
+    main.vote_limiter.collapse = 0
+    try:
+        responses = [vote('/upvote') for _ in range(main.vote_limiter.post_burst - 1)]
+    finally:
+        main.vote_limiter.collapse = collapse
+        main.vote_limiter.reset()
+    assert [response.status_code for response in responses] == [200, 200, 200, 429]
+    assert int(responses[-1].headers['Retry-After']) >= 1
+    assert json.loads(responses[-1].data)['status'] == 'rate limited'
+    assert 'vote_limiter_requests_total{outcome="collapsed"} 1' in client.get('/metrics').data.decode()
+
+
+def test_vote_limiter_bad_and_missing_posts(logged_in_client, app_env):
+    main = app_env[0]
+    client = logged_in_client('private9')
+    for body in ('{"postid": []}', '{"postid": {}}', '[]', 'not json', '{}'):
+        response = client.post('/upvote', data=body)
+        assert response.status_code == 400 and json.loads(response.data)['status'] == 'error', body
+    main.vote_limiter.reset()
+    # a double click on a post that does not exist gets the first click's answer, not "still running"
+    for _ in range(2):
+        assert json.loads(client.post('/upvote', data=json.dumps({'postid': 'no-such-post'})).data) == \
+            {'status': 'no post found'}
+    main.vote_limiter.reset()
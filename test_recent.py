@@ -0,0 +1,117 @@
+"""
+The in-memory recent posts, which have to page exactly like the database they stand in for.
+
+    python -m pytest test_recent.py
+"""
+import json
+import os
+
+import flask
+
+import helper
+import storage
+from conftest import POST_IDS, T0
+from recent import RecentPosts
+
+
+def test_recent_posts_match_database(app_env):
+    main, app, db_path, statements = app_env
+    recent = main.recent_posts
+
+    def from_database(username, cursor, newer):
+        q = main.reader.query(main.Posts).filter(main.Posts.username != username)
+        posts, has_newer, has_older = main.query_page(q, cursor, newer)
+        return [post.post_id for post in posts], has_newer, has_older
+
+    def from_memory(username, cursor, newer):
+        found = recent.page(username, cursor, newer)
+        return found and ([post.post_id for post in found[0]], found[1], found[2])
+
+    with app.app_context():
+        served = 0
+        for username in ('user4', 'nobody'):
+            cursor = None
+            while True:
+                page = from_memory(username, cursor, False)
+                if page is None:
+                    break
+                served += 1
+                assert page == from_database(username, cursor, False)
+                if cursor is not None:
+                    assert from_memory(username, (page[0][0],), True) == from_database(username, (page[0][0],), True)
+                if not page[0]:
+                    break
+                cursor = (page[0][-1],)
+        assert served > 5 and cursor is not None  # the walk ran past the recent posts into the database
+
+        # a post committed by another process shows up on the next page
+        conn = storage.connect(db_path)
+        post_id = helper.new_post_id()
+        conn.execute("INSERT INTO posts (post_id, title, content, username, timestamp, upvotes) "
+                     "VALUES (?, 'elsewhere', '', 'user3', ?, 0)", (post_id, T0 + 3600))
+        conn.commit()
+        assert from_memory('user4', None, False)[0][0] == post_id
+        conn.execute('DELETE FROM posts WHERE post_id = ?', (post_id,))
+        conn.commit()
+        assert from_memory('user4', None, False)[0][0] != post_id
+    assert 'recent_posts_pages_total{source="memory"} ' in app.test_client().get('/metrics').data.decode()
+
+
+def test_own_commits_keep_the_recent_posts(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    recent = main.recent_posts
+    client = logged_in_client('private6')
+    with app.app_context():
+        recent.page('user6')
+    reloads = recent.reloads._values.get((), 0)
+    for post_id in recent._ids[-3:]:
+        client.post('/upvote', data=json.dumps({'postid': post_id}))
+    client.post('/private6/create-submit', data={'title': 'kept', 'content': 'in place'})
+    with app.app_context():
+        posts = recent.page('user7')[0]
+    assert recent.reloads._values.get((), 0) == reloads
+    assert posts[0].title == 'kept' and [post.upvotes for post in posts[1:4]] == [1, 1, 1]
+
+
+def test_created_app_does_not_load(tmp_path):
+    recent = RecentPosts(flask.Flask(__name__), str(tmp_path / 'missing.db'))
+    assert recent._conn is None and not os.listdir(tmp_path)
+
+
+def test_cards_follow_votes_from_other_processes(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private8')
+    conn = storage.connect(db_path)
+    # the first page comes from the recent posts, the deep one from the database and then the feed page cache
+    for url in ('/private8/feed', '/private8/feed?older=' + main.encode_cursor(POST_IDS[20])):
+        post_id = client.get('/api/feed?' + url.partition('?')[2]).get_json()['posts'][0]['post_id']
+        client.get(url)
+        upvotes = conn.execute('SELECT upvotes FROM posts WHERE post_id = ?', (post_id,)).fetchone()[0]
+        conn.execute('UPDATE posts SET upvotes = 42, version = version + 1 WHERE post_id = ?', (post_id,))
+        conn.commit()
+        try:
+            page = client.get(url).data.decode()
+            assert 'id=%s style="float: left">&nbsp;<strong>42</strong>' % post_id in page, url
+        finally:
+            conn.execute('UPDATE posts SET upvotes = ?, version = version + 1 WHERE post_id = ?', (upvotes, post_id))
+            conn.commit()
+
+
+def test_votes_from_other_processes_update_in_place(app_env):
+    main, app, db_path, statements = app_env
+    recent = main.recent_posts
+    with app.app_context():
+        post = recent.page('user9')[0][0]
+        reloads, updates = recent.reloads._values.get((), 0), recent.updates._values.get((), 0)
+        conn = storage.connect(db_path)
+        conn.execute('UPDATE posts SET upvotes = upvotes + 5, version = version + 1 WHERE post_id = ?',
+                     (post.post_id,))
+        conn.commit()
+        assert recent.page('user9')[0][0] == post._replace(upvotes=post.upvotes + 5, version=post.version + 1)
+        # hot score refreshes change no version, and leave the posts alone
+        main.hot_refresher.refresh()
+        recent.page('user9')
+        assert recent.reloads._values.get((), 0) == reloads and recent.updates._values.get((), 0) == updates + 1
+        conn.execute('UPDATE posts SET upvotes = upvotes - 5, version = version + 1 WHERE post_id = ?',
+                     (post.post_id,))
+        conn.commit()
@@ -0,0 +1,43 @@
+"""
+Full-text search over posts, kept in step with posts by triggers.
+
+    python -m pytest test_search.py
+"""
+import json
+import sqlite3
+
+
+def test_search_follows_posts(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private1')
+
+    def search(q, after=None):
+        return json.loads(client.get('/api/search', query_string={'q': q, 'after': after} if after else {'q': q}).data)
+
+    client.post('/private1/create-submit', data={'title': 'Zebra crossing', 'content': 'a <b>striped</b> zebra'})
+    found = search('zebra')['results']
+    assert [result['title'] for result in found] == ['<mark>Zebra</mark> crossing']
+    assert '&lt;b&gt;striped&lt;/b&gt; <mark>zebra</mark>' in found[0]['snippet']
+    assert search('zeb')['results'] and search('"zebra OR')['results'] == []
+
+    seen, after = [], None
+    while True:
+        page = search('content', after)
+        seen += [result['post_id'] for result in page['results']]
+        after = page['next']
+        if after is None:
+            break
+    posts = sqlite3.connect(db_path).execute("SELECT count(*) FROM posts WHERE content LIKE 'content %'").fetchone()[0]
+    assert len(seen) == len(set(seen)) == posts
+
+    client.post('/post/' + found[0]['post_id'] + '/delete')
+    assert search('zebra')['results'] == []
+
+
+def test_search_ignores_control_characters(app_env, logged_in_client):
+    client = logged_in_client('private1')
+    assert json.loads(client.get('/api/search', query_string={'q': '\x00'}).data)['results'] == []
+    for q in ('title\x00', 'title\x1f1', '\x7fcontent'):
+        response = client.get('/api/search', query_string={'q': q})
+        assert response.status_code == 200 and json.loads(response.data)['results'], repr(q)
+    assert client.get('/search', query_string={'q': 'a\x00b'}).status_code == 200
@@ -0,0 +1,41 @@
+"""
+The snapshot export, which has to match the /getTSVfile exports of the same moment.
+
+    python -m pytest test_snapshot.py
+"""
+import io
+import json
+import os
+import zipfile
+
+import migrate
+import snapshot
+
+
+def test_snapshot_matches_exports(app_env, logged_in_client):
+    main, app, db_path, statements = app_env
+    client = logged_in_client('private0')
+    assert client.get('/admin/snapshot').status_code == 403
+    app.config['ADMIN_USERS'] = ('user0',)
+    try:
+        response = client.get('/admin/snapshot')
+    finally:
+        app.config['ADMIN_USERS'] = ()
+    assert response.status_code == 200 and response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    manifest = json.loads(archive.read('manifest.json'))
+    for table in ('users', 'posts'):
+        export = client.get('/getTSVfile/' + table).data
+        assert archive.read(table + '.tsv') == export
+        assert manifest['tables'][table]['rows'] == export.count(b'\n') - 1
+    assert manifest['schema_version'] == max(version for version, _, _ in migrate.migrations())
+    # the copy is removed once the archive has been sent
+    assert not [name for name in os.listdir(os.path.dirname(db_path)) if name.startswith('snapshot-')]
+
+
+def test_snapshot_of_a_path_needing_quotes(tmp_path):
+    path = str(tmp_path / 'data?base #1%20.db')
+    migrate.upgrade(path)
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(snapshot.stream(path))))
+    assert json.loads(archive.read('manifest.json'))['tables']['posts']['rows'] == 0
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('snapshot-')]
@@ -0,0 +1,20 @@
+"""
+The writer and read-only connections of storage.py.
+
+    python -m pytest test_storage.py
+"""
+import flask
+
+import migrate
+import storage
+
+
+def test_reader_opens_paths_needing_quotes(tmp_path):
+    path = str(tmp_path / 'data #1%20.db')
+    migrate.upgrade(path)
+    app = flask.Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    store = storage.Storage(app)
+    with store.read_engine.connect() as conn:
+        assert conn.exec_driver_sql('SELECT count(*) FROM posts').scalar() == 0
+        assert conn.exec_driver_sql('PRAGMA query_only').scalar() == 1
@@ -0,0 +1,63 @@
+"""
+The bulk TSV import, checked against the /getTSVfile exports it reads back.
+
+    python -m pytest test_tsv_import.py
+"""
+import time
+
+import pytest
+
+import hot
+import migrate
+import storage
+import tsv
+import tsv_import
+from conftest import POST_IDS, T0
+
+
+def test_tsv_import_round_trip(app_env, tmp_path):
+    main, app, db_path, statements = app_env
+    client = app.test_client()
+    exports = [(table, client.get('/getTSVfile/' + table).data.decode().splitlines(True))
+               for table in ('users', 'posts')]
+    copy_path = str(tmp_path / 'copy.db')
+    migrate.upgrade(copy_path)
+    conn = storage.connect(copy_path, isolation_level=None)
+    started = int(time.time())
+    assert tsv_import.import_tsv(conn, exports) == {'users': len(exports[0][1]) - 1, 'posts': len(exports[1][1]) - 1}
+
+    original = storage.connect(db_path)
+    for query in ('SELECT post_id, title, content, username, timestamp, upvotes FROM posts ORDER BY post_id',
+                  'SELECT * FROM post_votes ORDER BY post_id, username',
+                  'SELECT username, private_id, post_count FROM users ORDER BY username',
+                  "SELECT post_id FROM posts_fts JOIN posts ON posts.rowid = posts_fts.rowid "
+                  "WHERE posts_fts MATCH 'content' ORDER BY post_id"):
+        assert conn.execute(query).fetchall() == original.execute(query).fetchall()
+    finished = int(time.time())
+    # scored as of a moment during the import; scores only fall as time passes
+    for upvotes, timestamp, hot_score in conn.execute('SELECT upvotes, timestamp, hot_score FROM posts'):
+        assert hot.score(upvotes, timestamp, finished) <= hot_score <= hot.score(upvotes, timestamp, started)
+    assert conn.execute("SELECT v FROM posts_fts_config WHERE k = 'hashsize'").fetchone()[0] == 1024 * 1024
+    assert conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('integrity-check')").fetchall() == []
+    # importing again updates the posts in place
+    version = conn.execute('SELECT version FROM posts WHERE post_id = ?', (POST_IDS[1],)).fetchone()[0]
+    tsv_import.import_tsv(conn, exports[1:])
+    assert conn.execute('SELECT version FROM posts WHERE post_id = ?', (POST_IDS[1],)).fetchone()[0] == version + 1
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+
+
+def test_tsv_import_renames_old_post_ids(tmp_path):
+    path = str(tmp_path / 'database.db')
+    migrate.upgrade(path)
+    conn = storage.connect(path, isolation_level=None)
+    conn.execute("INSERT INTO users (username, private_id, authenticated, hasProfilePic) VALUES ('user0', 'p', 0, 0)")
+    conn.execute("INSERT INTO post_id_aliases (old_id, post_id) VALUES ('old-hash', ?)", (POST_IDS[0],))
+    posts = [tsv.header('posts'), tsv.encode_row(('old-hash', 'title', 'content', 'user0', T0, 1, 'user0', ''))]
+    tsv_import.import_tsv(conn, [('posts.tsv', posts)])
+    assert conn.execute('SELECT post_id, title FROM posts').fetchall() == [(POST_IDS[0], 'title')]
+    assert conn.execute('SELECT post_id, username FROM post_votes').fetchall() == [(POST_IDS[0], 'user0')]
+
+    posts[1] = tsv.encode_row(('an-unknown-hash', 'title', 'content', 'user0', T0, 0, '', ''))
+    with pytest.raises(ValueError, match='an-unknown-hash'):
+        tsv_import.import_tsv(conn, [('posts.tsv', posts)])
+    assert conn.execute('SELECT count(*) FROM posts').fetchone()[0] == 1
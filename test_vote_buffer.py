@@ -0,0 +1,91 @@
+"""
+The write-behind vote buffer and the intent logs that let it recover from a crash.
+
+    python -m pytest test_vote_buffer.py
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import flask
+
+import migrate
+from conftest import POST_IDS, T0
+from vote_buffer import VoteBuffer
+
+
+def test_workers_keep_their_own_logs(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'database.db')
+    migrate.upgrade(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO users (username, private_id, authenticated, hasProfilePic) VALUES (?, ?, 0, 0)',
+                     [('user%d' % i, 'private%d' % i) for i in range(2)])
+    conn.executemany('INSERT INTO posts (post_id, title, content, username, timestamp, upvotes) '
+                     "VALUES (?, '', '', 'user0', ?, 0)", [(POST_IDS[i], T0 + i) for i in range(2)])
+    conn.commit()
+    app = flask.Flask(__name__)
+    app.config.update(VOTE_BUFFER_ENABLED=True, VOTE_BUFFER_FLUSH_MS=3600 * 1000,
+                      VOTE_BUFFER_LOG=str(tmp_path / 'vote_intents.log'))
+
+    def start():
+        buffer = VoteBuffer()
+        buffer.init_app(app, db_path)
+        buffer._start()
+        return buffer
+
+    # two workers of one server: this process and one that will have died
+    child = subprocess.Popen([sys.executable, '-c', ''])
+    child.wait()
+    dead = child.pid
+    running = str(tmp_path / ('vote_intents.log.%d' % os.getppid()))
+    with open(running, 'w') as log:
+        log.write('%s\tuser1\t1\n' % POST_IDS[0])
+    first = start()
+    with monkeypatch.context() as patched:
+        patched.setattr(os, 'getpid', lambda: dead)
+        second = start()
+    first.vote(POST_IDS[0], 'user0', 1)
+    second.vote(POST_IDS[1], 'user1', 1)
+    first.flush()
+    second._pending.clear()  # the second worker dies before flushing
+    assert conn.execute('SELECT post_id FROM post_votes').fetchall() == [(POST_IDS[0],)]
+
+    # the next worker to start replays what the dead one acknowledged, and leaves the running worker's log alone
+    start()
+    assert sorted(conn.execute('SELECT post_id, username FROM post_votes').fetchall()) == \
+        [(POST_IDS[0], 'user0'), (POST_IDS[1], 'user1')]
+    assert conn.execute('SELECT upvotes FROM posts WHERE post_id = ?', (POST_IDS[1],)).fetchone()[0] == 1
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith('vote_intents.log')) == \
+        sorted([os.path.basename(running), 'vote_intents.log.%d' % os.getpid()])
+
+
+def test_flush_thread_survives_errors(tmp_path):
+    db_path = str(tmp_path / 'database.db')
+    migrate.upgrade(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (username, private_id, authenticated, hasProfilePic) VALUES ('user0', 'p', 0, 0)")
+    conn.executemany('INSERT INTO posts (post_id, title, content, username, timestamp, upvotes) '
+                     "VALUES (?, '', '', 'user0', ?, 0)", [(POST_IDS[i], T0 + i) for i in range(2)])
+    conn.commit()
+    app = flask.Flask(__name__)
+    app.config.update(VOTE_BUFFER_ENABLED=True, VOTE_BUFFER_FLUSH_MS=10,
+                      VOTE_BUFFER_LOG=str(tmp_path / 'vote_intents.log'))
+    buffer = VoteBuffer()
+    buffer.init_app(app, db_path)
+    flushed = []
+
+    def listener(post_ids):
+        flushed.extend(post_ids)
+        if len(flushed) == 1:
+            raise RuntimeError('first flush fails')
+    buffer.add_flush_listener(listener)
+    buffer._start()
+    for post_id in POST_IDS[:2]:
+        buffer.vote(post_id, 'user0', 1)
+        deadline = time.monotonic() + 5
+        while post_id not in flushed and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert flushed == POST_IDS[:2]
+    assert conn.execute('SELECT count(*) FROM post_votes').fetchone()[0] == 2
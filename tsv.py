@@ -0,0 +1,59 @@
+# Layout of the /getTSVfile exports: one header line, then one line per row with tab-separated fields.  Tabs,
+# newlines and backslashes inside a field are written as \t, \n and \\ so that every row stays on one line.
+import re
+
+COLUMNS = {
+    'posts': ('post_id', 'title', 'content', 'username', 'timestamp', 'upvotes', 'upvoters', 'downvoters'),
+    'users': ('username', 'private_id', 'authenticated', 'hasProfilePic', 'profilePicName'),
+}
+
+# The query that reads each export's rows, in COLUMNS order
+QUERIES = {
+    'posts': "SELECT post_id, title, content, username, timestamp, upvotes, "
+             "coalesce((SELECT group_concat(v.username) FROM post_votes v WHERE v.post_id = posts.post_id AND v.direction = 1), ''), "
+             "coalesce((SELECT group_concat(v.username) FROM post_votes v WHERE v.post_id = posts.post_id AND v.direction = -1), '') "
+             "FROM posts",
+    'users': "SELECT username, private_id, "
+             "CASE authenticated WHEN 1 THEN 'True' WHEN 0 THEN 'False' END, "
+             "CASE hasProfilePic WHEN 1 THEN 'True' WHEN 0 THEN 'False' END, "
+             "profilePicName FROM users",
+}
+
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def escape(value) -> str:
+    return str(value).translate(_ESCAPES)
+
+
+def header(table: str) -> str:
+    return '\t'.join(COLUMNS[table]) + '\n'
+
+
+def encode_row(row) -> str:
+    return '\t'.join([escape(value) for value in row]) + '\n'
+
+
+_UNESCAPES = {'\\\\': '\\', '\\t': '\t', '\\n': '\n', '\\r': '\r'}
+_ESCAPED = re.compile(r'\\.')
+
+
+def unescape(field: str) -> str:
+    if '\\' not in field:
+        return field
+    return _ESCAPED.sub(lambda match: _UNESCAPES.get(match.group(0), match.group(0)), field)
+
+
+def table_for_header(line: str):
+    # The table whose export starts with this header line, or None
+    for table in COLUMNS:
+        if line.rstrip('\n') == '\t'.join(COLUMNS[table]):
+            return table
+    return None
+
+
+def decode_row(line: str) -> list:
+    fields = line.rstrip('\n').split('\t')
+    if '\\' in line:
+        fields = [unescape(field) for field in fields]
+    return fields
@@ -0,0 +1,179 @@
+"""
+Bulk import of the TSV files written by /getTSVfile/<table>, the inverse of the export.  Each file's header line
+says which table it holds.  Rows are upserted on their primary key in batches of BATCH, all files in one
+transaction.  The secondary indexes and the triggers on posts are dropped for the duration and recreated at the end.
+What the triggers maintain row by row is then rebuilt in one pass each: the search index and users.post_count.
+Imported posts are given their hot score as they are parsed.  An imported post's voters replace its rows in
+post_votes, and a post that already existed has its version bumped, so API ETags change with it.  A post exported
+before migration 0009 gave it a time-ordered id is imported under its new id, found in post_id_aliases; one with an
+old id that is not there is refused.
+
+    python tsv_import.py [--database PATH] FILE [FILE ...]
+"""
+import argparse
+import sys
+import time
+
+import config
+import helper
+import hot
+import storage
+import tsv
+
+BATCH = 50000  # rows per executemany
+# Memory the search index rebuild may fill before writing a segment, instead of FTS5's default of 1 MiB: with fewer,
+# larger segments to merge the rebuild takes less than half as long
+FTS_HASHSIZE = 64 * 1024 * 1024
+
+_UPSERT = {
+    'users': 'INSERT INTO users (username, private_id, authenticated, hasProfilePic, profilePicName) '
+             'VALUES (?, ?, ?, ?, ?) ON CONFLICT (username) DO UPDATE SET private_id = excluded.private_id, '
+             'authenticated = excluded.authenticated, hasProfilePic = excluded.hasProfilePic, '
+             'profilePicName = excluded.profilePicName',
+    'posts': "INSERT INTO posts (post_id, title, content, username, timestamp, upvotes, hot_score, upvoters, "
+             "downvoters) VALUES (?, ?, ?, ?, ?, ?, ?, '', '') ON CONFLICT (post_id) DO UPDATE SET "
+             "title = excluded.title, content = excluded.content, username = excluded.username, "
+             "timestamp = excluded.timestamp, upvotes = excluded.upvotes, hot_score = excluded.hot_score, "
+             "version = version + 1",
+}
+_BOOLEANS = {'True': 1, 'False': 0, 'None': None}
+
+
+def _user(fields, now):
+    username, private_id, authenticated, has_profile_pic, profile_pic_name = fields
+    # the export writes NULLs as None
+    return (username, private_id, _BOOLEANS[authenticated], _BOOLEANS[has_profile_pic],
+            None if profile_pic_name == 'None' else profile_pic_name)
+
+
+def _post(fields, now):
+    post_id, title, content, username, timestamp, upvotes, upvoters, downvoters = fields
+    timestamp, upvotes = int(timestamp), int(upvotes)
+    return post_id, title, content, username, timestamp, upvotes, hot.score(upvotes, timestamp, now)
+
+
+def _votes(fields):
+    post_id, upvoters, downvoters = fields[0], fields[6], fields[7]
+    return ([(post_id, username, 1) for username in upvoters.split(',') if username] +
+            [(post_id, username, -1) for username in downvoters.split(',') if username])
+
+
+def _batches(table, lines, name, now):
+    # Yields lists of BATCH decoded rows, posts scored as of now; a malformed line raises ValueError naming it
+    convert = _user if table == 'users' else _post
+    batch, votes = [], []
+    for number, line in enumerate(lines, 2):
+        try:
+            fields = tsv.decode_row(line)
+            batch.append(convert(fields, now))
+            if table == 'posts':
+                votes.extend(_votes(fields))
+        except (ValueError, KeyError):
+            raise ValueError('%s line %d is not a %s row' % (name, number, table))
+        if len(batch) == BATCH:
+            yield batch, votes
+            batch, votes = [], []
+    if batch:
+        yield batch, votes
+
+
+def _import(conn, lines, name, progress, now):
+    lines = iter(lines)
+    table = tsv.table_for_header(next(lines, ''))
+    if table is None:
+        raise ValueError('%s does not start with the header of a /getTSVfile export' % name)
+    count = 0
+    for batch, votes in _batches(table, lines, name, now):
+        if table == 'posts':
+            batch, votes = _rename(conn, batch, votes, name)
+        conn.executemany(_UPSERT[table], batch)
+        if table == 'posts':
+            conn.executemany('DELETE FROM post_votes WHERE post_id = ?', [row[:1] for row in batch])
+            conn.executemany('INSERT OR REPLACE INTO post_votes (post_id, username, direction) VALUES (?, ?, ?)',
+                             votes)
+        count += len(batch)
+        if progress:
+            progress(name, table, count)
+    return table, count
+
+
+def _rename(conn, batch, votes, name):
+    # Gives the posts and votes of a batch that still use ids from before migration 0009 their new ids
+    old_ids = {row[0] for row in batch if not helper.is_post_id(row[0])}
+    if not old_ids:
+        return batch, votes
+    renamed = {}
+    for old_id in old_ids:
+        row = conn.execute('SELECT post_id FROM post_id_aliases WHERE old_id = ?', (old_id,)).fetchone()
+        if row is None:
+            raise ValueError('%s holds post %s, whose id is from before migration 0009 and has no alias'
+                             % (name, old_id))
+        renamed[old_id] = row[0]
+    return ([(renamed.get(row[0], row[0]),) + row[1:] for row in batch],
+            [(renamed.get(vote[0], vote[0]),) + vote[1:] for vote in votes])
+
+
+def import_tsv(conn, sources, progress=None):
+    # Imports every (name, lines) in sources, lines being an export read line by line, through the sqlite3
+    # connection conn (in autocommit mode, as from storage.connect(path, isolation_level=None)).  progress(name,
+    # table, rows) is called after each batch.  Returns {table: rows imported}; nothing is imported if any file fails.
+    deferred = conn.execute("SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND "
+                            "((type = 'index' AND tbl_name IN ('users', 'posts', 'post_votes')) OR "
+                            "(type = 'trigger' AND tbl_name = 'posts'))").fetchall()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for kind, name, sql in deferred:
+            conn.execute('DROP %s "%s"' % (kind.upper(), name))
+        counts = {}
+        now = int(time.time())
+        for name, lines in sources:
+            table, count = _import(conn, lines, name, progress, now)
+            counts[table] = counts.get(table, 0) + count
+        for kind, _, sql in deferred:
+            if kind == 'index':
+                conn.execute(sql)
+        conn.execute('UPDATE users SET post_count = (SELECT count(*) FROM posts WHERE posts.username = users.username)')
+        if counts.get('posts'):
+            hashsize = conn.execute("SELECT v FROM posts_fts_config WHERE k = 'hashsize'").fetchone()
+            conn.execute("INSERT INTO posts_fts (posts_fts, rank) VALUES ('hashsize', ?)", (FTS_HASHSIZE,))
+            conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+            conn.execute("INSERT INTO posts_fts (posts_fts, rank) VALUES ('hashsize', ?)",
+                         (hashsize[0] if hashsize else 1024 * 1024,))
+        for kind, _, sql in deferred:
+            if kind == 'trigger':
+                conn.execute(sql)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return counts
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=config.PATH_DATABASE)
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv[1:])
+    started = time.perf_counter()
+
+    def progress(name, table, rows):
+        elapsed = time.perf_counter() - started
+        print('%s: %d %s (%.0f rows/s)' % (name, rows, table, rows / elapsed if elapsed else 0))
+    files = [open(path, encoding='utf-8', newline='') for path in args.files]
+    conn = storage.connect(args.database, isolation_level=None)
+    try:
+        counts = import_tsv(conn, [(f.name, f) for f in files], progress)
+    except ValueError as e:
+        print(e)
+        return 1
+    finally:
+        conn.close()
+        for f in files:
+            f.close()
+    print('Imported %s in %.1f s' % (', '.join('%d %s' % (rows, table) for table, rows in counts.items()),
+                                     time.perf_counter() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
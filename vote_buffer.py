@@ -0,0 +1,205 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import config
+import hot  # registers the hot_score() SQL function used by flush()
+import storage
+
+log = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """Write-behind buffer for votes.
+
+    Each vote records the user's latest intent for a post (1, -1 or 0 for no vote) in memory and answers with the
+    projected upvote count straight away.  Intents are flushed to post_votes/posts in a single transaction every
+    VOTE_BUFFER_FLUSH_MS milliseconds or once VOTE_BUFFER_MAX_PENDING intents are waiting.  Every intent is appended
+    to a log before it is acknowledged, so a crash loses nothing that was answered.  Each worker process appends to a
+    log of its own, VOTE_BUFFER_LOG followed by its pid, and empties it after each flush.  On startup a worker claims
+    the logs of workers that are no longer running by renaming them, which only one worker can do for each log, and
+    replays them.  Flushing an intent sets the stored vote rather than applying a relative change, which makes
+    replaying an already-flushed log harmless.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}                  # (post_id, username) -> direction
+        self._deltas = defaultdict(int)     # post_id -> projected change to posts.upvotes
+        self._conn = None
+        self._log = None
+        self._flush_listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, database=None):
+        app.config.setdefault('VOTE_BUFFER_ENABLED', False)
+        app.config.setdefault('VOTE_BUFFER_FLUSH_MS', 250)
+        app.config.setdefault('VOTE_BUFFER_MAX_PENDING', 200)
+        app.config.setdefault('VOTE_BUFFER_LOG', config.PATH_VOTE_LOG)
+        app.config.setdefault('VOTE_BUFFER_FSYNC', False)
+        self.enabled = app.config['VOTE_BUFFER_ENABLED']
+        if not self.enabled:
+            return
+        self.flush_interval = app.config['VOTE_BUFFER_FLUSH_MS'] / 1000
+        self.max_pending = app.config['VOTE_BUFFER_MAX_PENDING']
+        self.fsync = app.config['VOTE_BUFFER_FSYNC']
+        self.database = database or config.PATH_DATABASE
+        self.log_path = app.config['VOTE_BUFFER_LOG']
+        # started by the first request rather than here, so that each forked worker gets its own thread and connection
+        app.before_request(self._start)
+
+    def _start(self):
+        if self._log is not None:
+            return
+        with self._start_lock:
+            if self._log is not None:
+                return
+            self._conn = storage.connect(self.database, check_same_thread=False, isolation_level=None)
+            self._replay(self._claim_logs())
+            self._log = open('%s.%d' % (self.log_path, os.getpid()), 'a')
+            threading.Thread(target=self._run, name='vote-buffer', daemon=True).start()
+            atexit.register(self.flush)
+
+    def vote(self, post_id, username, direction):
+        # Same contract as main.cast_vote: returns (projected upvotes, new direction), or None if there is no post.
+        with self._lock:
+            row = self._conn.execute('SELECT upvotes FROM posts WHERE post_id = ?', (post_id,)).fetchone()
+            if row is None:
+                return None
+            current = self._current(post_id, username)
+            new_direction = 0 if current == direction else direction
+            self._log.write('%s\t%s\t%d\n' % (post_id, username, new_direction))
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            self._pending[post_id, username] = new_direction
+            self._deltas[post_id] += new_direction - current
+            upvotes = row[0] + self._deltas[post_id]
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.set()
+        return upvotes, new_direction
+
+    def add_flush_listener(self, listener):
+        # listener(post_ids) is called after each flush with the posts whose counts were written
+        self._flush_listeners.append(listener)
+
+    def pending_vote(self, post_id, username):
+        # The buffered direction for this user and post, or None if nothing is waiting to be flushed.
+        return self._pending.get((post_id, username))
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            post_ids = {post_id for post_id, _ in self._pending}
+            votes = self._pending
+            now = int(time.time())
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for (post_id, username), direction in votes.items():
+                    stored = cursor.execute('SELECT direction FROM post_votes WHERE post_id = ? AND username = ?',
+                                            (post_id, username)).fetchone()
+                    stored = stored[0] if stored else 0
+                    if stored == direction:
+                        continue
+                    cursor.execute('UPDATE posts SET upvotes = upvotes + ?, version = version + 1, '
+                                   'hot_score = hot_score(upvotes + ?, timestamp, ?) WHERE post_id = ?',
+                                   (direction - stored, direction - stored, now, post_id))
+                    if cursor.rowcount == 0:
+                        continue  # the post was deleted while the vote was buffered
+                    if direction:
+                        cursor.execute('INSERT INTO post_votes (post_id, username, direction) VALUES (?, ?, ?) '
+                                       'ON CONFLICT (post_id, username) DO UPDATE SET direction = excluded.direction',
+                                       (post_id, username, direction))
+                    else:
+                        cursor.execute('DELETE FROM post_votes WHERE post_id = ? AND username = ?', (post_id, username))
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            self._pending = {}
+            self._deltas.clear()
+            if self._log is not None:
+                self._log.truncate(0)
+        for listener in self._flush_listeners:
+            listener(post_ids)
+
+    def _current(self, post_id, username):
+        if (post_id, username) in self._pending:
+            return self._pending[post_id, username]
+        row = self._conn.execute('SELECT direction FROM post_votes WHERE post_id = ? AND username = ?',
+                                 (post_id, username)).fetchone()
+        return row[0] if row else 0
+
+    def _claim_logs(self):
+        # Renames the logs of workers that are no longer running to names owned by this process, and returns them in
+        # the order they were last written.  A log is named VOTE_BUFFER_LOG.<pid>, and claiming one puts this process's
+        # pid in front of that suffix, so the logs of a worker that dies while replaying are claimed in turn.
+        directory, name = os.path.split(os.path.abspath(self.log_path))
+        claimed = []
+        for entry in os.listdir(directory):
+            if entry == name:
+                owner = None  # the single log shared by every worker before they had their own
+            elif entry.startswith(name + '.') and entry[len(name) + 1:].split('.', 1)[0].isdigit():
+                owner = int(entry[len(name) + 1:].split('.', 1)[0])
+            else:
+                continue
+            if owner is not None and owner != os.getpid() and _running(owner):
+                continue
+            path = os.path.join(directory, entry)
+            target = '%s.%d.%s' % (os.path.join(directory, name), os.getpid(), entry[len(name) + 1:] or 'shared')
+            try:
+                os.rename(path, target)
+                claimed.append((os.path.getmtime(target), target))
+            except FileNotFoundError:
+                continue  # claimed by another worker starting at the same time
+        return [path for _, path in sorted(claimed)]
+
+    def _replay(self, paths):
+        for path in paths:
+            with open(path) as log:
+                for line in log:
+                    try:
+                        post_id, username, direction = line.rstrip('\n').split('\t')
+                        self._pending[post_id, username] = int(direction)
+                    except ValueError:
+                        continue  # torn final write from a crash
+        # intents logged before migration 0009 gave their posts new ids
+        for (post_id, username), direction in list(self._pending.items()):
+            renamed = self._conn.execute('SELECT post_id FROM post_id_aliases WHERE old_id = ?', (post_id,)).fetchone()
+            if renamed is not None:
+                del self._pending[post_id, username]
+                self._pending[renamed[0], username] = direction
+        self.flush()
+        for path in paths:
+            os.remove(path)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.OperationalError:
+                continue  # database is busy; the intents stay buffered and logged until the next attempt
+            except Exception:
+                log.exception('Vote buffer flush failed')
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # a process of another user
+    return True